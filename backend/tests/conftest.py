@@ -0,0 +1,33 @@
+"""Imports the app against throwaway storage
+
+Settings are read when the module is imported, so the environment is set
+up here, before any test module imports it.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+_storage = Path(tempfile.mkdtemp(prefix="fastnas-tests-"))
+os.environ["NAS_BASE_DIR"] = str(_storage / "files")
+os.environ["NAS_DATA_DIR"] = str(_storage / "data")
+(_storage / "files").mkdir()
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import v2_main_use_this as nas  # noqa: E402
+
+
+@pytest.fixture
+def base_dir() -> Path:
+    return nas.get_settings().BASE_DIR
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+
+    return TestClient(nas.app)
@@ -0,0 +1,19 @@
+"""Columnar listings sort by the sizes they report"""
+
+import os
+
+import v2_main_use_this as nas
+
+
+def test_size_sort_uses_logical_size(base_dir):
+    folder = base_dir / "sorted"
+    folder.mkdir()
+    (folder / "random.txt").write_bytes(os.urandom(2000))
+    (folder / "text.txt").write_bytes(b"compress me " * 1000)
+    assert nas.compress_file_at_rest(folder / "text.txt")
+    assert (folder / "text.txt").stat().st_size < 2000  # Stored smaller
+
+    listing = nas.list_directory_columnar(folder, "sorted", "size", "asc")
+    columns = listing["columns"]
+    assert columns["name"] == ["random.txt", "text.txt"]
+    assert columns["size"] == [2000, 12000]
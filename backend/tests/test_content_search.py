@@ -0,0 +1,24 @@
+"""Content search snippets are safe to render as HTML"""
+
+import v2_main_use_this as nas
+
+
+def test_snippet_escapes_document_markup(base_dir):
+    folder = base_dir / "notes"
+    folder.mkdir()
+    (folder / "evil.txt").write_text(
+        'budget <img src=x onerror="alert(1)"> report & summary'
+    )
+    assert nas.index_document(nas.get_content_db(), "notes/evil.txt")
+
+    [result] = nas.search_content("budget", None, 10)
+    snippet = result["snippet"]
+    assert "<img" not in snippet
+    assert "&lt;img src=x onerror=&quot;alert(1)&quot;&gt;" in snippet
+    assert "&amp; summary" in snippet
+    assert snippet.startswith("<mark>budget</mark>")
+
+
+def test_stray_sentinels_do_not_leave_unbalanced_marks():
+    snippet = nas.highlight_snippet("a\x03 <b> \x02word\x03 \x02tail")
+    assert snippet == "a &lt;b&gt; <mark>word</mark> tail"
@@ -0,0 +1,99 @@
+"""Delta sync: signature -> patch -> apply reproduces the new version"""
+
+import hashlib
+import os
+import struct
+import zlib
+
+import v2_main_use_this as nas
+
+BLOCK_SIZE = nas.get_settings().DELTA_MIN_BLOCK_SIZE
+
+
+def encode_patch(signature: dict, new: bytes) -> bytes:
+    """Block-aligned patch script: copy blocks the server has, send the rest"""
+    block_size = signature["block_size"]
+    known = {
+        (weak, strong): index
+        for index, (weak, strong) in enumerate(signature["blocks"])
+    }
+    ops = []
+    for offset in range(0, len(new), block_size):
+        block = new[offset : offset + block_size]
+        key = (zlib.adler32(block), hashlib.blake2b(block, digest_size=16).hexdigest())
+        if key in known:
+            ops.append(nas.DELTA_OP_COPY + struct.pack(">QI", known[key], 1))
+        else:
+            ops.append(nas.DELTA_OP_DATA + struct.pack(">I", len(block)) + block)
+    return b"".join(ops) + nas.DELTA_OP_END
+
+
+def apply(client, path: str, patch: bytes, etag: str, checksum: str):
+    return client.post(
+        f"/api/delta/patch/{path}",
+        params={"block_size": BLOCK_SIZE, "checksum": checksum},
+        headers={"If-Match": etag},
+        content=patch,
+    )
+
+
+def test_patch_reproduces_target(client, base_dir):
+    old = os.urandom(BLOCK_SIZE * 8 + 100)
+    # Edit a block in the middle, drop one, and append new data
+    new = (
+        old[: BLOCK_SIZE * 2]
+        + os.urandom(BLOCK_SIZE)
+        + old[BLOCK_SIZE * 4 :]
+        + os.urandom(500)
+    )
+    (base_dir / "delta.txt").write_bytes(old)
+
+    response = client.get(
+        "/api/delta/signature/delta.txt", params={"block_size": BLOCK_SIZE}
+    )
+    assert response.status_code == 200
+    signature = response.json()
+    patch = encode_patch(signature, new)
+    assert len(patch) < len(new)
+
+    checksum = hashlib.sha256(new).hexdigest()
+    response = apply(client, "delta.txt", patch, signature["etag"], checksum)
+    assert response.status_code == 200, response.text
+    assert response.json()["checksum"] == checksum
+    assert hashlib.sha256((base_dir / "delta.txt").read_bytes()).hexdigest() == (
+        checksum
+    )
+
+
+def test_patch_rejects_stale_base(client, base_dir):
+    (base_dir / "stale.txt").write_bytes(os.urandom(BLOCK_SIZE))
+    signature = client.get(
+        "/api/delta/signature/stale.txt", params={"block_size": BLOCK_SIZE}
+    ).json()
+    os.utime(base_dir / "stale.txt", ns=(0, 0))
+
+    new = b"replacement"
+    response = apply(
+        client,
+        "stale.txt",
+        encode_patch(signature, new),
+        signature["etag"],
+        hashlib.sha256(new).hexdigest(),
+    )
+    assert response.status_code == 412
+
+
+def test_patch_output_is_capped(client, base_dir, monkeypatch):
+    (base_dir / "capped.txt").write_bytes(os.urandom(BLOCK_SIZE))
+    signature = client.get(
+        "/api/delta/signature/capped.txt", params={"block_size": BLOCK_SIZE}
+    ).json()
+    monkeypatch.setattr(nas.get_settings(), "MAX_UPLOAD_SIZE", BLOCK_SIZE * 3)
+
+    # Each op is small, but together they copy the block past the limit
+    copy = nas.DELTA_OP_COPY + struct.pack(">QI", 0, 1)
+    response = apply(
+        client, "capped.txt", copy * 4 + nas.DELTA_OP_END, signature["etag"], "0" * 64
+    )
+    assert response.status_code == 413
+    assert not [p for p in os.listdir(base_dir) if p.endswith(".part")]
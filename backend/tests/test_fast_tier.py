@@ -0,0 +1,72 @@
+"""Fast tier: copies are read safely even while they are being evicted"""
+
+import os
+
+import pytest
+
+import v2_main_use_this as nas
+
+
+@pytest.fixture
+def tier(tmp_path, monkeypatch):
+    tier = nas.FastTier(tmp_path / "ssd", 1024 * 1024, promote_hits=1, policy="lru")
+    monkeypatch.setattr(nas, "get_fast_tier", lambda: tier)
+    yield tier
+    tier._executor.shutdown(wait=True)
+
+
+def promote(client, tier, path: str):
+    assert client.get("/api/download", params={"path": path}).status_code == 200
+    tier._executor.submit(lambda: None).result()  # Wait for the copy
+    assert path in tier._entries
+
+
+def test_download_served_from_copy(client, base_dir, tier):
+    data = os.urandom(100_000)
+    (base_dir / "hot.txt").write_bytes(data)
+    promote(client, tier, "hot.txt")
+
+    response = client.get("/api/download", params={"path": "hot.txt"})
+    assert response.content == data
+    response = client.get(
+        "/api/download", params={"path": "hot.txt"}, headers={"Range": "bytes=10-99"}
+    )
+    assert response.status_code == 206
+    assert response.content == data[10:100]
+    assert tier.served_fast == 2
+
+
+def test_evicted_copy_stays_readable(base_dir, tier, client):
+    data = os.urandom(100_000)
+    (base_dir / "evict.txt").write_bytes(data)
+    promote(client, tier, "evict.txt")
+
+    path = base_dir / "evict.txt"
+    body = nas.iter_tiered_range(path, path.stat(), 0, len(data) - 1)
+    first = next(body)  # The copy is open now
+    with tier._lock:
+        tier._forget("evict.txt")
+    tier._executor.submit(lambda: None).result()
+    assert not tier._copy_path("evict.txt").exists()
+    assert first + b"".join(body) == data
+
+
+def test_unsatisfiable_range_opens_nothing(client, base_dir, tier):
+    (base_dir / "range.txt").write_bytes(b"x" * 1000)
+    promote(client, tier, "range.txt")
+
+    response = client.get(
+        "/api/download", params={"path": "range.txt"}, headers={"Range": "bytes=5000-"}
+    )
+    assert response.status_code == 416
+    assert tier.served_fast == 0
+
+
+def test_missing_copy_falls_back_to_the_original(client, base_dir, tier):
+    data = os.urandom(10_000)
+    (base_dir / "gone.txt").write_bytes(data)
+    promote(client, tier, "gone.txt")
+    tier._copy_path("gone.txt").unlink()
+
+    assert client.get("/api/download", params={"path": "gone.txt"}).content == data
+    assert tier.served_fast == 0
@@ -0,0 +1,125 @@
+"""Virtual fast-start MP4s: moov moved first, chunk offsets still valid"""
+
+import io
+import os
+import struct
+
+import pytest
+
+import v2_main_use_this as nas
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def make_trailing_moov_mp4(path, co64: bool) -> list:
+    """Write ftyp, mdat, moov, free; return the chunks stored in mdat"""
+    chunks = [os.urandom(1000 + i) for i in range(5)]
+    ftyp = box(b"ftyp", b"isom\0\0\2\0isomiso2mp41")
+    offsets = []
+    position = len(ftyp) + 8
+    for chunk in chunks:
+        offsets.append(position)
+        position += len(chunk)
+    if co64:
+        table = box(
+            b"co64", struct.pack(">II", 0, len(offsets)) + struct.pack(">5Q", *offsets)
+        )
+    else:
+        table = box(
+            b"stco", struct.pack(">II", 0, len(offsets)) + struct.pack(">5I", *offsets)
+        )
+    stbl = box(b"stbl", box(b"stsd", b"\0" * 8) + table)
+    trak = box(b"trak", box(b"tkhd", b"\0" * 84) + box(b"mdia", box(b"minf", stbl)))
+    moov = box(b"moov", box(b"mvhd", b"\0" * 100) + trak)
+    path.write_bytes(
+        ftyp + box(b"mdat", b"".join(chunks)) + moov + box(b"free", b"x" * 10)
+    )
+    return chunks
+
+
+def chunk_offsets(f, start: int, end: int) -> list:
+    """Offsets from every stco/co64 table between start and end"""
+    offsets = []
+    for box_type, offset, header_size, size in nas.read_mp4_boxes(f, start, end):
+        payload = offset + header_size
+        if box_type in nas.MP4_CONTAINER_BOXES:
+            offsets += chunk_offsets(f, payload, offset + size)
+        elif box_type in (b"stco", b"co64"):
+            f.seek(payload)
+            _, count = struct.unpack(">II", f.read(8))
+            code = "I" if box_type == b"stco" else "Q"
+            width = struct.calcsize(code)
+            offsets += struct.unpack(f">{count}{code}", f.read(count * width))
+    return offsets
+
+
+@pytest.mark.parametrize("co64", [False, True])
+def test_virtual_file_points_at_the_same_samples(base_dir, co64):
+    path = base_dir / f"trailing-{int(co64)}.mp4"
+    chunks = make_trailing_moov_mp4(path, co64)
+    stat = path.stat()
+
+    layout = nas.faststart_layout_for(path, stat)
+    assert layout is not None
+    assert layout.size == stat.st_size
+    virtual = b"".join(layout.iter_range(path, 0, layout.size - 1, 4096))
+    assert len(virtual) == layout.size
+
+    f = io.BytesIO(virtual)
+    types = [entry[0] for entry in nas.read_mp4_boxes(f, 0, len(virtual))]
+    assert types == [b"ftyp", b"moov", b"mdat", b"free"]
+
+    offsets = chunk_offsets(f, 0, len(virtual))
+    assert len(offsets) == len(chunks)
+    for offset, chunk in zip(offsets, chunks):
+        assert virtual[offset : offset + len(chunk)] == chunk
+
+
+def test_ranges_match_the_whole_virtual_file(base_dir):
+    path = base_dir / "ranges.mp4"
+    make_trailing_moov_mp4(path, co64=False)
+    layout = nas.faststart_layout_for(path, path.stat())
+    virtual = b"".join(layout.iter_range(path, 0, layout.size - 1, 4096))
+
+    for start, end in [
+        (0, 0),
+        (10, 300),
+        (500, 2500),
+        (layout.size - 7, layout.size - 1),
+    ]:
+        assert b"".join(layout.iter_range(path, start, end, 64)) == (
+            virtual[start : end + 1]
+        )
+
+
+def test_fast_start_file_is_left_alone(base_dir):
+    path = base_dir / "already.mp4"
+    ftyp = box(b"ftyp", b"isom\0\0\2\0isom")
+    path.write_bytes(
+        ftyp + box(b"moov", box(b"mvhd", b"\0" * 100)) + box(b"mdat", b"x")
+    )
+    assert nas.faststart_layout_for(path, path.stat()) is None
+
+
+def test_layout_cache_is_bounded_by_moov_bytes(base_dir):
+    layouts = []
+    for i in range(4):
+        path = base_dir / f"cached-{i}.mp4"
+        make_trailing_moov_mp4(path, co64=False)
+        layouts.append(nas.build_faststart_layout(str(path), path.stat().st_size))
+    moov_size = layouts[0].memory_size
+    assert moov_size > 0
+
+    cache = nas.FastStartLayoutCache(max_bytes=moov_size * 2)
+    for i, layout in enumerate(layouts):
+        cache.put((str(i), 0, 0), layout)
+    assert cache.bytes_cached == moov_size * 2
+    assert cache.get(("0", 0, 0)) is nas._NOT_CACHED
+    assert cache.get(("3", 0, 0)) is layouts[3]
+
+    small = nas.FastStartLayoutCache(max_bytes=moov_size - 1)
+    small.put(("big", 0, 0), layouts[0])
+    assert small.get(("big", 0, 0)) is nas._NOT_CACHED
+    assert small.bytes_cached == 0
@@ -0,0 +1,48 @@
+"""Path metadata cache: invalidation and freshness of served files"""
+
+import os
+
+import v2_main_use_this as nas
+
+
+def test_invalidate_drops_the_subtree_and_parent_only(tmp_path):
+    cache = nas.PathMetadataCache(max_entries=100, ttl=60)
+    for name in ["a", "a/x", "a/x/deep", "a/y", "b", "b/z"]:
+        cache.put_stat(tmp_path / name, None)
+
+    cache.invalidate(tmp_path / "a" / "x")
+
+    def cached(name):
+        return cache.get_stat(tmp_path / name) is not nas._NOT_CACHED
+
+    assert not cached("a") and not cached("a/x") and not cached("a/x/deep")
+    assert cached("a/y") and cached("b") and cached("b/z")
+
+
+def test_index_does_not_outlive_entries(tmp_path):
+    cache = nas.PathMetadataCache(max_entries=3, ttl=60)
+    for i in range(10):
+        cache.put_stat(tmp_path / "dir" / f"f{i}", None)
+        cache.put_resolved(tmp_path / "dir" / f"f{i}", tmp_path / "dir" / f"f{i}")
+    assert cache._below[str(tmp_path / "dir")] == {
+        str(tmp_path / "dir" / f"f{i}") for i in (7, 8, 9)
+    }
+
+    cache.invalidate(tmp_path / "dir")
+    assert not cache._below
+    assert cache.metrics()["stat_entries"] == 0
+
+
+def test_download_sees_changes_made_on_disk(client, base_dir):
+    path = base_dir / "changing.txt"
+    path.write_bytes(b"short")
+    assert client.get("/api/download", params={"path": "changing.txt"}).content == (
+        b"short"
+    )
+
+    # Changed behind the server's back, within PATH_CACHE_TTL
+    path.write_bytes(b"a good deal longer")
+    os.utime(path, ns=(0, 10**18))
+    response = client.get("/api/download", params={"path": "changing.txt"})
+    assert response.content == b"a good deal longer"
+    assert response.headers["content-length"] == str(len(b"a good deal longer"))
@@ -0,0 +1,50 @@
+"""Perceptual hashes agree between the photo indexer and the preview pyramid"""
+
+from PIL import Image, ImageDraw
+
+import v2_main_use_this as nas
+
+
+def transparent_png(path):
+    img = Image.new("RGBA", (800, 600), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((100, 100, 500, 500), fill=(200, 30, 30, 255))
+    draw.rectangle((550, 50, 750, 550), fill=(20, 20, 180, 128))
+    img.save(path)
+
+
+def stored_hash(relative_path: str) -> int:
+    return (
+        nas.get_photo_db()
+        .execute("SELECT phash FROM photos WHERE path = ?", (relative_path,))
+        .fetchone()[0]
+    )
+
+
+def test_transparent_image_hashes_match(base_dir):
+    path = base_dir / "logo.png"
+    transparent_png(path)
+    assert nas.index_photo(nas.get_photo_db(), "logo.png")
+    indexed = stored_hash("logo.png")
+
+    with Image.open(path) as img:
+        img = nas.flatten_transparency(img)
+        img.thumbnail((min(nas.get_settings().PREVIEW_SIZES),) * 2)
+        preview = nas.to_sqlite_hash(nas.dhash(img))
+    assert bin((indexed ^ preview) & (2**64 - 1)).count("1") <= 4
+
+    # Rendering previews leaves the indexer's hash in place
+    nas.generate_preview_pyramid(path, "logo.png", "etag-1")
+    assert stored_hash("logo.png") == indexed
+
+
+def test_preview_fills_in_a_missing_hash(base_dir):
+    path = base_dir / "missing.png"
+    transparent_png(path)
+    conn = nas.get_photo_db()
+    nas.index_photo(conn, "missing.png")
+    with conn:
+        conn.execute("UPDATE photos SET phash = NULL WHERE path = 'missing.png'")
+
+    nas.generate_preview_pyramid(path, "missing.png", "etag-1")
+    assert stored_hash("missing.png") is not None
@@ -0,0 +1,87 @@
+"""Symlinks in the share are only followed into the pool's volumes"""
+
+import os
+import shutil
+
+import pytest
+
+import v2_main_use_this as nas
+
+
+@pytest.fixture
+def pool_volume(tmp_path, monkeypatch):
+    volume = (tmp_path / "pool").resolve()
+    volume.mkdir()
+    monkeypatch.setattr(nas.get_settings(), "POOL_VOLUMES", [volume])
+    nas.get_path_cache().clear()
+    yield volume
+    nas.get_path_cache().clear()
+
+
+@pytest.fixture
+def folder(base_dir, tmp_path, pool_volume):
+    """A folder in the share for one test, removed with its links afterwards"""
+    path = base_dir / tmp_path.name
+    path.mkdir()
+    yield path
+    shutil.rmtree(path)
+
+
+def download(client, path: str):
+    return client.get("/api/download", params={"path": path})
+
+
+def test_symlink_out_of_share_is_denied(client, folder, tmp_path):
+    secret = tmp_path / "secret.txt"
+    secret.write_text("not shared")
+    (folder / "escape.txt").symlink_to(secret)
+    (folder / "escape-dir").symlink_to(tmp_path, target_is_directory=True)
+
+    assert download(client, f"{folder.name}/escape.txt").status_code == 403
+    assert download(client, f"{folder.name}/escape-dir/secret.txt").status_code == 403
+    response = client.get("/api/files", params={"path": f"{folder.name}/escape-dir"})
+    assert response.status_code == 403
+    assert download(client, "../secret.txt").status_code == 403
+
+
+def test_symlink_into_pool_volume_is_served(client, base_dir, folder, pool_volume):
+    data = pool_volume / folder.name / "movie.txt"
+    data.parent.mkdir()
+    data.write_text("pooled bytes")
+    (folder / "movie.txt").symlink_to(data)
+
+    response = download(client, f"{folder.name}/movie.txt")
+    assert response.status_code == 200
+    assert response.content == b"pooled bytes"
+
+    # Reaching the volume by any other route than its share path is refused
+    assert download(client, os.path.relpath(data, base_dir)).status_code == 403
+
+
+def test_pool_volume_link_chain_cannot_escape(client, folder, tmp_path, pool_volume):
+    secret = tmp_path / "secret.txt"
+    secret.write_text("not shared")
+    (pool_volume / "hop.txt").symlink_to(secret)
+    (folder / "chained.txt").symlink_to(pool_volume / "hop.txt")
+
+    assert download(client, f"{folder.name}/chained.txt").status_code == 403
+
+
+def test_new_file_is_written_to_its_pool_volume(
+    client, folder, pool_volume, monkeypatch
+):
+    settings = nas.get_settings()
+    monkeypatch.setattr(settings, "POOL_PLACEMENT", "by_extension")
+    monkeypatch.setattr(settings, "POOL_EXTENSION_MAP", {".txt": str(pool_volume)})
+    path = f"{folder.name}/notes.txt"
+
+    response = client.put(f"/api/files/{path}", content=b"on the pool")
+    assert response.status_code == 200, response.text
+
+    link = folder / "notes.txt"
+    assert link.is_symlink()
+    assert link.resolve() == pool_volume / path
+    assert download(client, path).content == b"on the pool"
+
+    assert client.delete(f"/api/delete/{path}").status_code == 200
+    assert not (pool_volume / path).exists()
@@ -0,0 +1,34 @@
+"""The profiling token only works as a header and is never stored"""
+
+import json
+
+import pytest
+
+import v2_main_use_this as nas
+
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setattr(nas.get_settings(), "PROFILING_TOKEN", "s3cret-token")
+    return "s3cret-token"
+
+
+def test_query_token_does_not_profile(client, token):
+    response = client.get("/health", params={"_profile": token})
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+
+    response = client.get("/api/profiles", params={"_profile": token})
+    assert response.status_code == 403
+
+
+def test_stored_query_drops_profile_parameter(client, token):
+    response = client.get(
+        "/health?detail=1&_profile=leaked", headers={"X-Profile-Token": token}
+    )
+    profile_id = response.headers["x-profile-id"]
+
+    meta = nas.profiles_dir() / f"{profile_id}.json"
+    stored = json.loads(meta.read_text())
+    assert stored["query"] == "detail=1"
+    assert "leaked" not in meta.read_text()
@@ -0,0 +1,150 @@
+"""Snapshots keep old versions, can be browsed and restored, and are pruned"""
+
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+import v2_main_use_this as nas
+
+
+def put(client, path: str, body: bytes, overwrite: bool = False):
+    response = client.put(
+        f"/api/files/{path}", content=body, params={"overwrite": overwrite}
+    )
+    assert response.status_code == 200, response.text
+
+
+def make_folder(client, name: str):
+    response = client.post(
+        "/api/folders/create", json={"folder_path": "", "folder_name": name}
+    )
+    assert response.status_code == 200, response.text
+
+
+def take_snapshot(client) -> int:
+    response = client.post("/api/snapshots")
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+
+def download(client, path: str, snapshot=None):
+    params = {"path": path}
+    if snapshot is not None:
+        params["snapshot"] = snapshot
+    return client.get("/api/download", params=params)
+
+
+def test_overwrite_keeps_the_snapshot_version(client):
+    make_folder(client, "cow")
+    put(client, "cow/doc.txt", b"first version")
+    snapshot = take_snapshot(client)
+
+    put(client, "cow/doc.txt", b"second, longer version", overwrite=True)
+
+    assert download(client, "cow/doc.txt").content == b"second, longer version"
+    old = download(client, "cow/doc.txt", snapshot)
+    assert old.status_code == 200
+    assert old.content == b"first version"
+
+    listing = client.get("/api/files", params={"path": "cow", "snapshot": snapshot})
+    assert listing.status_code == 200
+    [item] = listing.json()["items"]
+    assert (item["name"], item["file_size"]) == ("doc.txt", len(b"first version"))
+
+
+def test_restore_brings_back_deleted_and_changed_files(client, base_dir):
+    make_folder(client, "restore")
+    put(client, "restore/keep.txt", b"original")
+    put(client, "restore/gone.txt", b"deleted later")
+    snapshot = take_snapshot(client)
+
+    put(client, "restore/keep.txt", b"edited", overwrite=True)
+    assert client.delete("/api/delete/restore/gone.txt").status_code == 200
+    put(client, "restore/new.txt", b"created after the snapshot")
+
+    response = client.post(
+        f"/api/snapshots/{snapshot}/restore", params={"path": "restore"}
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["files"] == 2
+
+    assert (base_dir / "restore/keep.txt").read_bytes() == b"original"
+    assert (base_dir / "restore/gone.txt").read_bytes() == b"deleted later"
+    assert (base_dir / "restore/new.txt").exists()  # Newer files are left alone
+
+    # The restored copy is independent of the snapshot's version
+    put(client, "restore/keep.txt", b"edited again", overwrite=True)
+    assert download(client, "restore/keep.txt", snapshot).content == b"original"
+
+
+def test_snapshot_store_is_not_reachable(client, base_dir):
+    take_snapshot(client)
+    assert (base_dir / nas.SNAPSHOT_STORE_NAME).is_dir()
+
+    names = [item["name"] for item in client.get("/api/files").json()["items"]]
+    assert nas.SNAPSHOT_STORE_NAME not in names
+    response = client.get("/api/files", params={"path": nas.SNAPSHOT_STORE_NAME})
+    assert response.status_code == 403
+    response = client.delete(f"/api/delete/{nas.SNAPSHOT_STORE_NAME}?force=true")
+    assert response.status_code == 403
+
+
+def test_unknown_snapshot_is_404(client):
+    assert client.get("/api/files", params={"snapshot": 999999}).status_code == 404
+    assert download(client, "cow/doc.txt", 999999).status_code == 404
+
+
+@pytest.fixture
+def keep(monkeypatch):
+    settings = nas.get_settings()
+
+    def apply(hourly: int, daily: int):
+        monkeypatch.setattr(settings, "SNAPSHOT_KEEP_HOURLY", hourly)
+        monkeypatch.setattr(settings, "SNAPSHOT_KEEP_DAILY", daily)
+
+    return apply
+
+
+def test_retention_keeps_newest_and_one_per_day(keep):
+    day = 86400
+    now = datetime(2024, 6, 12, 12).timestamp()  # Local noon
+    snapshots = [
+        (1, now - 2 * day),
+        (2, now - 2 * day + 3600),
+        (3, now - day),
+        (4, now - 3600),
+        (5, now),
+    ]
+    keep(hourly=2, daily=2)
+    # Newest two, plus the newest of each of the two latest days
+    assert nas.snapshots_to_keep(snapshots) == {3, 4, 5}
+
+    keep(hourly=0, daily=0)
+    assert nas.snapshots_to_keep(snapshots) == {5}  # Newest is always kept
+
+
+def test_prune_drops_versions_only_old_snapshots_used(client, keep):
+    make_folder(client, "prune")
+    put(client, "prune/data.txt", b"old bytes")
+    old_snapshot = take_snapshot(client)
+    old_object = (
+        nas.get_snapshot_db()
+        .execute(
+            "SELECT object FROM snapshot_entries WHERE path = ? AND first_snapshot <= ?"
+            " ORDER BY first_snapshot DESC",
+            ("prune/data.txt", old_snapshot),
+        )
+        .fetchone()[0]
+    )
+    put(client, "prune/data.txt", b"new bytes", overwrite=True)
+    new_snapshot = take_snapshot(client)
+
+    keep(hourly=1, daily=0)
+    assert nas.prune_snapshots() >= 1
+
+    ids = [s["id"] for s in client.get("/api/snapshots").json()["snapshots"]]
+    assert ids == [new_snapshot]
+    assert not Path(old_object).exists()
+    assert download(client, "prune/data.txt", new_snapshot).content == b"new bytes"
+    assert download(client, "prune/data.txt", old_snapshot).status_code == 404
@@ -0,0 +1,128 @@
+"""Chunked upload sessions assemble files, refuse bad chunks and expire"""
+
+import hashlib
+
+import pytest
+
+import v2_main_use_this as nas
+
+CONTENT = bytes(range(256)) * 40  # 10240 bytes
+
+
+@pytest.fixture
+def folder(base_dir):
+    path = base_dir / "sessions"
+    path.mkdir(exist_ok=True)
+    return path
+
+
+def start(client, path: str, size: int = len(CONTENT), **params) -> str:
+    response = client.post(
+        "/api/uploads/sessions", params={"path": path, "size": size, **params}
+    )
+    assert response.status_code == 201, response.text
+    return response.json()["upload_id"]
+
+
+def send(client, upload_id: str, offset: int, body: bytes, **headers):
+    return client.put(
+        f"/api/uploads/sessions/{upload_id}",
+        params={"offset": offset},
+        content=body,
+        headers=headers,
+    )
+
+
+def complete(client, upload_id: str, **params):
+    return client.post(f"/api/uploads/sessions/{upload_id}/complete", params=params)
+
+
+def test_chunks_in_any_order_assemble_the_file(client, base_dir, folder):
+    upload_id = start(client, "sessions/whole.txt")
+    session = nas.upload_sessions[upload_id]
+    assert session.tmp_path.parent == base_dir / nas.UPLOAD_TMP_DIR_NAME
+
+    for offset in (8192, 0, 4096):
+        response = send(client, upload_id, offset, CONTENT[offset : offset + 4096])
+        assert response.status_code == 200, response.text
+
+    response = complete(client, upload_id, sha256=hashlib.sha256(CONTENT).hexdigest())
+    assert response.status_code == 200, response.text
+    assert (folder / "whole.txt").read_bytes() == CONTENT
+    assert not session.tmp_path.exists()
+    assert upload_id not in nas.upload_sessions
+
+
+def test_incomplete_upload_reports_missing_ranges(client, folder):
+    upload_id = start(client, "sessions/partial.txt")
+    send(client, upload_id, 1000, CONTENT[1000:3000])
+    send(client, upload_id, 2000, CONTENT[2000:5000])  # Overlaps are fine
+
+    response = complete(client, upload_id)
+    assert response.status_code == 400
+    assert response.json()["message"]["missing"] == [[0, 1000], [5000, len(CONTENT)]]
+    assert not (folder / "partial.txt").exists()
+    assert upload_id in nas.upload_sessions  # The client can still fill the gaps
+
+
+def test_bad_chunks_are_rejected(client):
+    upload_id = start(client, "sessions/bad.txt")
+    assert send(client, upload_id, len(CONTENT) - 10, b"x" * 11).status_code == 416
+    assert send(client, upload_id, -1, b"x").status_code == 416
+    response = send(client, upload_id, 0, b"abc", **{"Content-Length": "+3"})
+    assert response.status_code == 400
+    assert send(client, "no-such-session", 0, b"x").status_code == 404
+
+
+def test_checksum_mismatch_drops_the_session(client, folder):
+    upload_id = start(client, "sessions/corrupt.txt")
+    send(client, upload_id, 0, CONTENT)
+    tmp_path = nas.upload_sessions[upload_id].tmp_path
+
+    response = complete(client, upload_id, sha256="0" * 64)
+    assert response.status_code == 400
+    assert not tmp_path.exists()
+    assert not (folder / "corrupt.txt").exists()
+    assert complete(client, upload_id).status_code == 404
+
+
+def test_sessions_never_write_outside_the_share(client):
+    response = client.post(
+        "/api/uploads/sessions", params={"path": "../outside.txt", "size": 10}
+    )
+    assert response.status_code == 403
+    response = client.post(
+        "/api/uploads/sessions",
+        params={"path": f"{nas.UPLOAD_TMP_DIR_NAME}/sneaky.txt", "size": 10},
+    )
+    assert response.status_code == 403
+
+
+def test_idle_sessions_expire(client, monkeypatch):
+    idle = start(client, "sessions/idle.txt")
+    busy = start(client, "sessions/busy.txt")
+    idle_tmp = nas.upload_sessions[idle].tmp_path
+    nas.upload_sessions[busy].active_writes = 1
+
+    monkeypatch.setattr(nas.get_settings(), "UPLOAD_SESSION_TTL", -1)
+    nas.expire_upload_sessions()
+
+    assert idle not in nas.upload_sessions
+    assert not idle_tmp.exists()
+    assert busy in nas.upload_sessions  # A chunk is still being written
+
+    nas.upload_sessions[busy].active_writes = 0
+    assert client.delete(f"/api/uploads/sessions/{busy}").status_code == 200
+
+
+def test_startup_clears_leftover_temp_files(base_dir):
+    leftover = base_dir / nas.UPLOAD_TMP_DIR_NAME / ".crashed.txt.abc.part"
+    leftover.parent.mkdir(exist_ok=True)
+    leftover.write_bytes(b"\0" * 100)
+    kept = base_dir / "sessions" / ".kept.txt.part"  # Not in the temp folder
+    kept.parent.mkdir(exist_ok=True)
+    kept.write_bytes(b"user data")
+
+    assert nas.remove_stale_upload_parts() >= 1
+    assert not leftover.exists()
+    assert kept.exists()
@@ -0,0 +1,46 @@
+"""ZIP members: untrusted content is downloaded, corrupt data is not served"""
+
+import struct
+import zipfile
+import zlib
+
+import pytest
+
+
+def extract(client, archive: str, member: str):
+    return client.get(f"/api/zip/extract/{archive}", params={"member": member})
+
+
+def test_html_member_is_an_attachment(client, base_dir):
+    with zipfile.ZipFile(base_dir / "site.zip", "w") as archive:
+        archive.writestr("evil.html", "<script>alert(1)</script>")
+        archive.writestr("logo.svg", "<svg onload='alert(1)'/>")
+        archive.writestr("photo.png", b"\x89PNG\r\n\x1a\n")
+
+    for member in ("evil.html", "logo.svg"):
+        response = extract(client, "site.zip", member)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/octet-stream"
+        assert response.headers["content-disposition"].startswith("attachment;")
+        assert response.headers["x-content-type-options"] == "nosniff"
+
+    response = extract(client, "site.zip", "photo.png")
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["content-disposition"].startswith("inline;")
+    assert response.headers["x-content-type-options"] == "nosniff"
+
+
+def test_crc_mismatch_aborts_the_response(client, base_dir):
+    content = b"hello world " * 1000
+    with zipfile.ZipFile(
+        base_dir / "corrupt.zip", "w", compression=zipfile.ZIP_DEFLATED
+    ) as archive:
+        archive.writestr("notes.txt", content)
+    # Change the recorded CRC in both the local and the central header
+    data = (base_dir / "corrupt.zip").read_bytes()
+    crc = struct.pack("<I", zlib.crc32(content))
+    assert data.count(crc) == 2
+    (base_dir / "corrupt.zip").write_bytes(data.replace(crc, b"\0\0\0\0"))
+
+    with pytest.raises(zipfile.BadZipFile):
+        extract(client, "corrupt.zip", "notes.txt")
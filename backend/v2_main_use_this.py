@@ -1,3 +1,7 @@
+import time
+
+_import_started = time.perf_counter()
+
 from fastapi import (
     FastAPI,
     HTTPException,
@@ -8,30 +12,91 @@ from fastapi import (
     Header,
     BackgroundTasks,
     status,
+    Query,
+)
+from fastapi.responses import (
     HTMLResponse,
+    Response,
+    FileResponse,
+    StreamingResponse,
+    JSONResponse,
 )
-from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, BinaryIO, Union
 import mimetypes
 import os
-from PIL import Image
+import stat as stat_module
 import io
+import base64
 from pydantic import BaseModel, Field, field_validator
 import shutil
+import tempfile
 import hashlib
+import math
+import struct
+import zlib
+import re
+import zipfile
+import gzip
+import lzma
 import logging
+import cProfile
+import pstats
+import sys
 import json
+import html
+from urllib.parse import parse_qsl, quote, urlencode
 from contextlib import asynccontextmanager
 import asyncio
 from functools import lru_cache
-import time
+import importlib
+import itertools
 import secrets
-from collections import defaultdict
+from email.utils import formatdate, parsedate_to_datetime
+from collections import OrderedDict, defaultdict, deque
 from datetime import timedelta, datetime
 import threading
+import sqlite3
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+
+# Cold-start timings in ms, reported by GET /api/startup
+startup_timing: Dict[str, float] = {}
+
+
+def _elapsed_ms(since: float) -> float:
+    return round((time.perf_counter() - since) * 1000, 1)
+
+
+class LazyModule:
+    """Stand-in that imports a module on first attribute access
+
+    Keeps heavy subsystems such as Pillow off the cold-start path; the
+    lifespan warmup imports them in the background shortly after startup.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+Image = LazyModule("PIL.Image")
+
+
+@lru_cache()
+def optional_import(name: str):
+    """An optional dependency (numpy, orjson), imported on first use; else None"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
 
 # ============================================================================
 # CONFIGURATION & SETTINGS
@@ -64,19 +129,138 @@ class Settings(BaseModel):
     ]
     THUMBNAIL_SIZE: int = 200
     CHUNK_SIZE: int = 8192  # 8KB for streaming
+    # Upload writes are coalesced into blocks of this size (sequential I/O)
+    WRITE_BLOCK_SIZE: int = int(os.getenv("WRITE_BLOCK_SIZE", 4 * 1024 * 1024))
+    # Concurrent disk writers; 1 suits a single spinning disk
+    MAX_DISK_WRITERS: int = int(os.getenv("MAX_DISK_WRITERS", 1))
+    # Uploads stop reading their request body once this much is queued
+    MAX_BUFFERED_UPLOAD_BYTES: int = int(
+        os.getenv("MAX_BUFFERED_UPLOAD_BYTES", 64 * 1024 * 1024)
+    )
+    # Delta sync block size bounds (bytes); default is ~sqrt(file size)
+    DELTA_MIN_BLOCK_SIZE: int = 2048
+    DELTA_MAX_BLOCK_SIZE: int = 1024 * 1024
+    # Seconds between scans for changes made outside the API (0 disables)
+    JOURNAL_SCAN_INTERVAL: int = int(os.getenv("JOURNAL_SCAN_INTERVAL", 300))
+    # Journal entries older than this are dropped; older cursors must resync
+    JOURNAL_RETENTION_DAYS: int = int(os.getenv("JOURNAL_RETENTION_DAYS", 30))
+    # Optional transparent compression of compressible file types at rest
+    COMPRESS_AT_REST: bool = os.getenv("COMPRESS_AT_REST", "false").lower() == "true"
+    COMPRESSIBLE_EXTENSIONS: List[str] = [".txt", ".doc", ".docx", ".log", ".csv"]
+    # Minimum fraction of space a file must save to be stored compressed
+    COMPRESSION_MIN_SAVING: float = float(os.getenv("COMPRESSION_MIN_SAVING", 0.15))
+    # Full-text content index (text, .docx and simple PDFs)
+    CONTENT_INDEX_EXTENSIONS: List[str] = [
+        ".txt",
+        ".log",
+        ".csv",
+        ".md",
+        ".docx",
+        ".pdf",
+    ]
+    CONTENT_INDEX_MAX_CHARS: int = 1_000_000  # Per document
+    # Seconds between index updates (0 disables content indexing)
+    CONTENT_INDEX_INTERVAL: int = int(os.getenv("CONTENT_INDEX_INTERVAL", 60))
+    # Seconds between photo (EXIF) index updates (0 disables photo indexing)
+    PHOTO_INDEX_INTERVAL: int = int(os.getenv("PHOTO_INDEX_INTERVAL", 60))
+    # Threads hashing files during a duplicate scan
+    DUPLICATE_HASH_WORKERS: int = int(os.getenv("DUPLICATE_HASH_WORKERS", 4))
+    # Per route class: concurrent requests, waiting requests, max wait (s)
+    ADMISSION_LIMITS: Dict[str, Dict[str, float]] = {
+        "streaming": {"max_concurrent": 32, "max_queue": 64, "max_wait": 2.0},
+        "metadata": {"max_concurrent": 16, "max_queue": 64, "max_wait": 5.0},
+        "heavy_cpu": {"max_concurrent": 2, "max_queue": 32, "max_wait": 15.0},
+        "bulk_io": {"max_concurrent": 4, "max_queue": 16, "max_wait": 30.0},
+        **json.loads(os.getenv("ADMISSION_LIMITS", "{}")),
+    }
     ENABLE_AUTH: bool = os.getenv("ENABLE_AUTH", "false").lower() == "true"
     API_KEY: str = os.getenv("API_KEY", "your-secret-api-key-change-this")
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     RATE_LIMIT_REQUESTS: int = 100  # requests per minute
     RATE_LIMIT_WINDOW: int = 60  # seconds
-
-    @field_validator("BASE_DIR")
+    MAX_BATCH_THUMBNAILS: int = int(os.getenv("MAX_BATCH_THUMBNAILS", 500))
+    # Server-side state (preview cache, indexes) lives outside the share
+    DATA_DIR: Path = Path(os.getenv("NAS_DATA_DIR", Path.home() / ".fastnas"))
+    PREVIEW_SIZES: List[int] = [
+        int(s) for s in os.getenv("PREVIEW_SIZES", "64,200,1280").split(",")
+    ]
+    # Extra data volumes pooled behind BASE_DIR (os.pathsep-separated paths)
+    POOL_VOLUMES: List[Path] = Field(
+        default=[
+            Path(p) for p in os.getenv("NAS_POOL_VOLUMES", "").split(os.pathsep) if p
+        ],
+        validate_default=True,  # Volumes must exist and be resolved
+    )
+    # Volume choice for new files: most_free, round_robin or by_extension
+    POOL_PLACEMENT: str = os.getenv("POOL_PLACEMENT", "most_free")
+    # For by_extension, e.g. {".mp4": "/mnt/media"}; others fall back to most_free
+    POOL_EXTENSION_MAP: Dict[str, str] = json.loads(
+        os.getenv("POOL_EXTENSION_MAP", "{}")
+    )
+    # Optional fast-tier (SSD) read cache for frequently read files
+    FAST_TIER_DIR: Optional[Path] = (
+        Path(os.environ["NAS_FAST_TIER_DIR"])
+        if os.getenv("NAS_FAST_TIER_DIR")
+        else None
+    )
+    FAST_TIER_MAX_BYTES: int = int(os.getenv("FAST_TIER_MAX_BYTES", 8 * 1024**3))
+    # Reads of a file (download or stream request) before it is promoted
+    FAST_TIER_PROMOTE_HITS: int = int(os.getenv("FAST_TIER_PROMOTE_HITS", 3))
+    # Eviction: lru (least recently read) or lfu (least frequently read)
+    FAST_TIER_POLICY: str = os.getenv("FAST_TIER_POLICY", "lru")
+    # Resolved paths and stat results cached between requests; changes made
+    # outside the API show up after at most PATH_CACHE_TTL seconds (0 disables)
+    PATH_CACHE_SIZE: int = int(os.getenv("PATH_CACHE_SIZE", 4096))
+    PATH_CACHE_TTL: float = float(os.getenv("PATH_CACHE_TTL", 2))
+    # Stream MP4/MOV files whose moov box is at the end as if it were first
+    MP4_FASTSTART: bool = os.getenv("MP4_FASTSTART", "true").lower() == "true"
+    # Memory for cached fast-start layouts, mostly their rewritten moov boxes
+    MP4_FASTSTART_CACHE_BYTES: int = int(
+        os.getenv("MP4_FASTSTART_CACHE_BYTES", 64 * 1024 * 1024)
+    )
+    # Chunked upload sessions idle this long are dropped with their data
+    UPLOAD_SESSION_TTL: int = int(os.getenv("UPLOAD_SESSION_TTL", 3600))
+    # Uncached thumbnails/previews are queued and answered with 202 at once
+    THUMBNAIL_ASYNC: bool = os.getenv("THUMBNAIL_ASYNC", "true").lower() == "true"
+    # Seconds between automatic snapshots (0 disables them)
+    SNAPSHOT_INTERVAL: int = int(os.getenv("SNAPSHOT_INTERVAL", 3600))
+    # Defaults to BASE_DIR/.fastnas-snapshots; must be on BASE_DIR's
+    # filesystem since snapshots are made of hardlinks
+    SNAPSHOT_DIR: Optional[Path] = (
+        Path(os.environ["NAS_SNAPSHOT_DIR"]) if os.getenv("NAS_SNAPSHOT_DIR") else None
+    )
+    # Retention: the newest N snapshots, plus the newest one of each of the
+    # last N days
+    SNAPSHOT_KEEP_HOURLY: int = int(os.getenv("SNAPSHOT_KEEP_HOURLY", 24))
+    SNAPSHOT_KEEP_DAILY: int = int(os.getenv("SNAPSHOT_KEEP_DAILY", 7))
+    # Bandwidth caps for downloads and streams in bytes/s, over all clients
+    # and per client IP (0: unlimited)
+    BANDWIDTH_LIMIT: int = int(os.getenv("BANDWIDTH_LIMIT", 0))
+    BANDWIDTH_CLIENT_LIMIT: int = int(os.getenv("BANDWIDTH_CLIENT_LIMIT", 0))
+    # A stream's share of contended bandwidth relative to a download's
+    BANDWIDTH_STREAM_WEIGHT: float = float(os.getenv("BANDWIDTH_STREAM_WEIGHT", 4))
+    # Secret that enables on-demand profiling (empty: profiling disabled)
+    PROFILING_TOKEN: str = os.getenv("PROFILING_TOKEN", "")
+    PROFILE_KEEP: int = int(os.getenv("PROFILE_KEEP", 50))  # Request profiles
+    PROFILE_SAMPLE_INTERVAL: float = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))
+
+    @field_validator("BASE_DIR", "DATA_DIR")
     @classmethod
     def validate_base_dir(cls, v):
         if not v.exists():
             v.mkdir(parents=True, exist_ok=True)
         return v.resolve()
 
+    @field_validator("POOL_VOLUMES")
+    @classmethod
+    def validate_pool_volumes(cls, v):
+        return [cls.validate_base_dir(volume) for volume in v]
+
+    @field_validator("PREVIEW_SIZES")
+    @classmethod
+    def validate_preview_sizes(cls, v):
+        return sorted(set(v))
+
 
 @lru_cache()
 def get_settings() -> Settings:
@@ -106,7 +290,7 @@ class StructuredLogger:
 
     def _log(self, level: str, message: str, **kwargs):
         log_data = {
-            "timestamp": datetime.datetime.utcnow().isoformat(),
+            "timestamp": datetime.utcnow().isoformat(),
             "level": level,
             "message": message,
             **kwargs,
@@ -154,25 +338,780 @@ class RateLimiter:
 
 rate_limiter = RateLimiter()
 
+# ============================================================================
+# ADMISSION CONTROL
+# ============================================================================
+
+# (method or None for any, path prefix, route class); first match wins
+ROUTE_CLASSES = [
+    # Long-lived event stream; must not hold a heavy_cpu slot
+    ("GET", "/api/thumbnails/events", None),
+    (None, "/api/thumbnails/jobs", "metadata"),
+    (None, "/api/stream/", "streaming"),
+    ("GET", "/api/files", "metadata"),
+    (None, "/api/stats", "metadata"),
+    (None, "/api/file/info/", "metadata"),
+    (None, "/api/folders/", "metadata"),
+    (None, "/api/delete/", "metadata"),
+    (None, "/api/uploads/metrics", "metadata"),
+    (None, "/api/admission/metrics", "metadata"),
+    (None, "/api/startup", "metadata"),
+    (None, "/api/pool", "metadata"),
+    (None, "/api/tier", "metadata"),
+    (None, "/api/path-cache", "metadata"),
+    (None, "/api/changes", "metadata"),
+    ("POST", "/api/snapshots", "bulk_io"),
+    (None, "/api/transfers", "metadata"),
+    (None, "/api/profil", "metadata"),  # /api/profiles and /api/profiling
+    (None, "/api/snapshots", "metadata"),
+    (None, "/api/duplicates", "metadata"),
+    (None, "/api/photos", "metadata"),
+    (None, "/api/zip/entries/", "metadata"),
+    (None, "/api/zip/extract/", "bulk_io"),
+    (None, "/api/search", "heavy_cpu"),
+    (None, "/api/thumbnail", "heavy_cpu"),
+    (None, "/api/preview/", "heavy_cpu"),
+    (None, "/api/download", "bulk_io"),
+    (None, "/api/upload", "bulk_io"),
+    ("PUT", "/api/files/", "bulk_io"),
+    (None, "/api/uploads/sessions", "bulk_io"),
+    (None, "/api/delta/", "bulk_io"),
+]
+
+
+def classify_route(method: str, path: str) -> Optional[str]:
+    for route_method, prefix, route_class in ROUTE_CLASSES:
+        if (route_method is None or route_method == method) and path.startswith(prefix):
+            return route_class
+    return None
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+
+
+class RouteClassLimiter:
+    """Concurrency limit with a bounded, deadline-limited FIFO wait queue"""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiters: deque = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.avg_service_time = 0.0  # EWMA, seconds
+
+    def retry_after(self) -> int:
+        backlog = len(self.waiters) + 1
+        estimate = self.avg_service_time * backlog / self.max_concurrent
+        return max(1, int(estimate + 0.999))
+
+    async def acquire(self):
+        if self.active < self.max_concurrent and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+
+        if len(self.waiters) >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                self.admitted += 1
+                return  # Slot was handed over right as the deadline hit
+            self.waiters.remove(waiter)
+            self.rejected += 1
+            raise Overloaded(self.retry_after())
+        except asyncio.CancelledError:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                self.release(0.0)
+            raise
+        self.admitted += 1
+
+    def release(self, service_time: float):
+        self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * service_time
+        # Hand the slot straight to the next live waiter (keeps FIFO order)
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queued": len(self.waiters),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "max_wait_s": self.max_wait,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_service_ms": round(self.avg_service_time * 1000, 2),
+        }
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware that admits requests per route class
+
+    Streaming and listing keep their own slots, so a burst of thumbnail
+    decodes or a slow search only ever queues behind its own class. A slot is
+    held until the response body has been fully sent. Requests that would
+    wait past their class deadline get 503 with Retry-After.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        route_class = classify_route(scope["method"], scope["path"])
+        if route_class is None:
+            return await self.app(scope, receive, send)
+
+        limiter = get_route_limiter(route_class)
+        try:
+            await limiter.acquire()
+        except Overloaded as e:
+            logger.warning("Request shed", route_class=route_class, path=scope["path"])
+            response = JSONResponse(
+                status_code=503,
+                content={
+                    "error": True,
+                    "status_code": 503,
+                    "message": f"Server busy ({route_class}). Please retry.",
+                    "timestamp": datetime.utcnow().isoformat(),
+                },
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            return await response(scope, receive, send)
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.monotonic() - started)
+
+
+route_limiters: Dict[str, RouteClassLimiter] = {}
+
+
+def get_route_limiter(route_class: str) -> RouteClassLimiter:
+    """Limiter for a route class, created from settings on first use"""
+    if route_class not in route_limiters:
+        limits = get_settings().ADMISSION_LIMITS[route_class]
+        route_limiters[route_class] = RouteClassLimiter(
+            route_class,
+            max_concurrent=int(limits["max_concurrent"]),
+            max_queue=int(limits["max_queue"]),
+            max_wait=float(limits["max_wait"]),
+        )
+    return route_limiters[route_class]
+
+
+# ============================================================================
+# BANDWIDTH SHAPING
+# ============================================================================
+
+# Route classes whose GET responses are paced, and their default weights
+SHAPED_ROUTE_CLASSES = ("streaming", "bulk_io")
+# Bucket depth in seconds of its rate (at least one SHAPING_CHUNK)
+BANDWIDTH_BURST_SECONDS = 0.25
+# Large response bodies are split into pieces of this size before pacing
+SHAPING_CHUNK = 64 * 1024
+# Seconds over which a transfer's current rate is measured
+RATE_WINDOW = 2.0
+
+
+class TokenBucket:
+    """Bytes-per-second bucket; a take larger than the depth goes into debt"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.depth = max(rate * BANDWIDTH_BURST_SECONDS, SHAPING_CHUNK)
+        self.tokens = self.depth
+        self.updated = time.monotonic()
+
+    def wait_time(self, size: int, now: float) -> float:
+        self.tokens = min(self.depth, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        needed = min(size, self.depth)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def take(self, size: int):
+        self.tokens -= size
+
+
+class Transfer:
+    """One response being sent, with its progress and measured rate"""
+
+    def __init__(
+        self, transfer_id: int, client: str, path: str, kind: str, weight: float
+    ):
+        self.id = transfer_id
+        self.client = client
+        self.path = path
+        self.kind = kind
+        self.weight = weight
+        self.total_bytes: Optional[int] = None  # From Content-Length, if any
+        self.bytes_sent = 0
+        self.started = time.monotonic()
+        self.finish_tag = 0.0
+        self.waiting = False
+        self._recent: deque = deque()  # (time, bytes) within RATE_WINDOW
+
+    def sent(self, size: int):
+        now = time.monotonic()
+        self.bytes_sent += size
+        self._recent.append((now, size))
+        while self._recent and self._recent[0][0] < now - RATE_WINDOW:
+            self._recent.popleft()
+
+    def current_rate(self) -> float:
+        now = time.monotonic()
+        recent = sum(
+            size for sent_at, size in self._recent if sent_at >= now - RATE_WINDOW
+        )
+        return recent / max(min(RATE_WINDOW, now - self.started), 1e-3)
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        rate = self.current_rate()
+        return {
+            "id": self.id,
+            "client": self.client,
+            "path": self.path,
+            "route_class": self.kind,
+            "weight": self.weight,
+            "bytes_sent": self.bytes_sent,
+            "total_bytes": self.total_bytes,
+            "progress": (
+                round(self.bytes_sent / self.total_bytes, 4)
+                if self.total_bytes
+                else None
+            ),
+            "rate": round(rate),
+            "rate_human": f"{format_bytes(rate)}/s",
+            "avg_rate": round(self.bytes_sent / max(elapsed, 1e-3)),
+            "elapsed_s": round(elapsed, 2),
+            "throttled": self.waiting,
+        }
+
+
+class BandwidthShaper:
+    """Weighted fair sharing of response bandwidth under global and
+    per-client caps
+
+    Each body chunk waits for a grant. Grants go out in start-time fair
+    queueing order: a chunk's tag is the later of the virtual time and its
+    transfer's previous tag, plus size/weight, and the smallest tag whose
+    client bucket has tokens goes next. Busy transfers thus split bandwidth
+    by weight (streams get BANDWIDTH_STREAM_WEIGHT times a download's share),
+    bandwidth nobody uses is not held back, and idling earns no credit.
+    """
+
+    def __init__(self, global_limit: int, client_limit: int, stream_weight: float):
+        self.global_bucket = TokenBucket(global_limit) if global_limit > 0 else None
+        self.client_limit = client_limit
+        self.stream_weight = stream_weight
+        self.client_buckets: Dict[str, TokenBucket] = {}
+        self.transfers: Dict[int, Transfer] = {}
+        self.waiting: List[tuple] = []  # (tag, seq, transfer, size, future)
+        self.virtual_time = 0.0
+        self.bytes_sent = 0
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    @property
+    def limited(self) -> bool:
+        return self.global_bucket is not None or self.client_limit > 0
+
+    def open(self, client: str, path: str, kind: str) -> Transfer:
+        weight = self.stream_weight if kind == "streaming" else 1.0
+        transfer = Transfer(next(self._ids), client, path, kind, weight)
+        self.transfers[transfer.id] = transfer
+        if self.client_limit > 0 and client not in self.client_buckets:
+            self.client_buckets[client] = TokenBucket(self.client_limit)
+        return transfer
+
+    def close(self, transfer: Transfer):
+        self.transfers.pop(transfer.id, None)
+        if not any(t.client == transfer.client for t in self.transfers.values()):
+            self.client_buckets.pop(transfer.client, None)
+
+    async def acquire(self, transfer: Transfer, size: int):
+        """Wait until transfer may send size more bytes"""
+        tag = max(self.virtual_time, transfer.finish_tag) + size / transfer.weight
+        transfer.finish_tag = tag
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        entry = (tag, next(self._seq), transfer, size, future)
+        self.waiting.append(entry)
+        if (
+            self._dispatcher is None
+            or self._dispatcher.done()
+            or self._dispatcher.get_loop() is not loop
+        ):
+            self._dispatcher = loop.create_task(self._dispatch())
+        transfer.waiting = True
+        try:
+            await future
+        except asyncio.CancelledError:
+            if entry in self.waiting:
+                self.waiting.remove(entry)
+            raise
+        finally:
+            transfer.waiting = False
+
+    async def _dispatch(self):
+        while self.waiting:
+            now = time.monotonic()
+            chosen = None
+            delay = None
+            for entry in sorted(self.waiting, key=lambda e: e[:2]):
+                bucket = self.client_buckets.get(entry[2].client)
+                wait = bucket.wait_time(entry[3], now) if bucket else 0.0
+                if wait == 0.0:
+                    chosen = entry
+                    break
+                delay = wait if delay is None else min(delay, wait)
+
+            if chosen is None:
+                await asyncio.sleep(delay)  # Every waiting client is at its cap
+                continue
+            tag, _, transfer, size, future = chosen
+            if self.global_bucket is not None:
+                wait = self.global_bucket.wait_time(size, now)
+                if wait > 0:
+                    # Re-pick afterwards: a smaller tag may arrive meanwhile
+                    await asyncio.sleep(wait)
+                    continue
+                self.global_bucket.take(size)
+            if transfer.client in self.client_buckets:
+                self.client_buckets[transfer.client].take(size)
+            self.waiting.remove(chosen)
+            self.virtual_time = tag - size / transfer.weight
+            if not future.done():
+                future.set_result(None)
+
+    def metrics(self) -> Dict[str, Any]:
+        transfers = [t.snapshot() for t in self.transfers.values()]
+        clients: Dict[str, Dict[str, int]] = {}
+        for transfer in transfers:
+            client = clients.setdefault(transfer["client"], {"transfers": 0, "rate": 0})
+            client["transfers"] += 1
+            client["rate"] += transfer["rate"]
+        total_rate = sum(t["rate"] for t in transfers)
+        return {
+            "global_limit": self.global_bucket.rate if self.global_bucket else None,
+            "client_limit": self.client_limit or None,
+            "stream_weight": self.stream_weight,
+            "rate": total_rate,
+            "rate_human": f"{format_bytes(total_rate)}/s",
+            "bytes_sent": self.bytes_sent,
+            "active": len(transfers),
+            "clients": clients,
+            "transfers": sorted(transfers, key=lambda t: t["rate"], reverse=True),
+        }
+
+
+_bandwidth_shaper: Optional[BandwidthShaper] = None
+
+
+def get_bandwidth_shaper() -> BandwidthShaper:
+    global _bandwidth_shaper
+    if _bandwidth_shaper is None:
+        settings = get_settings()
+        _bandwidth_shaper = BandwidthShaper(
+            settings.BANDWIDTH_LIMIT,
+            settings.BANDWIDTH_CLIENT_LIMIT,
+            settings.BANDWIDTH_STREAM_WEIGHT,
+        )
+    return _bandwidth_shaper
+
+
+class BandwidthShapingMiddleware:
+    """ASGI middleware pacing file-serving response bodies
+
+    Applies to GETs in SHAPED_ROUTE_CLASSES. Every such response is tracked
+    for GET /api/transfers; it is only slowed down when BANDWIDTH_LIMIT or
+    BANDWIDTH_CLIENT_LIMIT is set.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return await self.app(scope, receive, send)
+        route_class = classify_route(scope["method"], scope["path"])
+        if route_class not in SHAPED_ROUTE_CLASSES:
+            return await self.app(scope, receive, send)
+
+        shaper = get_bandwidth_shaper()
+        client = scope["client"][0] if scope.get("client") else "unknown"
+        transfer = shaper.open(client, scope["path"], route_class)
+        if shaper.limited and scope.get("extensions"):
+            # Bodies must pass through send to be paced, so no sendfile
+            extensions = dict(scope["extensions"])
+            extensions.pop("http.response.pathsend", None)
+            extensions.pop("http.response.zerocopysend", None)
+            scope = {**scope, "extensions": extensions}
+
+        async def shaped_send(message):
+            if message["type"] == "http.response.start":
+                for name, value in message.get("headers", []):
+                    if name.lower() == b"content-length":
+                        transfer.total_bytes = int(value)
+            elif message["type"] == "http.response.body" and message.get("body"):
+                body = message["body"]
+                more_body = message.get("more_body", False)
+                step = SHAPING_CHUNK if shaper.limited else len(body)
+                for start in range(0, len(body), step):
+                    piece = body[start : start + step]
+                    if shaper.limited:
+                        await shaper.acquire(transfer, len(piece))
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": piece,
+                            "more_body": more_body or start + step < len(body),
+                        }
+                    )
+                    transfer.sent(len(piece))
+                    shaper.bytes_sent += len(piece)
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, receive, shaped_send)
+        finally:
+            shaper.close(transfer)
+
+
+# ============================================================================
+# PROFILING
+# ============================================================================
+
+# Leaf frames of threads that are just waiting, left out of samples unless
+# include_idle is set: (file name, function)
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+MAX_SAMPLE_SECONDS = 300
+
+_profile_lock = asyncio.Lock()
+
+
+def profiling_token_matches(token: Optional[str]) -> bool:
+    expected = get_settings().PROFILING_TOKEN
+    return bool(expected and token and secrets.compare_digest(token, expected))
+
+
+async def verify_profiling_token(x_profile_token: Optional[str] = Header(None)):
+    """Admin check for the profiling endpoints (X-Profile-Token header)"""
+    if not get_settings().PROFILING_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not profiling_token_matches(x_profile_token):
+        logger.warning("Unauthorized profiling attempt")
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+
+def query_without_profile_token(query_string: bytes) -> str:
+    """Query string with any _profile parameter removed, for storing"""
+    pairs = parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)
+    return urlencode([(key, value) for key, value in pairs if key != "_profile"])
+
+
+def profiles_dir() -> Path:
+    directory = get_settings().DATA_DIR / "profiles"
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def prune_profiles():
+    """Keep the newest PROFILE_KEEP request profiles"""
+    stored = sorted(profiles_dir().glob("*.prof"), reverse=True)
+    for old in stored[get_settings().PROFILE_KEEP :]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".json").unlink(missing_ok=True)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware running flagged requests under cProfile
+
+    A request carrying the PROFILING_TOKEN in an X-Profile-Token header is
+    profiled until its body has been sent (the token is only read from the
+    header, keeping it out of URLs and access logs). The pstats are stored
+    in DATA_DIR/profiles, and the response's X-Profile-Id header names them for GET /api/profiles/{id}. cProfile sees the event
+    loop thread only (work handed to the thread pool shows as a wait; use
+    the sampler for that), and profiled requests run one at a time so
+    others' work stays out of the profile as far as possible.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not get_settings().PROFILING_TOKEN:
+            return await self.app(scope, receive, send)
+        token = dict(scope["headers"]).get(b"x-profile-token", b"").decode()
+        if not profiling_token_matches(token):
+            return await self.app(scope, receive, send)
+
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+        status_code = None
+
+        async def profiled_send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"x-profile-id", profile_id.encode()),
+                    ],
+                }
+            await send(message)
+
+        async with _profile_lock:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, profiled_send)
+            finally:
+                profiler.disable()
+                duration_ms = _elapsed_ms(started)
+                await asyncio.to_thread(
+                    self._store,
+                    profiler,
+                    {
+                        "id": profile_id,
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "query": query_without_profile_token(
+                            scope.get("query_string", b"")
+                        ),
+                        "status_code": status_code,
+                        "duration_ms": duration_ms,
+                        "created": time.time(),
+                    },
+                )
+        logger.info("Request profiled", path=scope["path"], profile=profile_id)
+
+    @staticmethod
+    def _store(profiler: cProfile.Profile, meta: Dict[str, Any]):
+        directory = profiles_dir()
+        profiler.dump_stats(directory / f"{meta['id']}.prof")
+        (directory / f"{meta['id']}.json").write_text(json.dumps(meta))
+        prune_profiles()
+
+
+def format_profile(profile_path: Path, sort: str, limit: int) -> str:
+    """pstats report of a stored profile as text"""
+    out = io.StringIO()
+    stats = pstats.Stats(str(profile_path), stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+class StackSampler:
+    """Samples every thread's stack at a fixed interval
+
+    Produces collapsed stacks ("thread;outer;...;leaf count" per line), the
+    input format of flamegraph.pl, speedscope and similar tools. Sampling
+    costs one sys._current_frames() walk per interval, so it can run across
+    all requests on a live server.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.run_id: Optional[str] = None
+        self.started = 0.0
+        self.seconds = 0.0
+        self.samples = 0
+        self.include_idle = False
+        self._counts: Dict[str, int] = defaultdict(int)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, include_idle: bool) -> Dict[str, Any]:
+        with self._lock:
+            if self.running:
+                raise HTTPException(
+                    status_code=409, detail="A sampling run is already in progress"
+                )
+            self.run_id = f"sample-{time.strftime('%Y%m%d-%H%M%S')}"
+            self.started = time.time()
+            self.seconds = seconds
+            self.samples = 0
+            self.include_idle = include_idle
+            self._counts = defaultdict(int)
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="stack-sampler", daemon=True
+            )
+            self._thread.start()
+        logger.info("Stack sampling started", run=self.run_id, seconds=seconds)
+        return self.status()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        interval = get_settings().PROFILE_SAMPLE_INTERVAL
+        deadline = time.monotonic() + self.seconds
+        own_id = threading.get_ident()
+        while time.monotonic() < deadline and not self._stop.wait(interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self._sample(names.get(thread_id, str(thread_id)), frame)
+            self.samples += 1
+        with open(self.output_path(), "w") as f:
+            for stack, count in sorted(self._counts.items()):
+                f.write(f"{stack} {count}\n")
+        logger.info("Stack sampling finished", run=self.run_id, samples=self.samples)
+
+    def _sample(self, thread_name: str, frame):
+        code = frame.f_code
+        if (
+            not self.include_idle
+            and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+        ):
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(
+                f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                f":{code.co_firstlineno})"
+            )
+            frame = frame.f_back
+        # Pool workers are numbered; group them so their samples add up
+        stack.append(re.sub(r"_\d+$", "", thread_name))
+        self._counts[";".join(reversed(stack))] += 1
+
+    def output_path(self) -> Path:
+        return profiles_dir() / f"{self.run_id}.collapsed"
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "run_id": self.run_id,
+            "started": datetime.fromtimestamp(self.started) if self.run_id else None,
+            "seconds": self.seconds,
+            "samples": self.samples,
+            "include_idle": self.include_idle,
+            "download_url": (
+                f"/api/profiling/samples/{self.run_id}"
+                if self.run_id and not self.running
+                else None
+            ),
+        }
+
+
+stack_sampler = StackSampler()
+
+
 # ============================================================================
 # LIFESPAN & STARTUP/SHUTDOWN
 # ============================================================================
 
 
+def warm_up():
+    """Open indexes, import Pillow and prime caches off the request path"""
+    settings = get_settings()
+
+    started = time.perf_counter()
+    for open_index in (
+        get_journal_db,
+        get_compression_db,
+        get_content_db,
+        get_photo_db,
+        get_hash_db,
+        get_pool_db,
+    ):
+        open_index()
+    startup_timing["index_open_ms"] = _elapsed_ms(started)
+    if _journal_meta(get_hash_db(), "duplicate_scan_pending") == 1:
+        duplicate_scan.start()  # Resume a scan interrupted by shutdown
+
+    started = time.perf_counter()
+    Image.preinit()
+    mimetypes.init()
+    startup_timing["imports_ms"] = _elapsed_ms(started)
+
+    started = time.perf_counter()
+    get_storage_stats(settings.BASE_DIR)
+    startup_timing["stats_cache_ms"] = _elapsed_ms(started)
+
+    startup_timing["warm_ms"] = _elapsed_ms(_import_started)
+    logger.info("Startup timing", **startup_timing)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application lifecycle"""
     # Startup
+    started = time.perf_counter()
     setup_logging()
     settings = get_settings()
+    startup_timing["settings_ms"] = _elapsed_ms(started)
     logger.info("NAS Server starting", base_dir=str(settings.BASE_DIR))
 
     # Ensure base directory exists
     settings.BASE_DIR.mkdir(parents=True, exist_ok=True)
 
+    background_tasks = []
+    if settings.JOURNAL_SCAN_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(run_journal_scanner()))
+    if settings.CONTENT_INDEX_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(run_content_indexer()))
+    if settings.PHOTO_INDEX_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(run_photo_indexer()))
+    if settings.COMPRESS_AT_REST:
+        background_tasks.append(
+            asyncio.create_task(asyncio.to_thread(compress_existing_files))
+        )
+    if settings.SNAPSHOT_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(run_snapshotter()))
+    background_tasks.append(asyncio.create_task(run_upload_session_expiry()))
+    # Not awaited: requests are served while indexes open and caches fill
+    background_tasks.append(asyncio.create_task(asyncio.to_thread(warm_up)))
+    startup_timing["lifespan_ms"] = _elapsed_ms(started)
+
     yield
 
     # Shutdown
+    for task in background_tasks:
+        task.cancel()
+    duplicate_scan.cancel()
     logger.info("NAS Server shutting down")
 
 
@@ -180,6 +1119,29 @@ async def lifespan(app: FastAPI):
 # FASTAPI APP INITIALIZATION
 # ============================================================================
 
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """GZip for API responses only
+
+    File-serving routes send media that doesn't compress, byte ranges whose
+    lengths must not change, or bodies that are already gzip-encoded on disk.
+    """
+
+    SKIP_PREFIXES = (
+        "/api/download",
+        "/api/stream/",
+        "/api/thumbnail",
+        "/api/preview/",
+        "/api/zip/extract/",
+    )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(self.SKIP_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
 app = FastAPI(
     title="Personal NAS Server",
     description="Production-ready personal NAS for single-user storage on old laptops",
@@ -201,7 +1163,18 @@ app.add_middleware(
 )
 
 # Add compression middleware
-app.add_middleware(GZipMiddleware, minimum_size=1000)
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=1000)
+
+# Pace downloads and streams (inside admission control: a paced response
+# keeps its slot until it has been sent)
+app.add_middleware(BandwidthShapingMiddleware)
+
+# Profile flagged requests (inside admission control, so queueing for a
+# slot is not part of the profile)
+app.add_middleware(ProfilingMiddleware)
+
+# Add per-route-class admission control
+app.add_middleware(AdmissionControlMiddleware)
 
 # ============================================================================
 # SECURITY & AUTHENTICATION
@@ -236,15 +1209,172 @@ async def check_rate_limit(request: Request):
         )
 
 
+class PathMetadataCache:
+    """Bounded LRU of validated paths and stat results
+
+    Saves the resolve() and exists/is_file/stat syscalls that every request
+    would otherwise repeat. Only paths that passed validation are cached.
+    Mutations made through the API invalidate their entries (see
+    record_change); entries also expire after PATH_CACHE_TTL seconds so
+    changes made directly on disk are picked up. Each key is also filed
+    under every folder above it, so invalidating a folder costs the number
+    of entries below it rather than a scan of the whole cache.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._resolved: "OrderedDict[str, tuple]" = OrderedDict()
+        self._stats: "OrderedDict[str, tuple]" = OrderedDict()
+        self._below: Dict[str, set] = defaultdict(set)  # folder -> keys under it
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, table: OrderedDict, key: str):
+        with self._lock:
+            item = table.get(key)
+            if item is None or item[0] < time.monotonic():
+                self.misses += 1
+                return _NOT_CACHED
+            table.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    @staticmethod
+    def _folders_above(key: str):
+        parent = os.path.dirname(key)
+        while parent != key:
+            yield parent
+            key, parent = parent, os.path.dirname(parent)
+
+    def _unindex(self, key: str):
+        # Caller holds the lock
+        if key in self._resolved or key in self._stats:
+            return
+        for folder in self._folders_above(key):
+            keys = self._below.get(folder)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._below[folder]
+
+    def _put(self, table: OrderedDict, key: str, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if key not in self._resolved and key not in self._stats:
+                for folder in self._folders_above(key):
+                    self._below[folder].add(key)
+            table[key] = (time.monotonic() + self.ttl, value)
+            table.move_to_end(key)
+            while len(table) > self.max_entries:
+                evicted, _ = table.popitem(last=False)
+                self._unindex(evicted)
+
+    def get_resolved(self, path: Path):
+        return self._get(self._resolved, str(path))
+
+    def put_resolved(self, path: Path, validated: Path):
+        self._put(self._resolved, str(path), validated)
+
+    def get_stat(self, path: Path):
+        return self._get(self._stats, str(path))
+
+    def put_stat(self, path: Path, stat: Optional[os.stat_result]):
+        self._put(self._stats, str(path), stat)
+
+    def invalidate(self, path: Path):
+        """Forget path, everything below it and its parent folder's stat"""
+        path = str(path)
+        with self._lock:
+            keys = {path, os.path.dirname(path)} | self._below.get(path, set())
+            for key in keys:
+                self._resolved.pop(key, None)
+                self._stats.pop(key, None)
+                self._unindex(key)
+
+    def clear(self):
+        with self._lock:
+            self._resolved.clear()
+            self._stats.clear()
+            self._below.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "resolved_entries": len(self._resolved),
+                "stat_entries": len(self._stats),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_NOT_CACHED = object()
+
+
+@lru_cache()
+def get_path_cache() -> PathMetadataCache:
+    settings = get_settings()
+    return PathMetadataCache(settings.PATH_CACHE_SIZE, settings.PATH_CACHE_TTL)
+
+
+@lru_cache(maxsize=8)
+def _resolved_base(base_dir: Path) -> Path:
+    return base_dir.resolve()
+
+
 def validate_path_security(path: Path, base_dir: Path) -> Path:
-    """Validate path to prevent directory traversal attacks"""
+    """Validate path to prevent directory traversal attacks
+
+    Pooled files are symlinks into another volume; those are returned as
+    their path in the share rather than resolved.
+    """
+    path_cache = get_path_cache()
+    validated = path_cache.get_resolved(path)
+    if validated is not _NOT_CACHED:
+        return validated
     try:
         resolved = path.resolve()
-        resolved.relative_to(base_dir.resolve())
-        return resolved
+        if resolved.is_relative_to(_resolved_base(base_dir)):
+            validated = resolved
+        else:
+            validated = Path(os.path.normpath(path))
+            validated.relative_to(base_dir)
+            if pool_volume_of(resolved) is None:
+                raise ValueError(path)
     except (ValueError, RuntimeError):
         logger.error("Path traversal attempt", path=str(path))
         raise HTTPException(status_code=403, detail="Access denied: Invalid path")
+    if any(name in validated.parts for name in INTERNAL_DIR_NAMES) and (
+        is_internal_path(validated)
+    ):
+        # Server-owned; snapshots are reached read-only through ?snapshot=ID
+        raise HTTPException(status_code=403, detail="Access denied: Invalid path")
+    path_cache.put_resolved(path, validated)
+    return validated
+
+
+def stat_path(path: Path, fresh: bool = False) -> Optional[os.stat_result]:
+    """Cached stat of a validated path, following symlinks; None if missing
+
+    Use stat_module.S_ISREG/S_ISDIR on the result instead of separate
+    exists()/is_file()/is_dir() calls. Routes that open the file and send
+    its bytes pass fresh=True: a stat up to PATH_CACHE_TTL old could give a
+    wrong Content-Length or ETag after a change made directly on disk.
+    """
+    path_cache = get_path_cache()
+    stat = _NOT_CACHED if fresh else path_cache.get_stat(path)
+    if stat is not _NOT_CACHED:
+        return stat
+    try:
+        stat = path.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        stat = None
+    path_cache.put_stat(path, stat)
+    return stat
 
 
 # ============================================================================
@@ -260,6 +1390,9 @@ async def log_requests(request: Request, call_next):
     response = await call_next(request)
 
     process_time = time.time() - start_time
+    if "first_request_ms" not in startup_timing:
+        startup_timing["first_request_ms"] = _elapsed_ms(_import_started)
+        logger.info("First request served", **startup_timing)
     logger.info(
         "Request completed",
         method=request.method,
@@ -283,8 +1416,8 @@ class FileItem(BaseModel):
     is_file: bool
     is_folder: bool
     file_size: int
-    creation_date: datetime.datetime
-    modification_date: datetime.datetime
+    creation_date: datetime
+    modification_date: datetime
     path: str
     extension: Optional[str] = None
     thumbnail_url: Optional[str] = None
@@ -318,6 +1451,18 @@ class FileUploadResponse(BaseModel):
     message: str
 
 
+class ThumbnailBatchRequest(BaseModel):
+    path: Optional[str] = Field(
+        None, description="Directory whose images should be thumbnailed"
+    )
+    paths: Optional[List[str]] = Field(
+        None, description="Explicit list of image paths (used instead of path)"
+    )
+    size: int = Field(200, ge=16, le=1024)
+    format: str = "webp"
+    layout: str = Field("multipart", description="multipart or sprite")
+
+
 class StorageStats(BaseModel):
     total_space: int
     used_space: int
@@ -325,11 +1470,14 @@ class StorageStats(BaseModel):
     usage_percentage: float
     total_files: int
     total_folders: int
+    compressed_files: int = 0
+    compression_saved_bytes: int = 0
+    volumes: List[Dict[str, Any]] = []
 
 
 class HealthCheck(BaseModel):
     status: str
-    timestamp: datetime.datetime
+    timestamp: datetime
     version: str
     base_dir_accessible: bool
 
@@ -342,7 +1490,7 @@ class HealthCheck(BaseModel):
 def calculate_checksum(file_path: Path) -> str:
     """Calculate SHA256 checksum of a file"""
     sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
+    with open_logical(file_path) as f:
         for byte_block in iter(lambda: f.read(4096), b""):
             sha256_hash.update(byte_block)
     return sha256_hash.hexdigest()
@@ -369,8 +1517,27 @@ def get_storage_stats(base_dir: Path) -> Dict[str, Any]:
         ):
             return _stats_cache["data"]
 
-        # Get disk usage (fast)
-        stat = shutil.disk_usage(base_dir)
+        # Get disk usage (fast), once per distinct filesystem in the pool
+        volumes = []
+        seen_devices = set()
+        total = used = free = 0
+        for volume in pool_volumes():
+            usage = shutil.disk_usage(volume)
+            device = os.stat(volume).st_dev
+            volumes.append(
+                {
+                    "path": str(volume),
+                    "total_space": usage.total,
+                    "free_space": usage.free,
+                }
+            )
+            if device not in seen_devices:
+                seen_devices.add(device)
+                total, used, free = (
+                    total + usage.total,
+                    used + usage.used,
+                    free + usage.free,
+                )
 
         # Count files efficiently with early exit on large directories
         file_count = 0
@@ -382,6 +1549,8 @@ def get_storage_stats(base_dir: Path) -> Dict[str, Any]:
             for item in base_dir.iterdir():
                 if file_count + folder_count > MAX_COUNT:
                     break
+                if item.name in INTERNAL_DIR_NAMES:
+                    continue
 
                 if item.is_file():
                     file_count += 1
@@ -393,12 +1562,13 @@ def get_storage_stats(base_dir: Path) -> Dict[str, Any]:
             pass  # Skip inaccessible directories
 
         result = {
-            "total_space": stat.total,
-            "used_space": stat.used,
-            "free_space": stat.free,
-            "usage_percentage": round((stat.used / stat.total) * 100, 2),
+            "total_space": total,
+            "used_space": used,
+            "free_space": free,
+            "usage_percentage": round((used / total) * 100, 2),
             "total_files": file_count,
             "total_folders": folder_count,
+            "volumes": volumes,
         }
 
         # Update cache
@@ -408,152 +1578,4466 @@ def get_storage_stats(base_dir: Path) -> Dict[str, Any]:
         return result
 
 
-def format_bytes(bytes_size: int) -> str:
-    """Human-readable file size"""
-    for unit in ["B", "KB", "MB", "GB", "TB"]:
-        if bytes_size < 1024.0:
-            return f"{bytes_size:.2f} {unit}"
-        bytes_size /= 1024.0
-    return f"{bytes_size:.2f} PB"
+# Read once at import (setting it is the only way to query it)
+PROCESS_UMASK = os.umask(0o022)
+os.umask(PROCESS_UMASK)
 
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"]
+THUMBNAIL_FORMATS = ["jpeg", "png", "webp"]
 
-# ============================================================================
-# ENDPOINTS
-# ============================================================================
+# Shared pool for CPU-bound image work so batch requests decode in parallel
+thumbnail_executor = ThreadPoolExecutor(
+    max_workers=max(2, os.cpu_count() or 2), thread_name_prefix="thumbnail"
+)
 
 
-@app.get("/", tags=["System"])
-async def root():
-    """Root endpoint"""
+def flatten_transparency(img: "Image.Image") -> "Image.Image":
+    """Composite transparent images onto a white background"""
+    if img.mode in ("RGBA", "LA", "P"):
+        bg = Image.new("RGB", img.size, (255, 255, 255))
+        if img.mode == "P":
+            img = img.convert("RGBA")
+        bg.paste(img, mask=img.split()[-1] if img.mode in ("RGBA", "LA") else None)
+        img = bg
+    return img
+
+
+def encode_image(img: "Image.Image", format: str) -> bytes:
+    """Encode an image with the optimized settings used for thumbnails"""
+    buffer = io.BytesIO()
+    output_format = format.upper()
+    if output_format == "WEBP":
+        img.save(buffer, format="WEBP", quality=85, method=6)
+    elif output_format == "JPEG":
+        img.save(buffer, format="JPEG", quality=85, optimize=True)
+    else:
+        img.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def render_thumbnail_image(full_path: Path, size: int) -> "Image.Image":
+    """Decode an image and shrink it to fit within size x size"""
+    img = Image.open(full_path)
+    img.thumbnail((size, size), Image.Resampling.LANCZOS)
+    return flatten_transparency(img)
+
+
+def render_thumbnail(full_path: Path, size: int, format: str) -> bytes:
+    """Decode an image and return an encoded thumbnail"""
+    return encode_image(render_thumbnail_image(full_path, size), format)
+
+
+def make_etag(stat: os.stat_result, variant: str = "") -> str:
+    """Strong validator derived from inode, size and mtime (plus an optional
+    variant for derived representations such as thumbnail size/format)"""
+    tag = f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    if variant:
+        tag = f"{tag}-{variant}"
+    return f'"{tag}"'
+
+
+def validator_headers(stat: os.stat_result, etag: str) -> Dict[str, str]:
+    """ETag and Last-Modified headers for a file-backed response"""
     return {
-        "message": "Welcome to your Personal NAS Server! 🚀",
-        "version": "2.0.0",
-        "docs": (
-            "/docs"
-            if os.getenv("ENVIRONMENT", "development") == "development"
-            else "disabled"
-        ),
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
     }
 
 
-@app.get("/health", response_model=HealthCheck, tags=["System"])
-async def health_check():
-    """Health check endpoint for monitoring"""
-    settings = get_settings()
-    return HealthCheck(
-        status="healthy",
-        timestamp=datetime.datetime.utcnow(),
-        version="2.0.0",
-        base_dir_accessible=settings.BASE_DIR.exists() and settings.BASE_DIR.is_dir(),
+def _parse_http_date(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _etag_in(header: str, etag: str) -> bool:
+    """Weak comparison of an ETag against an If-None-Match style list"""
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == opaque
+        for candidate in header.split(",")
     )
 
 
-@app.get("/app", response_class=HTMLResponse, tags=["Frontend"])
-async def serve_frontend():
-    """Serve the frontend interface"""
+def is_not_modified(request: Request, stat: os.stat_result, etag: str) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since (RFC 9110 precedence)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_in(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        since = _parse_http_date(if_modified_since)
+        return since is not None and int(stat.st_mtime) <= since
+    return False
+
+
+def if_range_allows(request: Request, stat: os.stat_result, etag: str) -> bool:
+    """True when a Range header may be honoured given any If-Range precondition"""
+    if_range = request.headers.get("if-range")
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # If-Range requires a strong match
+        return not if_range.startswith("W/") and if_range == etag
+    since = _parse_http_date(if_range)
+    return since is not None and int(stat.st_mtime) == since
+
+
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def parse_byte_range(range_header: str, size: int) -> Optional[tuple]:
+    """(start, end) of a single-range Range header, None to send everything
+
+    Multiple ranges are answered with the whole file; an unsatisfiable range
+    raises 416.
+    """
+    units, _, spec = range_header.partition("=")
+    if units.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
     try:
-        with open("index.html", "r", encoding="utf-8") as f:
-            return HTMLResponse(content=f.read())
-    except FileNotFoundError:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
         raise HTTPException(
-            status_code=404,
-            detail="Frontend not found. Place index.html in the same directory as main.py",
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
         )
+    return start, end
 
 
-@app.get("/api/stats", response_model=StorageStats, tags=["Storage"])
-async def get_storage_statistics(
-    _: str = Depends(verify_api_key), __: None = Depends(check_rate_limit)
-):
-    """Get storage statistics and usage"""
-    settings = get_settings()
-    stats = get_storage_stats(settings.BASE_DIR)
-    return StorageStats(**stats)
+def request_content_length(request: Request) -> Optional[int]:
+    """The request's Content-Length, None if absent; 400 if malformed"""
+    content_length = request.headers.get("content-length")
+    if content_length is None:
+        return None
+    if not (content_length.isascii() and content_length.isdigit()):
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    return int(content_length)
 
 
-@app.get("/api/files", tags=["Files"])
-async def list_files(
-    path: str = "",
-    sort_by: str = "name",  # name, size, date
-    order: str = "asc",  # asc, desc
-    _: str = Depends(verify_api_key),
-    __: None = Depends(check_rate_limit),
+def iter_file_range(
+    source: Union[Path, BinaryIO], start: int, end: int, chunk_size: int = 64 * 1024
 ):
-    """List files and folders with enhanced sorting"""
-    settings = get_settings()
+    """Yield bytes start..end (inclusive) of a file path or open file
+
+    An open file is closed once the range has been read.
+    """
+    with open(source, "rb") if isinstance(source, Path) else source as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
 
-    target_dir = settings.BASE_DIR / path if path else settings.BASE_DIR
-    target_dir = validate_path_security(target_dir, settings.BASE_DIR)
 
-    if not target_dir.exists():
-        raise HTTPException(status_code=404, detail="Directory not found")
+def format_bytes(bytes_size: int) -> str:
+    """Human-readable file size"""
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if bytes_size < 1024.0:
+            return f"{bytes_size:.2f} {unit}"
+        bytes_size /= 1024.0
+    return f"{bytes_size:.2f} PB"
 
-    if not target_dir.is_dir():
-        raise HTTPException(status_code=400, detail="Path is not a directory")
+
+# ============================================================================
+# PREVIEW PYRAMID
+# ============================================================================
+
+# A fixed set of striped locks, so concurrent requests for one source image
+# share a single decode without keeping a lock per image ever previewed
+PREVIEW_LOCK_STRIPES = 64
+_preview_locks = tuple(threading.Lock() for _ in range(PREVIEW_LOCK_STRIPES))
+
+
+def _preview_dir(relative_path: str) -> Path:
+    key = hashlib.sha1(relative_path.encode("utf-8")).hexdigest()
+    return get_settings().DATA_DIR / "previews" / key[:2] / key
+
+
+def _read_preview_meta(preview_dir: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with open(preview_dir / "meta.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _preview_meta_fresh(meta: Optional[Dict[str, Any]], etag: str) -> bool:
+    """Stored levels match both the source version and the configured sizes"""
+    return (
+        meta is not None
+        and meta.get("etag") == etag
+        and sorted(int(size) for size in meta.get("levels", {}))
+        == get_settings().PREVIEW_SIZES
+    )
+
+
+def closest_preview_size(width: int) -> int:
+    """Smallest configured preview level that still covers width"""
+    sizes = get_settings().PREVIEW_SIZES
+    return next((size for size in sizes if size >= width), sizes[-1])
+
+
+def generate_preview_pyramid(
+    full_path: Path, relative_path: str, etag: str
+) -> Dict[str, Any]:
+    """Decode an image once and store every configured preview size
+
+    Levels are produced largest-first, each one downscaled from the level above
+    it, so the original is only decoded a single time. Returns the metadata
+    describing the stored levels.
+    """
+    settings = get_settings()
+    preview_dir = _preview_dir(relative_path)
+
+    with _preview_locks[hash(relative_path) % PREVIEW_LOCK_STRIPES]:
+        # Another request may have finished the work while we waited
+        meta = _read_preview_meta(preview_dir)
+        if _preview_meta_fresh(meta, etag):
+            return meta
+
+        preview_dir.mkdir(parents=True, exist_ok=True)
+        largest = settings.PREVIEW_SIZES[-1]
+
+        img = Image.open(full_path)
+        orientation = img.getexif().get(EXIF_ORIENTATION)
+        # Let JPEG decode straight at reduced scale when the source is huge
+        img.draft("RGB", (largest, largest))
+        img = flatten_transparency(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        levels = {}
+        for size in reversed(settings.PREVIEW_SIZES):
+            if size < max(img.size):
+                img = img.copy()
+                img.thumbnail((size, size), Image.Resampling.LANCZOS)
+            level_path = preview_dir / f"{size}.webp"
+            tmp_path = level_path.with_suffix(".tmp")
+            tmp_path.write_bytes(encode_image(img, "webp"))
+            os.replace(tmp_path, level_path)
+            levels[str(size)] = {"width": img.width, "height": img.height}
+
+        # The smallest level is plenty for the perceptual hash
+        store_perceptual_hash(full_path, dhash(img, orientation))
+
+        meta = {"etag": etag, "source": relative_path, "levels": levels}
+        tmp_meta = preview_dir / "meta.json.tmp"
+        tmp_meta.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp_meta, preview_dir / "meta.json")
+
+        logger.info("Preview pyramid generated", file=relative_path, levels=levels)
+        return meta
+
+
+def get_preview_path(
+    full_path: Path, relative_path: str, etag: str, width: int
+) -> Path:
+    """Path of the stored preview closest to width, generating it if stale"""
+    preview_dir = _preview_dir(relative_path)
+    if not _preview_meta_fresh(_read_preview_meta(preview_dir), etag):
+        generate_preview_pyramid(full_path, relative_path, etag)
+    return preview_dir / f"{closest_preview_size(width)}.webp"
+
+
+def preview_ready(relative_path: str, etag: str) -> bool:
+    """True when the stored pyramid matches this version of the image"""
+    return _preview_meta_fresh(_read_preview_meta(_preview_dir(relative_path)), etag)
+
+
+# ============================================================================
+# THUMBNAIL JOBS
+# ============================================================================
+
+# 1x1 transparent GIF served while a thumbnail is being generated
+PLACEHOLDER_GIF = (
+    b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04"
+    b"\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+)
+
+# Finished and failed jobs are remembered this long (seconds)
+THUMBNAIL_JOB_RETENTION = 600
+
+
+class ThumbnailJobQueue:
+    """De-duplicated background preview generation with completion events
+
+    One job per image version: requests for an image that is already queued
+    or rendering get the existing job. Jobs run on thumbnail_executor;
+    subscribers (the /api/thumbnails/events stream) are told when each one
+    finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}  # job id -> job
+        self._by_path: Dict[str, str] = {}  # relative path -> latest job id
+        self._subscribers: List[tuple] = []  # (event loop, asyncio.Queue)
+
+    def enqueue(self, full_path: Path, relative_path: str, etag: str) -> Dict[str, Any]:
+        """The job producing this image version's pyramid, started if needed"""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(self._by_path.get(relative_path, ""))
+            if job is not None and job["etag"] == etag and job["status"] != "done":
+                return dict(job)
+
+            job = {
+                "id": secrets.token_hex(8),
+                "path": relative_path,
+                "etag": etag,
+                "status": "queued",
+                "error": None,
+                "created": time.time(),
+                "finished": None,
+            }
+            self._jobs[job["id"]] = job
+            self._by_path[relative_path] = job["id"]
+
+        future = thumbnail_executor.submit(self._run, job, full_path)
+        future.add_done_callback(lambda f, job=job: self._finished(job, f))
+        return dict(job)
+
+    def _run(self, job: Dict[str, Any], full_path: Path):
+        job["status"] = "running"
+        generate_preview_pyramid(full_path, job["path"], job["etag"])
+
+    def _finished(self, job: Dict[str, Any], future):
+        error = CancelledError() if future.cancelled() else future.exception()
+        with self._lock:
+            job["status"] = "failed" if error else "done"
+            job["error"] = str(error) if error else None
+            job["finished"] = time.time()
+            subscribers = list(self._subscribers)
+        if error:
+            logger.error(
+                "Thumbnail generation failed", file=job["path"], error=str(error)
+            )
+        event = {"id": job["id"], "path": job["path"], "status": job["status"]}
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def _prune(self):
+        # Caller holds the lock
+        cutoff = time.time() - THUMBNAIL_JOB_RETENTION
+        for job_id, job in list(self._jobs.items()):
+            if job["finished"] is not None and job["finished"] < cutoff:
+                del self._jobs[job_id]
+                if self._by_path.get(job["path"]) == job_id:
+                    del self._by_path[job["path"]]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1000)
+        with self._lock:
+            self._subscribers.append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[1] is not queue]
+
+
+thumbnail_jobs = ThumbnailJobQueue()
+
+
+def thumbnail_pending_response(job: Dict[str, Any]) -> Response:
+    """202 with a placeholder image, a retry hint and the job's status URL"""
+    if job["status"] == "failed":
+        raise HTTPException(
+            status_code=500, detail=f"Error generating thumbnail: {job['error']}"
+        )
+    return Response(
+        content=PLACEHOLDER_GIF,
+        status_code=202,
+        media_type="image/gif",
+        headers={
+            "Retry-After": "1",
+            "Location": f"/api/thumbnails/jobs/{job['id']}",
+            "X-Thumbnail-Job": job["id"],
+            "Cache-Control": "no-store",
+        },
+    )
+
+
+# ============================================================================
+# DISK WRITE SCHEDULER
+# ============================================================================
+
+
+class DiskWriteScheduler:
+    """Caps concurrent disk writers and applies backpressure to uploads
+
+    Each upload accumulates its body into WRITE_BLOCK_SIZE blocks and hands
+    whole blocks to the scheduler, which lets at most MAX_DISK_WRITERS of them
+    hit the disk at once. Parallel uploads therefore turn into a sequence of
+    large sequential writes instead of interleaved small ones. An upload waits
+    for its block to be written before reading more of its body, and waits
+    up front when the global buffered total is over budget, so slow disks
+    push back on clients through TCP flow control.
+    """
+
+    def __init__(self, max_writers: int, max_buffered: int):
+        self.max_writers = max_writers
+        self.max_buffered = max_buffered
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_writers, thread_name_prefix="disk-writer"
+        )
+        self._writers: Optional[asyncio.Semaphore] = None
+        self._buffer_freed: Optional[asyncio.Condition] = None
+        self.buffered_bytes = 0
+        self.queued_writes = 0
+        self.active_writes = 0
+        self.active_uploads = 0
+        self.bytes_written = 0
+        self.writes_completed = 0
+        self.total_wait_time = 0.0
+        self._recent: deque = deque()  # (timestamp, bytes) for throughput
+
+    def _primitives(self):
+        # Created lazily so they bind to the running event loop
+        if self._writers is None:
+            self._writers = asyncio.Semaphore(self.max_writers)
+            self._buffer_freed = asyncio.Condition()
+        return self._writers, self._buffer_freed
+
+    async def reserve(self, size: int):
+        """Wait until size more bytes may be buffered (backpressure)"""
+        _, buffer_freed = self._primitives()
+        async with buffer_freed:
+            await buffer_freed.wait_for(
+                lambda: self.buffered_bytes == 0
+                or self.buffered_bytes + size <= self.max_buffered
+            )
+            self.buffered_bytes += size
+
+    async def write_block(self, f, data: bytes):
+        """Queue one coalesced block and wait until it is on disk"""
+        writers, buffer_freed = self._primitives()
+        queued_at = time.monotonic()
+        acquired = False
+        self.queued_writes += 1
+        try:
+            async with writers:
+                acquired = True
+                self.queued_writes -= 1
+                self.total_wait_time += time.monotonic() - queued_at
+                self.active_writes += 1
+                try:
+                    await asyncio.get_running_loop().run_in_executor(
+                        self._executor, self._write_all, f, data
+                    )
+                finally:
+                    self.active_writes -= 1
+        finally:
+            if not acquired:
+                self.queued_writes -= 1
+            async with buffer_freed:
+                self.buffered_bytes -= len(data)
+                buffer_freed.notify_all()
+
+        now = time.monotonic()
+        self.bytes_written += len(data)
+        self.writes_completed += 1
+        self._recent.append((now, len(data)))
+        while self._recent and now - self._recent[0][0] > 10:
+            self._recent.popleft()
+
+    @staticmethod
+    def _write_all(f, data: bytes):
+        # Unbuffered writes may be partial
+        view = memoryview(data)
+        while view:
+            view = view[f.write(view) :]
+
+    def sink(self, f, block_size: int) -> "UploadSink":
+        return UploadSink(self, f, block_size)
+
+    def metrics(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        window = [(t, n) for t, n in self._recent if now - t <= 10]
+        recent_bytes = sum(n for _, n in window)
+        return {
+            "max_writers": self.max_writers,
+            "active_writes": self.active_writes,
+            "queued_writes": self.queued_writes,
+            "active_uploads": self.active_uploads,
+            "buffered_bytes": self.buffered_bytes,
+            "max_buffered_bytes": self.max_buffered,
+            "bytes_written": self.bytes_written,
+            "writes_completed": self.writes_completed,
+            "avg_queue_wait_ms": (
+                round(self.total_wait_time / self.writes_completed * 1000, 2)
+                if self.writes_completed
+                else 0.0
+            ),
+            "throughput_bytes_per_sec": round(recent_bytes / 10, 2),
+            "throughput_human": f"{format_bytes(recent_bytes / 10)}/s",
+        }
+
+
+class UploadSink:
+    """Per-upload buffer that feeds whole blocks to the write scheduler"""
+
+    def __init__(self, scheduler: DiskWriteScheduler, f, block_size: int):
+        self.scheduler = scheduler
+        self.f = f
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.reserved = 0
+
+    async def __aenter__(self):
+        self.scheduler.active_uploads += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self.flush()
+        finally:
+            self.scheduler.active_uploads -= 1
+            if self.reserved:
+                # Upload aborted with data still buffered: hand back the budget
+                _, buffer_freed = self.scheduler._primitives()
+                async with buffer_freed:
+                    self.scheduler.buffered_bytes -= self.reserved
+                    buffer_freed.notify_all()
+                self.reserved = 0
+
+    async def write(self, chunk: bytes):
+        await self.scheduler.reserve(len(chunk))
+        self.reserved += len(chunk)
+        self.buffer += chunk
+        if len(self.buffer) >= self.block_size:
+            await self.flush()
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        block = bytes(self.buffer)
+        self.buffer.clear()
+        self.reserved -= len(block)
+        await self.scheduler.write_block(self.f, block)
+
+
+_disk_write_schedulers: Dict[int, DiskWriteScheduler] = {}
+
+
+def get_disk_write_scheduler(device: int = 0) -> DiskWriteScheduler:
+    """Write scheduler for one disk (st_dev)
+
+    Pool volumes on different disks write in parallel, while writes to each
+    disk stay capped at MAX_DISK_WRITERS.
+    """
+    scheduler = _disk_write_schedulers.get(device)
+    if scheduler is None:
+        settings = get_settings()
+        scheduler = _disk_write_schedulers.setdefault(
+            device,
+            DiskWriteScheduler(
+                max_writers=settings.MAX_DISK_WRITERS,
+                max_buffered=settings.MAX_BUFFERED_UPLOAD_BYTES,
+            ),
+        )
+    return scheduler
+
+
+def get_scheduler_for(path: Path) -> DiskWriteScheduler:
+    """Write scheduler of the disk a new file at path will be written to"""
+    return get_disk_write_scheduler(os.stat(path.parent).st_dev)
+
+
+# ============================================================================
+# CHUNKED UPLOADS
+# ============================================================================
+
+
+class UploadSession:
+    """A file being uploaded as independently sent (possibly parallel) chunks
+
+    Chunks are written at their offset into a preallocated temp file next to
+    the destination; completing the session renames it into place.
+    """
+
+    def __init__(self, target_path: Path, data_path: Path, tmp_path: Path, size: int):
+        self.target_path = target_path
+        self.data_path = data_path
+        self.tmp_path = tmp_path
+        self.size = size
+        self.chunks: Dict[int, int] = {}  # offset -> length, for received chunks
+        self.active_writes = 0
+        self.last_activity = time.monotonic()
+
+    def missing_ranges(self) -> List[List[int]]:
+        """[start, end) ranges not yet covered by a received chunk"""
+        missing = []
+        position = 0
+        for offset, length in sorted(self.chunks.items()):
+            if offset > position:
+                missing.append([position, offset])
+            position = max(position, offset + length)
+        if position < self.size:
+            missing.append([position, self.size])
+        return missing
+
+
+upload_sessions: Dict[str, UploadSession] = {}
+
+# Hidden folder at each volume's root holding streamed uploads' temp files
+UPLOAD_TMP_DIR_NAME = ".fastnas-uploads"
+
+
+def upload_tmp_dir(data_path: Path) -> Path:
+    """Where to create the temp file of an upload that will land at data_path
+
+    UPLOAD_TMP_DIR_NAME on the same volume, so completing is a rename and
+    leftovers can be found at startup. A folder that is another filesystem
+    mounted inside the share gets its temp files in place instead.
+    """
+    volume = pool_volume_of(data_path) or get_settings().BASE_DIR
+    directory = volume / UPLOAD_TMP_DIR_NAME
+    directory.mkdir(exist_ok=True)
+    if directory.stat().st_dev != data_path.parent.stat().st_dev:
+        return data_path.parent
+    return directory
+
+
+def expire_upload_sessions():
+    """Drop sessions idle for longer than UPLOAD_SESSION_TTL"""
+    deadline = time.monotonic() - get_settings().UPLOAD_SESSION_TTL
+    for upload_id, session in list(upload_sessions.items()):
+        if session.active_writes == 0 and session.last_activity < deadline:
+            del upload_sessions[upload_id]
+            session.tmp_path.unlink(missing_ok=True)
+            logger.info("Upload session expired", upload_id=upload_id)
+
+
+def remove_stale_upload_parts() -> int:
+    """Empty each volume's UPLOAD_TMP_DIR_NAME of a previous run's temp files
+
+    Upload sessions live in memory, so at startup no temp file is in use:
+    whatever a crash or restart left behind, preallocated to its full size,
+    is orphaned. Returns how many were removed.
+    """
+    removed = 0
+    for volume in pool_volumes():
+        try:
+            entries = list(os.scandir(volume / UPLOAD_TMP_DIR_NAME))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            try:
+                os.unlink(entry.path)
+                removed += 1
+            except OSError:
+                continue
+    return removed
+
+
+async def run_upload_session_expiry():
+    """Background loop: clear stale temp files, then expire idle sessions"""
+    removed = await asyncio.to_thread(remove_stale_upload_parts)
+    if removed:
+        logger.info("Removed stale upload temp files", count=removed)
+    interval = max(1, min(get_settings().UPLOAD_SESSION_TTL, 60))
+    while True:
+        await asyncio.sleep(interval)
+        expire_upload_sessions()
+
+
+def get_upload_session(upload_id: str) -> UploadSession:
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    session.last_activity = time.monotonic()
+    return session
+
+
+def sha256_of_file(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+# ============================================================================
+# DELTA SYNC
+# ============================================================================
+
+# Patch script opcodes (see apply_delta_patch)
+DELTA_OP_COPY = b"C"  # uint64 first block index, uint32 block count
+DELTA_OP_DATA = b"D"  # uint32 length, then that many literal bytes
+DELTA_OP_END = b"E"
+
+
+def default_delta_block_size(file_size: int) -> int:
+    """rsync's heuristic: about sqrt(size), rounded to a multiple of 1KB"""
+    settings = get_settings()
+    block = int(math.sqrt(file_size)) // 1024 * 1024
+    return max(settings.DELTA_MIN_BLOCK_SIZE, min(settings.DELTA_MAX_BLOCK_SIZE, block))
+
+
+def compute_block_signatures(file_path: Path, block_size: int) -> List[List[Any]]:
+    """[weak, strong] per block: Adler-32 (rolls on the client) and BLAKE2b-128"""
+    signatures = []
+    with open_logical(file_path) as f:
+        while block := f.read(block_size):
+            signatures.append(
+                [
+                    zlib.adler32(block),
+                    hashlib.blake2b(block, digest_size=16).hexdigest(),
+                ]
+            )
+    return signatures
+
+
+def _read_at(f, offset: int, length: int) -> bytes:
+    f.seek(offset)
+    return f.read(length)
+
+
+class PatchStreamReader:
+    """Exact-size reads over an async byte stream"""
+
+    def __init__(self, stream):
+        self.stream = stream.__aiter__()
+        self.buffer = bytearray()
+        self.bytes_received = 0
+
+    async def read_exact(self, size: int) -> bytes:
+        while len(self.buffer) < size:
+            try:
+                chunk = await self.stream.__anext__()
+            except StopAsyncIteration:
+                raise HTTPException(status_code=400, detail="Truncated patch")
+            self.bytes_received += len(chunk)
+            self.buffer += chunk
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    async def read_some(self, size: int) -> bytes:
+        """Up to size bytes (at least one), without buffering beyond a chunk"""
+        if not self.buffer:
+            try:
+                chunk = await self.stream.__anext__()
+            except StopAsyncIteration:
+                raise HTTPException(status_code=400, detail="Truncated patch")
+            self.bytes_received += len(chunk)
+            self.buffer += chunk
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    @property
+    def bytes_consumed(self) -> int:
+        return self.bytes_received - len(self.buffer)
+
+
+async def apply_delta_patch(
+    reader: PatchStreamReader,
+    base_path: Path,
+    sink: "UploadSink",
+    block_size: int,
+    sha256_hash,
+) -> int:
+    """Rebuild a file from the base copy plus a streamed patch script
+
+    The script is a sequence of ops: C<u64 index><u32 count> copies count
+    blocks from the base file, D<u32 length><bytes> inserts literal data and E
+    ends the script (integers are big-endian). Both the patch and the file
+    it builds are limited to MAX_UPLOAD_SIZE, and literal data is streamed
+    through in WRITE_BLOCK_SIZE pieces rather than buffered whole.
+    """
+    settings = get_settings()
+    too_large = HTTPException(
+        status_code=413,
+        detail=f"Patch exceeds maximum allowed size of {format_bytes(settings.MAX_UPLOAD_SIZE)}",
+    )
+    loop = asyncio.get_running_loop()
+    info = get_compression_info(base_path)
+    base_size = info["logical_size"] if info else base_path.stat().st_size
+    total_size = 0
+
+    with open_logical(base_path) as base:
+        while True:
+            op = await reader.read_exact(1)
+            if op == DELTA_OP_END:
+                return total_size
+
+            if op == DELTA_OP_COPY:
+                index, count = struct.unpack(">QI", await reader.read_exact(12))
+                start = index * block_size
+                end = min(start + count * block_size, base_size)
+                if count == 0 or start >= base_size:
+                    raise HTTPException(
+                        status_code=400, detail=f"Copy op out of range: block {index}"
+                    )
+                if total_size + (end - start) > settings.MAX_UPLOAD_SIZE:
+                    raise too_large
+                while start < end:
+                    length = min(settings.WRITE_BLOCK_SIZE, end - start)
+                    data = await loop.run_in_executor(
+                        None, _read_at, base, start, length
+                    )
+                    if not data:
+                        raise HTTPException(
+                            status_code=412,
+                            detail="File changed while the patch was applied",
+                        )
+                    start += len(data)
+                    total_size += len(data)
+                    sha256_hash.update(data)
+                    await sink.write(data)
+
+            elif op == DELTA_OP_DATA:
+                (length,) = struct.unpack(">I", await reader.read_exact(4))
+                if (
+                    reader.bytes_consumed + length > settings.MAX_UPLOAD_SIZE
+                    or total_size + length > settings.MAX_UPLOAD_SIZE
+                ):
+                    raise too_large
+                while length:
+                    data = await reader.read_some(
+                        min(settings.WRITE_BLOCK_SIZE, length)
+                    )
+                    length -= len(data)
+                    total_size += len(data)
+                    sha256_hash.update(data)
+                    await sink.write(data)
+
+            else:
+                raise HTTPException(status_code=400, detail=f"Unknown patch op {op!r}")
+
+
+# ============================================================================
+# METADATA DATABASE
+# ============================================================================
+
+_db_local = threading.local()
+
+
+def get_db() -> sqlite3.Connection:
+    """Per-thread connection to the server's SQLite database in DATA_DIR"""
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        data_dir = get_settings().DATA_DIR
+        data_dir.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            data_dir / "fastnas.db", timeout=30, isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _db_local.conn = conn
+    return conn
+
+
+def path_prefix_range(path: str) -> tuple:
+    """Bounds selecting every descendant of path with a plain index range scan"""
+    return path + os.sep, path + chr(ord(os.sep) + 1)
+
+
+# ============================================================================
+# STORAGE POOL
+# ============================================================================
+
+POOL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pool_locations (
+    path TEXT PRIMARY KEY,
+    volume TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pool_locations_volume ON pool_locations(volume);
+"""
+
+_pool_ready = False
+_pool_round_robin = itertools.count()
+
+
+def get_pool_db() -> sqlite3.Connection:
+    global _pool_ready
+    conn = get_db()
+    if not _pool_ready:
+        conn.executescript(POOL_SCHEMA)
+        _pool_ready = True
+    return conn
+
+
+def pool_volumes() -> List[Path]:
+    """Data volumes of the share, BASE_DIR first
+
+    BASE_DIR holds the whole namespace: every folder, and each file either
+    in place or as a symlink to its data at the same relative path on one of
+    POOL_VOLUMES. Anything that opens, stats or streams through BASE_DIR
+    keeps working; only writes and deletes go through the pool helpers.
+    """
+    settings = get_settings()
+    return [settings.BASE_DIR, *settings.POOL_VOLUMES]
+
+
+def pool_volume_of(path: Path) -> Optional[Path]:
+    """The secondary volume a resolved data path lives on, if any"""
+    for volume in get_settings().POOL_VOLUMES:
+        if path.is_relative_to(volume):
+            return volume
+    return None
+
+
+def choose_volume(relative_path: str, size: int = 0) -> Path:
+    """Volume for a new file according to POOL_PLACEMENT"""
+    settings = get_settings()
+    volumes = pool_volumes()
+    if len(volumes) == 1:
+        return volumes[0]
+
+    policy = settings.POOL_PLACEMENT
+    if policy == "by_extension":
+        target = settings.POOL_EXTENSION_MAP.get(Path(relative_path).suffix.lower())
+        if target is not None and Path(target).resolve() in volumes:
+            return Path(target).resolve()
+        policy = "most_free"
+
+    free = {volume: shutil.disk_usage(volume).free for volume in volumes}
+    candidates = [volume for volume in volumes if free[volume] > size] or volumes
+    if policy == "round_robin":
+        return candidates[next(_pool_round_robin) % len(candidates)]
+    return max(candidates, key=free.get)
+
+
+def pool_data_path(full_path: Path, size: int = 0) -> Path:
+    """Where a file's bytes live, or should be written for a new file
+
+    Overwrites stay on the file's current volume. New files are placed by
+    choose_volume, creating their parent folders on that volume.
+    """
+    if full_path.is_symlink():
+        target = full_path.resolve()
+        if pool_volume_of(target) is not None:
+            return target
+    if full_path.exists():
+        return full_path
+
+    base_dir = get_settings().BASE_DIR
+    relative_path = full_path.relative_to(base_dir)
+    volume = choose_volume(str(relative_path), size)
+    if volume == base_dir:
+        return full_path
+    data_path = volume / relative_path
+    data_path.parent.mkdir(parents=True, exist_ok=True)
+    return data_path
+
+
+def pool_link(full_path: Path, data_path: Path):
+    """Make a file written at data_path visible at full_path in the share"""
+    if data_path == full_path:
+        return
+    if not (full_path.is_symlink() and full_path.resolve() == data_path):
+        # Swap the link in atomically; .part names are ignored by tree walks
+        tmp_link = full_path.with_name(f".{full_path.name}.{secrets.token_hex(4)}.part")
+        os.symlink(data_path, tmp_link)
+        os.replace(tmp_link, full_path)
+    conn = get_pool_db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO pool_locations (path, volume) VALUES (?, ?)",
+            (
+                str(full_path.relative_to(get_settings().BASE_DIR)),
+                str(pool_volume_of(data_path)),
+            ),
+        )
+
+
+def pool_remove(full_path: Path, is_dir: bool):
+    """Delete a file's or folder's data from the secondary volumes
+
+    Call after removing the entry from the share itself.
+    """
+    settings = get_settings()
+    relative_path = str(full_path.relative_to(settings.BASE_DIR))
+    for volume in settings.POOL_VOLUMES:
+        data_path = volume / relative_path
+        if is_dir:
+            shutil.rmtree(data_path, ignore_errors=True)
+        else:
+            data_path.unlink(missing_ok=True)
+    low, high = path_prefix_range(relative_path)
+    conn = get_pool_db()
+    with conn:
+        conn.execute(
+            "DELETE FROM pool_locations WHERE path = ? OR (path >= ? AND path < ?)",
+            (relative_path, low, high),
+        )
+
+
+def get_pool_summary() -> List[Dict[str, Any]]:
+    """Per-volume space and number of files placed there"""
+    placed = dict(
+        get_pool_db().execute(
+            "SELECT volume, COUNT(*) FROM pool_locations GROUP BY volume"
+        )
+    )
+    summary = []
+    for volume in pool_volumes():
+        usage = shutil.disk_usage(volume)
+        summary.append(
+            {
+                "path": str(volume),
+                "primary": volume == get_settings().BASE_DIR,
+                "device": os.stat(volume).st_dev,
+                "total_space": usage.total,
+                "used_space": usage.used,
+                "free_space": usage.free,
+                # Files in BASE_DIR itself are not tracked individually
+                "placed_files": (
+                    None
+                    if volume == get_settings().BASE_DIR
+                    else placed.get(str(volume), 0)
+                ),
+            }
+        )
+    return summary
+
+
+# ============================================================================
+# FAST TIER
+# ============================================================================
+
+FAST_TIER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fast_tier (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+"""
+
+# Untracked files' read counts are halved when this many are being counted
+FAST_TIER_MAX_TRACKED = 10000
+
+
+class FastTier:
+    """Read cache of hot files on a fast disk
+
+    download_file and stream_video count reads per file. A file read
+    FAST_TIER_PROMOTE_HITS times is copied into FAST_TIER_DIR in the
+    background, and later reads are served from the copy while the
+    original's size and mtime still match the copied version. The tier stays
+    under FAST_TIER_MAX_BYTES by evicting the least recently (lru) or least
+    frequently (lfu) read copies.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, promote_hits: int, policy: str):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.promote_hits = promote_hits
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="fast-tier"
+        )
+        self._counts: Dict[str, int] = {}  # Reads of files not in the tier
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._promoting: set = set()
+        self.bytes_cached = 0
+        self.served_fast = 0
+        self.served_slow = 0
+        self.promotions = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        directory.mkdir(parents=True, exist_ok=True)
+        conn = get_db()
+        conn.executescript(FAST_TIER_SCHEMA)
+        for path, size, mtime_ns, hits, last_access in conn.execute(
+            "SELECT path, size, mtime_ns, hits, last_access FROM fast_tier"
+        ).fetchall():
+            if self._copy_path(path).is_file():
+                self._entries[path] = {
+                    "size": size,
+                    "mtime_ns": mtime_ns,
+                    "hits": hits,
+                    "last_access": last_access,
+                }
+                self.bytes_cached += size
+            else:
+                with conn:
+                    conn.execute("DELETE FROM fast_tier WHERE path = ?", (path,))
+
+    def _copy_path(self, relative_path: str) -> Path:
+        digest = hashlib.sha1(relative_path.encode("utf-8")).hexdigest()
+        return self.directory / digest[:2] / digest
+
+    def open_copy(
+        self, relative_path: str, full_path: Path, stat: os.stat_result
+    ) -> Optional[BinaryIO]:
+        """Open full_path's fast copy if it is valid, counting the access
+
+        The copy is opened under the lock, so an eviction or invalidation
+        that deletes it afterwards cannot pull it away from the reader.
+        Returns None when the original should be read instead.
+        """
+        with self._lock:
+            entry = self._entries.get(relative_path)
+            if entry is not None:
+                if (entry["size"], entry["mtime_ns"]) == (
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                ):
+                    try:
+                        copy = open(self._copy_path(relative_path), "rb")
+                    except OSError as e:
+                        logger.warning(
+                            "Fast tier copy unreadable",
+                            file=relative_path,
+                            error=str(e),
+                        )
+                        self._forget(relative_path)
+                    else:
+                        entry["hits"] += 1
+                        entry["last_access"] = time.time()
+                        self.served_fast += 1
+                        return copy
+                else:
+                    # Original changed since it was copied
+                    self._forget(relative_path)
+                    self.invalidations += 1
+
+            self.served_slow += 1
+            count = self._counts.get(relative_path, 0) + 1
+            self._counts[relative_path] = count
+            if len(self._counts) > FAST_TIER_MAX_TRACKED:
+                # Age the counts so only recently hot files get promoted
+                self._counts = {
+                    path: n // 2 for path, n in self._counts.items() if n > 1
+                }
+            if (
+                count >= self.promote_hits
+                and relative_path not in self._promoting
+                and stat.st_size <= self.max_bytes
+            ):
+                self._promoting.add(relative_path)
+                self._executor.submit(self._promote, relative_path, full_path)
+        return None
+
+    def _forget(self, relative_path: str):
+        # Caller holds the lock; the file work happens on the tier's thread
+        entry = self._entries.pop(relative_path)
+        self.bytes_cached -= entry["size"]
+        self._executor.submit(self._delete_copy, relative_path)
+
+    def _delete_copy(self, relative_path: str):
+        self._copy_path(relative_path).unlink(missing_ok=True)
+        conn = get_db()
+        with conn:
+            conn.execute("DELETE FROM fast_tier WHERE path = ?", (relative_path,))
+
+    def _eviction_key(self, relative_path: str):
+        entry = self._entries[relative_path]
+        if self.policy == "lfu":
+            return (entry["hits"], entry["last_access"])
+        return entry["last_access"]
+
+    def _promote(self, relative_path: str, full_path: Path):
+        try:
+            stat = full_path.stat()
+            with self._lock:
+                while (
+                    self._entries and self.bytes_cached + stat.st_size > self.max_bytes
+                ):
+                    victim = min(self._entries, key=self._eviction_key)
+                    self._forget(victim)
+                    self.evictions += 1
+                self.bytes_cached += stat.st_size  # Reserved while copying
+
+            copy_path = self._copy_path(relative_path)
+            copy_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = copy_path.with_suffix(".tmp")
+            copied = False
+            try:
+                shutil.copyfile(full_path, tmp_path)
+                after = full_path.stat()
+                if (after.st_size, after.st_mtime_ns) == (
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                ):
+                    os.replace(tmp_path, copy_path)
+                    copied = True
+            finally:
+                tmp_path.unlink(missing_ok=True)
+
+            with self._lock:
+                if not copied:
+                    self.bytes_cached -= stat.st_size
+                    return
+                hits = self._counts.pop(relative_path, 0)
+                self._entries[relative_path] = {
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "hits": hits,
+                    "last_access": time.time(),
+                }
+                self.promotions += 1
+            conn = get_db()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO fast_tier VALUES (?, ?, ?, ?, ?)",
+                    (relative_path, stat.st_size, stat.st_mtime_ns, hits, time.time()),
+                )
+            logger.info("Promoted to fast tier", file=relative_path, size=stat.st_size)
+        except OSError as e:
+            logger.warning(
+                "Fast tier promotion failed", file=relative_path, error=str(e)
+            )
+        finally:
+            with self._lock:
+                self._promoting.discard(relative_path)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            served = self.served_fast + self.served_slow
+            hottest = sorted(
+                self._entries.items(), key=lambda item: item[1]["hits"], reverse=True
+            )[:10]
+            return {
+                "enabled": True,
+                "directory": str(self.directory),
+                "policy": self.policy,
+                "max_bytes": self.max_bytes,
+                "bytes_cached": self.bytes_cached,
+                "files_cached": len(self._entries),
+                "served_fast": self.served_fast,
+                "served_slow": self.served_slow,
+                "hit_ratio": round(self.served_fast / served, 4) if served else 0.0,
+                "promotions": self.promotions,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hottest": [
+                    {"path": path, "hits": entry["hits"], "size": entry["size"]}
+                    for path, entry in hottest
+                ],
+            }
+
+
+@lru_cache()
+def get_fast_tier() -> Optional[FastTier]:
+    """The fast tier, or None when FAST_TIER_DIR is not configured"""
+    settings = get_settings()
+    if settings.FAST_TIER_DIR is None:
+        return None
+    return FastTier(
+        settings.FAST_TIER_DIR,
+        settings.FAST_TIER_MAX_BYTES,
+        settings.FAST_TIER_PROMOTE_HITS,
+        settings.FAST_TIER_POLICY,
+    )
+
+
+def open_fast_copy(full_path: Path, stat: os.stat_result) -> Optional[BinaryIO]:
+    """full_path's valid fast copy opened for download/stream, else None"""
+    fast_tier = get_fast_tier()
+    if fast_tier is None:
+        return None
+    relative_path = str(full_path.relative_to(get_settings().BASE_DIR))
+    return fast_tier.open_copy(relative_path, full_path, stat)
+
+
+def iter_tiered_range(
+    full_path: Path,
+    stat: os.stat_result,
+    start: int,
+    end: int,
+    chunk_size: int = 64 * 1024,
+):
+    """iter_file_range over full_path's fast copy if valid, else full_path
+
+    The copy is opened on the first read rather than when the response is
+    built, so a body that never starts (416, early disconnect) holds no fd.
+    """
+    source = open_fast_copy(full_path, stat) or full_path
+    yield from iter_file_range(source, start, end, chunk_size)
+
+
+# ============================================================================
+# CHANGE JOURNAL
+# ============================================================================
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    op TEXT NOT NULL,
+    is_dir INTEGER NOT NULL DEFAULT 0,
+    size INTEGER,
+    mtime REAL,
+    old_path TEXT,
+    source TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_path ON changes(path);
+CREATE TABLE IF NOT EXISTS fs_state (
+    path TEXT PRIMARY KEY,
+    is_dir INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS journal_meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_journal_ready = False
+
+
+def get_journal_db() -> sqlite3.Connection:
+    global _journal_ready
+    conn = get_db()
+    if not _journal_ready:
+        conn.executescript(JOURNAL_SCHEMA)
+        _journal_ready = True
+    return conn
+
+
+def _journal_meta(conn: sqlite3.Connection, key: str, default: int = 0) -> int:
+    row = conn.execute(
+        "SELECT value FROM journal_meta WHERE key = ?", (key,)
+    ).fetchone()
+    return int(row[0]) if row else default
+
+
+def _set_journal_meta(conn: sqlite3.Connection, key: str, value: int):
+    conn.execute(
+        "INSERT OR REPLACE INTO journal_meta (key, value) VALUES (?, ?)",
+        (key, str(value)),
+    )
+
+
+def _journal_remove(
+    conn: sqlite3.Connection,
+    relative_path: str,
+    source: str,
+    now: float,
+    is_dir: Optional[bool] = None,
+):
+    if is_dir is None:
+        row = conn.execute(
+            "SELECT is_dir FROM fs_state WHERE path = ?", (relative_path,)
+        ).fetchone()
+        is_dir = bool(row and row[0])
+    conn.execute(
+        "INSERT INTO changes (path, op, is_dir, source, ts)"
+        " VALUES (?, 'deleted', ?, ?, ?)",
+        (relative_path, int(is_dir), source, now),
+    )
+    low, high = path_prefix_range(relative_path)
+    conn.execute(
+        "DELETE FROM fs_state WHERE path = ? OR (path >= ? AND path < ?)",
+        (relative_path, low, high),
+    )
+
+
+def record_change(
+    op: str,
+    full_path: Path,
+    old_path: Optional[Path] = None,
+    source: str = "api",
+    is_dir: Optional[bool] = None,
+):
+    """Append a change (created, modified, deleted) to the journal
+
+    Also updates the scanner's view of the tree so changes made through the
+    API are not reported a second time by the external-change scan. A move is
+    journaled as a delete of old_path followed by a create of full_path.
+    """
+    base_dir = get_settings().BASE_DIR
+    relative_path = str(full_path.relative_to(base_dir))
+    now = time.time()
+
+    path_cache = get_path_cache()
+    path_cache.invalidate(full_path)
+    if old_path is not None:
+        path_cache.invalidate(old_path)
+
+    try:
+        conn = get_journal_db()
+        with conn:
+            if old_path is not None:
+                _journal_remove(conn, str(old_path.relative_to(base_dir)), source, now)
+
+            if op == "deleted":
+                _journal_remove(conn, relative_path, source, now, is_dir)
+                return
+
+            stat = full_path.stat()
+            is_dir = full_path.is_dir()
+            size = 0 if is_dir else stat.st_size
+            conn.execute(
+                "INSERT INTO changes"
+                " (path, op, is_dir, size, mtime, old_path, source, ts)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    relative_path,
+                    op,
+                    int(is_dir),
+                    size,
+                    stat.st_mtime,
+                    str(old_path.relative_to(base_dir)) if old_path else None,
+                    source,
+                    now,
+                ),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO fs_state (path, is_dir, size, mtime_ns)"
+                " VALUES (?, ?, ?, ?)",
+                (relative_path, int(is_dir), size, stat.st_mtime_ns),
+            )
+    except (sqlite3.Error, OSError) as e:
+        # The journal must never make a successful file operation fail
+        logger.error("Change journal write failed", path=relative_path, error=str(e))
+
+
+def refresh_fs_state(full_path: Path):
+    """Update the scanner's snapshot of one file without journaling a change"""
+    get_path_cache().invalidate(full_path)
+    stat = full_path.stat()
+    conn = get_journal_db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO fs_state (path, is_dir, size, mtime_ns)"
+            " VALUES (?, 0, ?, ?)",
+            (
+                str(full_path.relative_to(get_settings().BASE_DIR)),
+                stat.st_size,
+                stat.st_mtime_ns,
+            ),
+        )
+
+
+def iter_tree(base_dir: Path):
+    """Yield (relative_path, is_dir, stat) for every entry below base_dir"""
+    stack = [str(base_dir)]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith(".") and entry.name.endswith(".part"):
+                        continue  # In-flight upload temp file
+                    if entry.name in INTERNAL_DIR_NAMES and is_internal_path(
+                        entry.path
+                    ):
+                        continue
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        # Follows pooled files' symlinks to their data
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    yield os.path.relpath(entry.path, base_dir), is_dir, stat
+                    if is_dir:
+                        stack.append(entry.path)
+        except (PermissionError, FileNotFoundError):
+            continue
+
+
+def walk_tree_state(base_dir: Path) -> Dict[str, tuple]:
+    """(is_dir, size, mtime_ns) for every entry below base_dir"""
+    return {
+        path: (int(is_dir), 0 if is_dir else stat.st_size, stat.st_mtime_ns)
+        for path, is_dir, stat in iter_tree(base_dir)
+    }
+
+
+def scan_external_changes() -> int:
+    """Diff the tree against the last scan and journal changes made outside
+    the API. The very first scan only records a baseline. Returns the number
+    of changes journaled.
+    """
+    conn = get_journal_db()
+    previous = {
+        path: (is_dir, size, mtime_ns)
+        for path, is_dir, size, mtime_ns in conn.execute(
+            "SELECT path, is_dir, size, mtime_ns FROM fs_state"
+        )
+    }
+    current = walk_tree_state(get_settings().BASE_DIR)
+
+    baseline_done = _journal_meta(conn, "baseline_done") == 1
+    now = time.time()
+    changes = 0
+    with conn:
+        if baseline_done:
+            for path in previous.keys() - current.keys():
+                # Children of a deleted folder are implied by the folder's entry
+                parent = os.path.dirname(path)
+                if parent in previous and parent not in current:
+                    continue
+                conn.execute(
+                    "INSERT INTO changes (path, op, is_dir, source, ts)"
+                    " VALUES (?, 'deleted', ?, 'scan', ?)",
+                    (path, previous[path][0], now),
+                )
+                changes += 1
+            for path, state in current.items():
+                if previous.get(path) == state:
+                    continue
+                if state[0] and path in previous:
+                    continue  # A folder's mtime only reflects child changes
+                conn.execute(
+                    "INSERT INTO changes (path, op, is_dir, size, mtime, source, ts)"
+                    " VALUES (?, ?, ?, ?, ?, 'scan', ?)",
+                    (
+                        path,
+                        "modified" if path in previous else "created",
+                        state[0],
+                        state[1],
+                        state[2] / 1e9,
+                        now,
+                    ),
+                )
+                changes += 1
+        conn.execute("DELETE FROM fs_state")
+        conn.executemany(
+            "INSERT INTO fs_state (path, is_dir, size, mtime_ns) VALUES (?, ?, ?, ?)",
+            ((path, *state) for path, state in current.items()),
+        )
+        _set_journal_meta(conn, "baseline_done", 1)
+
+    if changes:
+        get_path_cache().clear()
+        logger.info("External changes journaled", changes=changes)
+    return changes
+
+
+def compact_journal() -> int:
+    """Drop superseded and expired entries; returns rows removed
+
+    An entry is superseded when a later one exists for the same path, which a
+    client replaying from any cursor would see anyway. Expired entries move
+    the journal floor forward; cursors below it must do a full resync.
+    """
+    settings = get_settings()
+    conn = get_journal_db()
+    cutoff = time.time() - settings.JOURNAL_RETENTION_DAYS * 86400
+    with conn:
+        # Folder deletes stay: they imply the removal of everything below
+        removed = conn.execute(
+            "DELETE FROM changes WHERE seq NOT IN "
+            "(SELECT MAX(seq) FROM changes GROUP BY path)"
+            " AND NOT (op = 'deleted' AND is_dir = 1)"
+        ).rowcount
+        expired_floor = conn.execute(
+            "SELECT MAX(seq) FROM changes WHERE ts < ?", (cutoff,)
+        ).fetchone()[0]
+        if expired_floor is not None:
+            removed += conn.execute(
+                "DELETE FROM changes WHERE seq <= ?", (expired_floor,)
+            ).rowcount
+            _set_journal_meta(conn, "floor", expired_floor)
+    return removed
+
+
+async def run_journal_scanner():
+    """Background loop: journal external changes, then compact"""
+    interval = get_settings().JOURNAL_SCAN_INTERVAL
+    while True:
+        try:
+            await asyncio.to_thread(scan_external_changes)
+            await asyncio.to_thread(compact_journal)
+        except Exception as e:
+            logger.error("Journal scan failed", error=str(e))
+        await asyncio.sleep(interval)
+
+
+def sync_index_with_journal(
+    conn: sqlite3.Connection, name: str, table: str, index_one, remove
+) -> int:
+    """Update a per-file index from the change journal; returns files indexed
+
+    Each index follows the journal from its own cursor (kept in journal_meta
+    under name), so a pass costs O(changes). Only the first pass, or one whose
+    cursor fell off the compacted journal, walks the whole tree and drops rows
+    of table whose files are gone. index_one(conn, path) returns True if it
+    (re-)indexed the file; remove(conn, path) drops a file or folder.
+    """
+    cursor = _journal_meta(conn, f"{name}_cursor")
+    built = _journal_meta(conn, f"{name}_built") == 1
+    latest = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+    indexed = 0
+
+    if not built or cursor < _journal_meta(conn, "floor"):
+        current = walk_tree_state(get_settings().BASE_DIR)
+        known = [path for (path,) in conn.execute(f"SELECT path FROM {table}")]
+        for path in known:
+            if path not in current:
+                remove(conn, path)
+        for path, (is_dir, _, _) in current.items():
+            if not is_dir and index_one(conn, path):
+                indexed += 1
+    else:
+        for path, op, is_dir in conn.execute(
+            "SELECT path, op, is_dir FROM changes WHERE seq > ? AND seq <= ?"
+            " ORDER BY seq",
+            (cursor, latest),
+        ).fetchall():
+            if op == "deleted":
+                remove(conn, path)
+            elif not is_dir and index_one(conn, path):
+                indexed += 1
+
+    with conn:
+        _set_journal_meta(conn, f"{name}_cursor", latest)
+        _set_journal_meta(conn, f"{name}_built", 1)
+    return indexed
+
+
+# ============================================================================
+# COMPRESSION AT REST
+# ============================================================================
+
+COMPRESSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS compressed_files (
+    path TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    logical_size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ino INTEGER NOT NULL
+);
+"""
+
+_compression_ready = False
+
+
+def get_compression_db() -> sqlite3.Connection:
+    global _compression_ready
+    conn = get_db()
+    if not _compression_ready:
+        conn.executescript(COMPRESSION_SCHEMA)
+        _compression_ready = True
+    return conn
+
+
+def _compression_row_valid(row, stat: os.stat_result) -> bool:
+    # The row describes one exact on-disk file; anything else is stored raw
+    _, _, _, stored_size, mtime_ns, ino = row
+    return (
+        stored_size == stat.st_size
+        and mtime_ns == stat.st_mtime_ns
+        and ino == stat.st_ino
+    )
+
+
+def get_compression_info(
+    full_path: Path, stat: Optional[os.stat_result] = None
+) -> Optional[Dict[str, Any]]:
+    """Codec and logical size if full_path is stored compressed, else None"""
+    settings = get_settings()
+    if full_path.suffix.lower() not in settings.COMPRESSIBLE_EXTENSIONS:
+        return None
+    row = (
+        get_compression_db()
+        .execute(
+            "SELECT * FROM compressed_files WHERE path = ?",
+            (str(full_path.relative_to(settings.BASE_DIR)),),
+        )
+        .fetchone()
+    )
+    stat = stat or full_path.stat()
+    if row is None or not _compression_row_valid(row, stat):
+        return None
+    return {"codec": row[1], "logical_size": row[2], "stored_size": row[3]}
+
+
+def compressed_entries_in(directory: Path) -> Dict[str, tuple]:
+    """Compression rows for the direct children of a directory, keyed by name"""
+    base_dir = get_settings().BASE_DIR
+    relative_dir = str(directory.relative_to(base_dir))
+    if relative_dir == ".":
+        rows = get_compression_db().execute(
+            "SELECT * FROM compressed_files WHERE instr(path, ?) = 0", (os.sep,)
+        )
+    else:
+        low, high = path_prefix_range(relative_dir)
+        rows = get_compression_db().execute(
+            "SELECT * FROM compressed_files WHERE path >= ? AND path < ?",
+            (low, high),
+        )
+    return {
+        os.path.basename(row[0]): row
+        for row in rows
+        if os.path.dirname(row[0]) == ("" if relative_dir == "." else relative_dir)
+    }
+
+
+def logical_size(stat: os.stat_result, row: Optional[tuple]) -> int:
+    """User-visible size given a row from compressed_entries_in"""
+    if row is not None and _compression_row_valid(row, stat):
+        return row[2]
+    return stat.st_size
+
+
+def open_logical(full_path: Path, stat: Optional[os.stat_result] = None):
+    """Open a file for reading its original (decompressed) content"""
+    info = get_compression_info(full_path, stat)
+    if info is None:
+        return open(full_path, "rb")
+    if info["codec"] == "gzip":
+        return gzip.open(full_path, "rb")
+    return lzma.open(full_path, "rb")
+
+
+def choose_compression_codec(full_path: Path, size: int) -> Optional[str]:
+    """Pick gzip, xz or None from a sampled compression ratio
+
+    Samples 64KB from the start, middle and end of the file. xz is only used
+    when it beats gzip clearly, because gzip-stored files can be sent to
+    gzip-capable clients as-is.
+    """
+    settings = get_settings()
+    sample_size = 64 * 1024
+    with open(full_path, "rb") as f:
+        sample = b""
+        for offset in {
+            0,
+            max(0, size // 2 - sample_size // 2),
+            max(0, size - sample_size),
+        }:
+            f.seek(offset)
+            sample += f.read(sample_size)
+    if not sample:
+        return None
+
+    gzip_ratio = len(zlib.compress(sample, 6)) / len(sample)
+    if 1 - gzip_ratio < settings.COMPRESSION_MIN_SAVING:
+        return None
+    xz_ratio = len(lzma.compress(sample, preset=6)) / len(sample)
+    return "xz" if xz_ratio < gzip_ratio * 0.6 else "gzip"
+
+
+def compress_file_at_rest(full_path: Path) -> Optional[str]:
+    """Replace a file with a compressed copy if that saves enough space
+
+    The compressed copy keeps the original mtime. Its row is written before
+    the rename and names the new inode, so readers never misinterpret the
+    bytes they find on disk. Returns the codec used, or None.
+    """
+    settings = get_settings()
+    if full_path.suffix.lower() not in settings.COMPRESSIBLE_EXTENSIONS:
+        return None
+
+    stat = full_path.stat()
+    if stat.st_size < 4096 or get_compression_info(full_path, stat):
+        return None
+
+    codec = choose_compression_codec(full_path, stat.st_size)
+    if codec is None:
+        return None
+
+    data_path = pool_data_path(full_path)
+    fd, tmp_name = tempfile.mkstemp(
+        dir=data_path.parent, prefix=f".{full_path.name}.", suffix=".part"
+    )
+    os.close(fd)
+    tmp_path = Path(tmp_name)
+    try:
+        opener = gzip.open if codec == "gzip" else lzma.open
+        with open(full_path, "rb") as src, opener(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.chmod(tmp_path, stat.st_mode & 0o777)
+        os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        tmp_stat = tmp_path.stat()
+
+        if tmp_stat.st_size >= stat.st_size * (1 - settings.COMPRESSION_MIN_SAVING):
+            tmp_path.unlink()
+            return None
+
+        current = full_path.stat()
+        if (current.st_ino, current.st_size, current.st_mtime_ns) != (
+            stat.st_ino,
+            stat.st_size,
+            stat.st_mtime_ns,
+        ):
+            tmp_path.unlink()  # Modified while we were compressing
+            return None
+
+        relative_path = str(full_path.relative_to(settings.BASE_DIR))
+        conn = get_compression_db()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO compressed_files VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    relative_path,
+                    codec,
+                    stat.st_size,
+                    tmp_stat.st_size,
+                    tmp_stat.st_mtime_ns,
+                    tmp_stat.st_ino,
+                ),
+            )
+        os.replace(tmp_path, data_path)
+        # Same content to clients, so keep the change scanner quiet about it
+        refresh_fs_state(full_path)
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    logger.info(
+        "File compressed at rest",
+        file=relative_path,
+        codec=codec,
+        size=stat.st_size,
+        stored_size=tmp_stat.st_size,
+    )
+    return codec
+
+
+def schedule_compression(full_path: Path):
+    """Background-task entry point used after uploads"""
+    if not get_settings().COMPRESS_AT_REST:
+        return
+    try:
+        compress_file_at_rest(full_path)
+    except Exception as e:
+        logger.error("At-rest compression failed", file=str(full_path), error=str(e))
+
+
+def compress_existing_files():
+    """One pass over the share compressing files that qualify"""
+    settings = get_settings()
+    compressed = 0
+    for path, (is_dir, _, _) in walk_tree_state(settings.BASE_DIR).items():
+        full_path = settings.BASE_DIR / path
+        if is_dir or full_path.suffix.lower() not in settings.COMPRESSIBLE_EXTENSIONS:
+            continue
+        try:
+            if compress_file_at_rest(full_path):
+                compressed += 1
+        except Exception as e:
+            logger.error("At-rest compression failed", file=path, error=str(e))
+    # Forget rows whose files are gone or were rewritten raw
+    conn = get_compression_db()
+    stale = [
+        row[0]
+        for row in conn.execute("SELECT * FROM compressed_files").fetchall()
+        if not _row_matches_disk(row)
+    ]
+    with conn:
+        conn.executemany(
+            "DELETE FROM compressed_files WHERE path = ?", ((p,) for p in stale)
+        )
+    logger.info("At-rest compression sweep done", compressed=compressed)
+
+
+def _row_matches_disk(row) -> bool:
+    try:
+        return _compression_row_valid(row, (get_settings().BASE_DIR / row[0]).stat())
+    except OSError:
+        return False
+
+
+def get_compression_savings() -> Dict[str, int]:
+    row = (
+        get_compression_db()
+        .execute(
+            "SELECT COUNT(*), COALESCE(SUM(logical_size - stored_size), 0)"
+            " FROM compressed_files"
+        )
+        .fetchone()
+    )
+    return {"compressed_files": row[0], "compression_saved_bytes": row[1]}
+
+
+# ============================================================================
+# SNAPSHOTS
+# ============================================================================
+
+# Rows of snapshot_entries are versions of a path, valid from first_snapshot
+# to last_snapshot (NULL while still current). A file version's bytes are a
+# hardlink to its inode in an object store on the file's own volume.
+SNAPSHOT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    journal_seq INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    changed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshot_entries (
+    path TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ino INTEGER,
+    object TEXT,
+    codec TEXT,
+    first_snapshot INTEGER NOT NULL,
+    last_snapshot INTEGER
+);
+CREATE INDEX IF NOT EXISTS snapshot_entries_path ON snapshot_entries(path);
+CREATE INDEX IF NOT EXISTS snapshot_entries_object ON snapshot_entries(object);
+"""
+
+# WHERE clause (two parameters: the snapshot id twice) for rows in a snapshot
+SNAPSHOT_VISIBLE = (
+    "first_snapshot <= ? AND (last_snapshot IS NULL OR last_snapshot >= ?)"
+)
+
+# Object store folder at the root of BASE_DIR and each pool volume; hidden
+# from listings and tree walks, and not reachable through the API
+SNAPSHOT_STORE_NAME = ".fastnas-snapshots"
+# Folders the server keeps inside BASE_DIR, hidden from and closed to clients
+INTERNAL_DIR_NAMES = (SNAPSHOT_STORE_NAME, UPLOAD_TMP_DIR_NAME)
+
+# Entries recorded per transaction while taking a snapshot
+SNAPSHOT_BATCH = 1000
+
+_snapshot_ready = False
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot_db() -> sqlite3.Connection:
+    global _snapshot_ready
+    conn = get_journal_db()  # Snapshots follow the change journal
+    if not _snapshot_ready:
+        conn.executescript(SNAPSHOT_SCHEMA)
+        _snapshot_ready = True
+    return conn
+
+
+def is_internal_path(path) -> bool:
+    """True for BASE_DIR's INTERNAL_DIR_NAMES folders and anything inside"""
+    relative_path = os.path.relpath(path, get_settings().BASE_DIR)
+    return relative_path.split(os.sep, 1)[0] in INTERNAL_DIR_NAMES
+
+
+def snapshot_objects_dir(volume: Path) -> Path:
+    """Object store for file versions on one data volume
+
+    A hidden SNAPSHOT_STORE_NAME folder at the volume's root, unless
+    SNAPSHOT_DIR overrides BASE_DIR's. Hardlinks cannot cross filesystems,
+    so a store on another device is a configuration error.
+    """
+    settings = get_settings()
+    directory = volume / SNAPSHOT_STORE_NAME
+    if volume == settings.BASE_DIR and settings.SNAPSHOT_DIR is not None:
+        directory = settings.SNAPSHOT_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    if directory.stat().st_dev != volume.stat().st_dev:
+        raise ValueError(f"{directory} is not on the same filesystem as {volume}")
+    return directory
+
+
+class SnapshotBuilder:
+    """Records the live tree into snapshot snapshot_id, one path at a time
+
+    An entry whose mtime and inode match its current row costs a stat
+    and nothing else. A changed file is hardlinked into the object store
+    under its inode number, so a version linked before is simply reused.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, snapshot_id: int):
+        self.conn = conn
+        self.snapshot_id = snapshot_id
+        self.base_dir = get_settings().BASE_DIR
+        self.changed = 0
+        self._uncommitted = 0
+        self._objects_dirs: Dict[Path, Path] = {}
+
+    def _current_rows(self, relative_path: str, subtree: bool) -> Dict[str, tuple]:
+        sql = (
+            "SELECT path, rowid, is_dir, size, mtime_ns, ino, first_snapshot"
+            " FROM snapshot_entries WHERE last_snapshot IS NULL"
+        )
+        if relative_path and subtree:
+            low, high = path_prefix_range(relative_path)
+            rows = self.conn.execute(
+                sql + " AND (path = ? OR (path >= ? AND path < ?))",
+                (relative_path, low, high),
+            )
+        elif relative_path:
+            rows = self.conn.execute(sql + " AND path = ?", (relative_path,))
+        else:
+            rows = self.conn.execute(sql)
+        return {row[0]: row[1:] for row in rows}
+
+    def _close(self, row: tuple):
+        rowid, first_snapshot = row[0], row[5]
+        if first_snapshot == self.snapshot_id:
+            # Recorded earlier in this same snapshot (or an aborted attempt)
+            self.conn.execute("DELETE FROM snapshot_entries WHERE rowid = ?", (rowid,))
+        else:
+            self.conn.execute(
+                "UPDATE snapshot_entries SET last_snapshot = ? WHERE rowid = ?",
+                (self.snapshot_id - 1, rowid),
+            )
+
+    def _link(self, full_path: Path) -> tuple:
+        """Hardlink the file's current inode into the store; (object, stat)"""
+        data_path = Path(os.path.realpath(full_path))
+        volume = pool_volume_of(data_path) or self.base_dir
+        if volume not in self._objects_dirs:
+            self._objects_dirs[volume] = snapshot_objects_dir(volume)
+        objects_dir = self._objects_dirs[volume]
+
+        # Link under a temp name first: the file may be replaced at any
+        # moment, and only the link itself tells which inode we got
+        tmp_link = objects_dir / f".{secrets.token_hex(8)}.part"
+        os.link(data_path, tmp_link)
+        stat = tmp_link.stat()
+        object_path = objects_dir / f"{stat.st_ino:x}"
+        if object_path.exists():
+            tmp_link.unlink()
+        else:
+            os.rename(tmp_link, object_path)
+        return object_path, stat
+
+    def record(self, relative_path: str, is_dir: bool, row: Optional[tuple]) -> bool:
+        """Add a new version of an entry unless row already matches it"""
+        if is_dir:
+            if row is not None and row[1]:
+                return False  # A folder's mtime only reflects child changes
+            stat = (self.base_dir / relative_path).stat()
+            object_path, codec, ino, size = None, None, None, 0
+        else:
+            full_path = self.base_dir / relative_path
+            stat = full_path.stat()
+            # Writes through the API replace files with a new inode
+            if (
+                row is not None
+                and not row[1]
+                and row[3:5]
+                == (
+                    stat.st_mtime_ns,
+                    stat.st_ino,
+                )
+            ):
+                return False
+            object_path, stat = self._link(full_path)
+            info = get_compression_info(full_path, stat)
+            codec = info["codec"] if info else None
+            ino = stat.st_ino
+            size = info["logical_size"] if info else stat.st_size
+
+        if row is not None:
+            self._close(row)
+        self.conn.execute(
+            "INSERT INTO snapshot_entries"
+            " (path, is_dir, size, mtime_ns, ino, object, codec, first_snapshot)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                relative_path,
+                int(is_dir),
+                size,
+                stat.st_mtime_ns,
+                ino,
+                str(object_path) if object_path else None,
+                codec,
+                self.snapshot_id,
+            ),
+        )
+        return True
+
+    def sync(self, relative_path: str, subtree: bool):
+        """Bring the rows for a path (and everything below it) up to date"""
+        current = self._current_rows(relative_path, subtree)
+        live: Dict[str, bool] = {}
+        if not relative_path:
+            for path, is_dir, _ in iter_tree(self.base_dir):
+                live[path] = is_dir
+        else:
+            full_path = self.base_dir / relative_path
+            if full_path.exists():
+                is_dir = full_path.is_dir() and not full_path.is_symlink()
+                live[relative_path] = is_dir
+                if is_dir and subtree:
+                    for path, child_is_dir, _ in iter_tree(full_path):
+                        live[os.path.join(relative_path, path)] = child_is_dir
+
+        for path, row in current.items():
+            if path not in live:
+                self._close(row)
+                self._written()
+        for path, is_dir in live.items():
+            try:
+                if self.record(path, is_dir, current.get(path)):
+                    self._written()
+            except FileNotFoundError:
+                continue  # Gone since the walk; the journal will say so
+            except OSError as e:
+                logger.warning("Snapshot skipped entry", path=path, error=str(e))
+
+    def _written(self):
+        # Commit in batches so a first snapshot of a large share does not
+        # hold the database's write lock for its whole duration. A partial
+        # attempt is harmless: its rows carry the id the retry reuses.
+        self.changed += 1
+        self._uncommitted += 1
+        if self._uncommitted >= SNAPSHOT_BATCH:
+            self.conn.execute("COMMIT")
+            self.conn.execute("BEGIN")
+            self._uncommitted = 0
+
+
+def snapshot_changes(conn: sqlite3.Connection, since: int, until: int) -> List[tuple]:
+    """(path, subtree) pairs to re-record for journal entries since..until
+
+    Folders that were created, moved in or deleted are re-recorded with
+    everything below them, which also covers their children's entries.
+    """
+    paths: Dict[str, bool] = {}
+    for path, op, is_dir in conn.execute(
+        "SELECT path, op, is_dir FROM changes WHERE seq > ? AND seq <= ?"
+        " ORDER BY seq",
+        (since, until),
+    ):
+        paths[path] = paths.get(path, False) or bool(is_dir) or op == "deleted"
+
+    result = []
+    for path in sorted(paths):
+        parent = os.path.dirname(path)
+        while parent and not paths.get(parent):
+            parent = os.path.dirname(parent)
+        if not parent:
+            result.append((path, paths[path]))
+    return result
+
+
+def create_snapshot() -> Dict[str, Any]:
+    """Take a snapshot of the share; returns its summary
+
+    Follows the change journal from the previous snapshot's cursor, so the
+    work is proportional to what changed. The first snapshot, one whose
+    cursor fell off the compacted journal, or any snapshot while external
+    changes are not journaled (JOURNAL_SCAN_INTERVAL=0) compares the whole
+    tree by mtime and inode instead.
+    """
+    settings = get_settings()
+    started = time.perf_counter()
+    with _snapshot_lock:
+        conn = get_snapshot_db()
+        previous = conn.execute(
+            "SELECT id, journal_seq FROM snapshots ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        latest = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        snapshot_id = previous[0] + 1 if previous else 1
+        builder = SnapshotBuilder(conn, snapshot_id)
+        get_compression_db()  # Its schema script would end our transaction
+
+        conn.execute("BEGIN")
+        try:
+            if (
+                previous is None
+                or previous[1] < _journal_meta(conn, "floor")
+                or settings.JOURNAL_SCAN_INTERVAL <= 0
+            ):
+                builder.sync("", subtree=True)
+            else:
+                for path, subtree in snapshot_changes(conn, previous[1], latest):
+                    builder.sync(path, subtree)
+
+            files, total_bytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM snapshot_entries"
+                f" WHERE is_dir = 0 AND {SNAPSHOT_VISIBLE}",
+                (snapshot_id, snapshot_id),
+            ).fetchone()
+            created = time.time()
+            conn.execute(
+                "INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?)",
+                (snapshot_id, created, latest, files, total_bytes, builder.changed),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    logger.info(
+        "Snapshot created",
+        snapshot=snapshot_id,
+        files=files,
+        changed=builder.changed,
+        duration_ms=_elapsed_ms(started),
+    )
+    return snapshot_summary(
+        (snapshot_id, created, latest, files, total_bytes, builder.changed)
+    )
+
+
+def snapshot_summary(row: tuple) -> Dict[str, Any]:
+    snapshot_id, created, _, files, total_bytes, changed = row
+    return {
+        "id": snapshot_id,
+        "created": datetime.fromtimestamp(created),
+        "files": files,
+        "size": total_bytes,
+        "size_human": format_bytes(total_bytes),
+        "changed_entries": changed,
+    }
+
+
+def snapshots_to_keep(snapshots: List[tuple]) -> set:
+    """Ids kept by SNAPSHOT_KEEP_HOURLY/SNAPSHOT_KEEP_DAILY from (id, created)
+
+    The newest snapshot is always kept: it anchors the current rows that
+    the next snapshot builds on.
+    """
+    settings = get_settings()
+    newest_first = sorted(snapshots, reverse=True)
+    keep = {
+        snapshot_id
+        for snapshot_id, _ in newest_first[: max(1, settings.SNAPSHOT_KEEP_HOURLY)]
+    }
+    days = set()
+    for snapshot_id, created in newest_first:
+        day = datetime.fromtimestamp(created).date()
+        if day not in days and len(days) < settings.SNAPSHOT_KEEP_DAILY:
+            days.add(day)
+            keep.add(snapshot_id)
+    return keep
+
+
+def drop_snapshots(conn: sqlite3.Connection, snapshot_ids: List[int]):
+    """Delete snapshots, then the versions and object links only they used"""
+    with conn:
+        conn.executemany(
+            "DELETE FROM snapshots WHERE id = ?", ((i,) for i in snapshot_ids)
+        )
+        unused = conn.execute(
+            "SELECT rowid, object FROM snapshot_entries e WHERE NOT EXISTS"
+            " (SELECT 1 FROM snapshots s WHERE s.id >= e.first_snapshot"
+            " AND (e.last_snapshot IS NULL OR s.id <= e.last_snapshot))"
+        ).fetchall()
+        conn.executemany(
+            "DELETE FROM snapshot_entries WHERE rowid = ?",
+            ((rowid,) for rowid, _ in unused),
+        )
+    removed = 0
+    for object_path in {object_path for _, object_path in unused if object_path}:
+        if (
+            conn.execute(
+                "SELECT 1 FROM snapshot_entries WHERE object = ? LIMIT 1",
+                (object_path,),
+            ).fetchone()
+            is None
+        ):
+            Path(object_path).unlink(missing_ok=True)
+            removed += 1
+    logger.info("Snapshots deleted", snapshots=snapshot_ids, objects_removed=removed)
+
+
+def prune_snapshots() -> int:
+    """Apply the retention policy; returns the number of snapshots deleted"""
+    with _snapshot_lock:
+        conn = get_snapshot_db()
+        snapshots = conn.execute("SELECT id, created FROM snapshots").fetchall()
+        keep = snapshots_to_keep(snapshots)
+        doomed = [
+            snapshot_id for snapshot_id, _ in snapshots if snapshot_id not in keep
+        ]
+        if doomed:
+            drop_snapshots(conn, doomed)
+    return len(doomed)
+
+
+def newest_snapshot_time() -> Optional[float]:
+    return get_snapshot_db().execute("SELECT MAX(created) FROM snapshots").fetchone()[0]
+
+
+async def run_snapshotter():
+    """Background loop: snapshot every SNAPSHOT_INTERVAL seconds, then prune
+
+    Checks once that the object stores can hold hardlinks; if not, logs why
+    and leaves snapshots disabled instead of failing every interval.
+    """
+    interval = get_settings().SNAPSHOT_INTERVAL
+    try:
+        for volume in pool_volumes():
+            await asyncio.to_thread(snapshot_objects_dir, volume)
+    except (OSError, ValueError) as e:
+        logger.warning("Snapshots disabled", reason=str(e))
+        return
+    while True:
+        newest = await asyncio.to_thread(newest_snapshot_time)
+        wait = newest + interval - time.time() if newest else 0
+        if wait > 0:
+            await asyncio.sleep(wait)
+            continue
+        try:
+            await asyncio.to_thread(create_snapshot)
+            await asyncio.to_thread(prune_snapshots)
+        except Exception as e:
+            logger.error("Snapshot failed", error=str(e))
+            await asyncio.sleep(interval)
+
+
+def require_snapshot(snapshot_id: int):
+    if (
+        get_snapshot_db()
+        .execute("SELECT 1 FROM snapshots WHERE id = ?", (snapshot_id,))
+        .fetchone()
+        is None
+    ):
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+
+
+def snapshot_relative_path(path: str) -> str:
+    """Validated share-relative form of a path given for a snapshot"""
+    base_dir = get_settings().BASE_DIR
+    validated = validate_path_security(base_dir / path, base_dir)
+    relative_path = str(validated.relative_to(base_dir))
+    return "" if relative_path == "." else relative_path
+
+
+SNAPSHOT_ENTRY_COLUMNS = "path, is_dir, size, mtime_ns, object, codec"
+
+
+def snapshot_entry(snapshot_id: int, relative_path: str) -> Optional[tuple]:
+    return (
+        get_snapshot_db()
+        .execute(
+            f"SELECT {SNAPSHOT_ENTRY_COLUMNS} FROM snapshot_entries"
+            f" WHERE path = ? AND {SNAPSHOT_VISIBLE}",
+            (relative_path, snapshot_id, snapshot_id),
+        )
+        .fetchone()
+    )
+
+
+def snapshot_entries_below(snapshot_id: int, relative_path: str) -> List[tuple]:
+    """All entries under a folder in a snapshot, parents before children"""
+    sql = f"SELECT {SNAPSHOT_ENTRY_COLUMNS} FROM snapshot_entries WHERE {SNAPSHOT_VISIBLE}"
+    params: List[Any] = [snapshot_id, snapshot_id]
+    if relative_path:
+        low, high = path_prefix_range(relative_path)
+        sql += " AND path >= ? AND path < ?"
+        params += [low, high]
+    return get_snapshot_db().execute(sql + " ORDER BY path", params).fetchall()
+
+
+def list_snapshot_directory(snapshot_id: int, relative_path: str) -> List[FileItem]:
+    """FileItems for a folder's direct children as of a snapshot"""
+    require_snapshot(snapshot_id)
+    if relative_path:
+        entry = snapshot_entry(snapshot_id, relative_path)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Directory not found")
+        if not entry[1]:
+            raise HTTPException(status_code=400, detail="Path is not a directory")
+
+    items = []
+    for path, is_dir, size, mtime_ns, _, _ in snapshot_entries_below(
+        snapshot_id, relative_path
+    ):
+        if os.path.dirname(path) != relative_path:
+            continue
+        name = os.path.basename(path)
+        extension = os.path.splitext(name)[1].lower()
+        modified = datetime.fromtimestamp(mtime_ns / 1e9)
+        items.append(
+            FileItem(
+                name=name,
+                is_file=not is_dir,
+                is_folder=bool(is_dir),
+                file_size=size,
+                creation_date=modified,
+                modification_date=modified,
+                path=path,
+                extension=None if is_dir else extension,
+                thumbnail_url=None,
+                mime_type=mimetypes.guess_type(name)[0],
+            )
+        )
+    return items
+
+
+def open_snapshot_object(entry: tuple):
+    """Open a file version from a snapshot for reading its original content"""
+    object_path, codec = entry[4], entry[5]
+    if codec == "gzip":
+        return gzip.open(object_path, "rb")
+    if codec == "xz":
+        return lzma.open(object_path, "rb")
+    return open(object_path, "rb")
+
+
+def snapshot_file_response(snapshot_id: int, relative_path: str):
+    """Response serving a file as it was in a snapshot"""
+    require_snapshot(snapshot_id)
+    entry = snapshot_entry(snapshot_id, relative_path)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="File not found in snapshot")
+    if entry[1]:
+        raise HTTPException(status_code=400, detail="Path is not a file")
+
+    name = os.path.basename(entry[0])
+    headers = {
+        "Content-Disposition": f"attachment; filename*=utf-8''{quote(name)}",
+        "X-Snapshot": str(snapshot_id),
+    }
+    if entry[5] is None:
+        return FileResponse(
+            entry[4], media_type="application/octet-stream", headers=headers
+        )
+
+    def iterfile():
+        with open_snapshot_object(entry) as f:
+            while chunk := f.read(64 * 1024):
+                yield chunk
+
+    headers["Content-Length"] = str(entry[2])
+    return StreamingResponse(
+        iterfile(), media_type="application/octet-stream", headers=headers
+    )
+
+
+def restore_snapshot_file(entry: tuple, target: Path):
+    """Copy a file version back into the share with its original mtime
+
+    A copy rather than a link: a link would let a later in-place edit made
+    outside the API change the snapshot's version too.
+    """
+    if target.is_dir() and not target.is_symlink():
+        raise HTTPException(
+            status_code=409, detail=f"A folder exists at {entry[0]}; delete it first"
+        )
+    target.parent.mkdir(parents=True, exist_ok=True)
+    existed = target.exists()
+    data_path = pool_data_path(target, entry[2])
+    fd, tmp_name = tempfile.mkstemp(
+        dir=data_path.parent, prefix=f".{target.name}.", suffix=".part"
+    )
+    tmp_path = Path(tmp_name)
+    try:
+        with open_snapshot_object(entry) as src, open(fd, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.chmod(tmp_path, stat_module.S_IMODE(os.stat(entry[4]).st_mode))
+        os.utime(tmp_path, ns=(entry[3], entry[3]))
+        os.replace(tmp_path, data_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    pool_link(target, data_path)
+    record_change("modified" if existed else "created", target)
+
+
+def restore_from_snapshot(snapshot_id: int, relative_path: str) -> Dict[str, int]:
+    """Restore a file or folder as of a snapshot over the live share
+
+    Entries created since the snapshot are left alone; restored files
+    replace the live ones copy-on-write, so newer snapshots keep theirs.
+    """
+    require_snapshot(snapshot_id)
+    base_dir = get_settings().BASE_DIR
+    entries = []
+    if relative_path:
+        entry = snapshot_entry(snapshot_id, relative_path)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Not found in snapshot")
+        entries.append(entry)
+    if not entries or entries[0][1]:
+        entries += snapshot_entries_below(snapshot_id, relative_path)
+
+    files = folders = 0
+    for entry in entries:
+        target = base_dir / entry[0]
+        if entry[1]:
+            if target.is_file():
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"A file exists at {entry[0]}; delete it first",
+                )
+            if not target.exists():
+                target.mkdir(parents=True)
+                record_change("created", target)
+                folders += 1
+            continue
+        restore_snapshot_file(entry, target)
+        files += 1
+
+    logger.info(
+        "Restored from snapshot",
+        snapshot=snapshot_id,
+        path=relative_path,
+        files=files,
+    )
+    return {"files": files, "folders_created": folders}
+
+
+# ============================================================================
+# CONTENT SEARCH INDEX
+# ============================================================================
+
+CONTENT_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS content_docs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    extension TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS content_fts USING fts5(
+    body, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+_content_index_ready = False
+_content_index_lock = threading.Lock()
+
+
+def get_content_db() -> sqlite3.Connection:
+    global _content_index_ready
+    conn = get_journal_db()  # Cursor bookkeeping lives in journal_meta
+    if not _content_index_ready:
+        conn.executescript(CONTENT_INDEX_SCHEMA)
+        _content_index_ready = True
+    return conn
+
+
+def extract_docx_text(f) -> str:
+    """Paragraph text from word/document.xml, via zipfile and ElementTree"""
+    from xml.etree import ElementTree
+
+    word_ns = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+    with zipfile.ZipFile(f) as docx:
+        with docx.open("word/document.xml") as xml:
+            parts = []
+            for _, element in ElementTree.iterparse(xml):
+                if element.tag == f"{word_ns}t" and element.text:
+                    parts.append(element.text)
+                elif element.tag == f"{word_ns}p":
+                    parts.append("\n")
+                    element.clear()
+    return "".join(parts)
+
+
+_PDF_STREAM = re.compile(rb"stream\r?\n(.*?)\r?\nendstream", re.S)
+_PDF_TEXT_OP = re.compile(rb"\((?:\\.|[^\\)])*\)\s*Tj|\[(?:[^\]]*)\]\s*TJ", re.S)
+_PDF_STRING = re.compile(rb"\(((?:\\.|[^\\)])*)\)", re.S)
+
+
+def extract_pdf_text(data: bytes) -> str:
+    """Best-effort text from Tj/TJ operators in (Flate) content streams
+
+    Covers the common case of simple-font PDFs without a PDF library; files
+    using CID fonts or custom encodings just yield little or no text.
+    """
+    parts = []
+    for match in _PDF_STREAM.finditer(data):
+        stream = match.group(1)
+        try:
+            stream = zlib.decompress(stream)
+        except zlib.error:
+            pass  # Uncompressed (or unsupported filter); scan it as-is
+        for op in _PDF_TEXT_OP.finditer(stream):
+            for string in _PDF_STRING.findall(op.group(0)):
+                parts.append(
+                    re.sub(rb"\\([nrt()\\])", rb"\1", string).decode("latin-1")
+                )
+            parts.append(" ")
+    return "".join(parts)
+
+
+def extract_text(full_path: Path) -> str:
+    """Searchable text of a document, truncated to CONTENT_INDEX_MAX_CHARS"""
+    settings = get_settings()
+    extension = full_path.suffix.lower()
+    limit = settings.CONTENT_INDEX_MAX_CHARS
+
+    with open_logical(full_path) as f:
+        if extension == ".docx":
+            return extract_docx_text(io.BytesIO(f.read()))[:limit]
+        if extension == ".pdf":
+            return extract_pdf_text(f.read(limit * 20))[:limit]
+        return f.read(limit).decode("utf-8", errors="replace")
+
+
+def index_document(conn: sqlite3.Connection, relative_path: str) -> bool:
+    """(Re-)index one file if its size/mtime changed; True if it was indexed"""
+    settings = get_settings()
+    full_path = settings.BASE_DIR / relative_path
+    extension = full_path.suffix.lower()
+    if extension not in settings.CONTENT_INDEX_EXTENSIONS:
+        return False
+
+    try:
+        stat = full_path.stat()
+    except OSError:
+        remove_from_content_index(conn, relative_path)
+        return False
+
+    row = conn.execute(
+        "SELECT id, size, mtime_ns FROM content_docs WHERE path = ?",
+        (relative_path,),
+    ).fetchone()
+    if row and row[1] == stat.st_size and row[2] == stat.st_mtime_ns:
+        return False
+
+    try:
+        text = extract_text(full_path)
+    except Exception as e:
+        logger.warning("Text extraction failed", file=relative_path, error=str(e))
+        text = ""
+
+    with conn:
+        if row:
+            conn.execute("DELETE FROM content_fts WHERE rowid = ?", (row[0],))
+            conn.execute(
+                "UPDATE content_docs SET size = ?, mtime_ns = ? WHERE id = ?",
+                (stat.st_size, stat.st_mtime_ns, row[0]),
+            )
+            doc_id = row[0]
+        else:
+            doc_id = conn.execute(
+                "INSERT INTO content_docs (path, extension, size, mtime_ns)"
+                " VALUES (?, ?, ?, ?)",
+                (relative_path, extension, stat.st_size, stat.st_mtime_ns),
+            ).lastrowid
+        conn.execute(
+            "INSERT INTO content_fts (rowid, body) VALUES (?, ?)", (doc_id, text)
+        )
+    return True
+
+
+def remove_from_content_index(conn: sqlite3.Connection, relative_path: str):
+    """Drop a file, or a whole folder's worth of files, from the index"""
+    low, high = path_prefix_range(relative_path)
+    with conn:
+        ids = [
+            (doc_id,)
+            for (doc_id,) in conn.execute(
+                "SELECT id FROM content_docs"
+                " WHERE path = ? OR (path >= ? AND path < ?)",
+                (relative_path, low, high),
+            )
+        ]
+        conn.executemany("DELETE FROM content_fts WHERE rowid = ?", ids)
+        conn.executemany("DELETE FROM content_docs WHERE id = ?", ids)
+
+
+def update_content_index() -> int:
+    """Bring the index up to date; returns the number of files (re-)indexed"""
+    with _content_index_lock:
+        indexed = sync_index_with_journal(
+            get_content_db(),
+            "content_index",
+            "content_docs",
+            index_document,
+            remove_from_content_index,
+        )
+
+    if indexed:
+        logger.info("Content index updated", indexed=indexed)
+    return indexed
+
+
+async def run_content_indexer():
+    """Background loop keeping the full-text index current"""
+    interval = get_settings().CONTENT_INDEX_INTERVAL
+    while True:
+        try:
+            await asyncio.to_thread(update_content_index)
+        except Exception as e:
+            logger.error("Content indexing failed", error=str(e))
+        await asyncio.sleep(interval)
+
+
+def build_fts_query(q: str) -> Optional[str]:
+    """Turn user input into a safe FTS5 query
+
+    Words are ANDed; input wrapped in double quotes is matched as a phrase.
+    """
+    words = re.findall(r"\w+", q)
+    if not words:
+        return None
+    if len(q) > 1 and q.startswith('"') and q.endswith('"'):
+        return '"' + " ".join(words) + '"'
+    return " ".join(f'"{word}"' for word in words)
+
+
+_SNIPPET_MATCH = re.compile("\x02(.*?)\x03", re.S)
+
+
+def highlight_snippet(snippet: str) -> str:
+    """HTML-escape an FTS snippet, then turn its match sentinels into <mark>
+
+    The document text is untrusted, so the marks are only added after
+    escaping; stray sentinels in the text itself are dropped.
+    """
+    marked = _SNIPPET_MATCH.sub(r"<mark>\1</mark>", html.escape(snippet))
+    return marked.replace("\x02", "").replace("\x03", "")
+
+
+def search_content(
+    q: str, file_type: Optional[str], limit: int
+) -> List[Dict[str, Any]]:
+    """Ranked full-text matches with highlighted snippets"""
+    fts_query = build_fts_query(q)
+    if fts_query is None:
+        return []
+
+    sql = (
+        "SELECT d.path, d.size, d.mtime_ns, bm25(content_fts) AS score,"
+        " snippet(content_fts, 0, char(2), char(3), '…', 16)"
+        " FROM content_fts JOIN content_docs d ON d.id = content_fts.rowid"
+        " WHERE content_fts MATCH ?"
+    )
+    params: List[Any] = [fts_query]
+    if file_type:
+        sql += " AND d.extension = ?"
+        params.append(f".{file_type.lower()}")
+    sql += " ORDER BY score LIMIT ?"
+    params.append(limit)
+
+    base_dir = get_settings().BASE_DIR
+    results = []
+    for path, size, mtime_ns, score, snippet in get_content_db().execute(sql, params):
+        try:
+            compression = get_compression_info(base_dir / path)
+        except OSError:
+            continue  # Deleted since it was indexed
+        if compression:
+            size = compression["logical_size"]
+        results.append(
+            {
+                "filename": os.path.basename(path),
+                "path": path,
+                "size": size,
+                "size_human": format_bytes(size),
+                "modification_date": datetime.fromtimestamp(mtime_ns / 1e9),
+                "folder": os.path.dirname(path),
+                "extension": os.path.splitext(path)[1].lower(),
+                "thumbnail_url": None,
+                "snippet": highlight_snippet(snippet),
+                "score": round(-score, 4),
+            }
+        )
+    return results
+
+
+# ============================================================================
+# PHOTO INDEX
+# ============================================================================
+
+PHOTO_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS photos (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    taken_at TEXT NOT NULL,
+    date_source TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    camera TEXT,
+    has_gps INTEGER NOT NULL DEFAULT 0,
+    phash INTEGER
+);
+CREATE INDEX IF NOT EXISTS photos_taken ON photos(taken_at, path);
+"""
+
+# EXIF tag ids (IFD0 unless noted)
+EXIF_MAKE = 0x010F
+EXIF_MODEL = 0x0110
+EXIF_ORIENTATION = 0x0112
+EXIF_DATETIME = 0x0132
+EXIF_IFD_POINTER = 0x8769
+EXIF_GPS_IFD_POINTER = 0x8825
+EXIF_DATETIME_ORIGINAL = 0x9003  # Exif IFD
+EXIF_DATETIME_DIGITIZED = 0x9004  # Exif IFD
+
+_photo_index_ready = False
+_photo_index_lock = threading.Lock()
+
+
+def get_photo_db() -> sqlite3.Connection:
+    global _photo_index_ready
+    conn = get_journal_db()  # Cursor bookkeeping lives in journal_meta
+    if not _photo_index_ready:
+        conn.executescript(PHOTO_INDEX_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(photos)")}
+        if "phash" not in columns:  # Index built before perceptual hashing
+            conn.execute("ALTER TABLE photos ADD COLUMN phash INTEGER")
+        _photo_index_ready = True
+    return conn
+
+
+def parse_exif_datetime(value) -> Optional[datetime]:
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value.strip("\x00 ")[:19], "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None  # Blank ("    :  :  ") or malformed
+
+
+def read_photo_metadata(full_path: Path, stat: os.stat_result) -> Dict[str, Any]:
+    """Capture date, displayed dimensions, camera, GPS presence and dHash
+
+    Metadata comes from the header alone; for the perceptual hash JPEGs are
+    decoded at 1/8 scale (draft mode). Without a usable EXIF date the file's
+    mtime stands in (date_source "mtime").
+    """
+    with Image.open(full_path) as img:
+        width, height = img.size
+        exif = img.getexif()
+        exif_ifd = exif.get_ifd(EXIF_IFD_POINTER)
+        has_gps = bool(exif.get_ifd(EXIF_GPS_IFD_POINTER))
+        img.draft("L", (64, 64))
+        phash = dhash(img, exif.get(EXIF_ORIENTATION))
+
+    if exif.get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+        width, height = height, width  # Rotated 90 degrees when displayed
+
+    taken_at, date_source = None, "exif"
+    for value in (
+        exif_ifd.get(EXIF_DATETIME_ORIGINAL),
+        exif_ifd.get(EXIF_DATETIME_DIGITIZED),
+        exif.get(EXIF_DATETIME),
+    ):
+        taken_at = parse_exif_datetime(value)
+        if taken_at:
+            break
+    if taken_at is None:
+        taken_at, date_source = datetime.fromtimestamp(stat.st_mtime), "mtime"
+
+    make = str(exif.get(EXIF_MAKE) or "").strip("\x00 ")
+    model = str(exif.get(EXIF_MODEL) or "").strip("\x00 ")
+    camera = model if model.startswith(make) else f"{make} {model}".strip()
+
+    return {
+        "taken_at": taken_at.isoformat(timespec="seconds"),
+        "date_source": date_source,
+        "width": width,
+        "height": height,
+        "camera": camera or None,
+        "has_gps": has_gps,
+        "phash": phash,
+    }
+
+
+def index_photo(conn: sqlite3.Connection, relative_path: str) -> bool:
+    """(Re-)index one image if its size/mtime changed; True if it was indexed"""
+    full_path = get_settings().BASE_DIR / relative_path
+    if full_path.suffix.lower() not in IMAGE_EXTENSIONS:
+        return False
+
+    try:
+        stat = full_path.stat()
+    except OSError:
+        remove_from_photo_index(conn, relative_path)
+        return False
+
+    row = conn.execute(
+        "SELECT size, mtime_ns FROM photos WHERE path = ?", (relative_path,)
+    ).fetchone()
+    if row == (stat.st_size, stat.st_mtime_ns):
+        return False
+
+    try:
+        meta = read_photo_metadata(full_path, stat)
+    except Exception as e:
+        # Keep a row anyway so the image still shows up and isn't retried
+        logger.warning("EXIF extraction failed", file=relative_path, error=str(e))
+        meta = {
+            "taken_at": datetime.fromtimestamp(stat.st_mtime).isoformat(
+                timespec="seconds"
+            ),
+            "date_source": "mtime",
+            "width": None,
+            "height": None,
+            "camera": None,
+            "has_gps": False,
+            "phash": None,
+        }
+
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO photos (path, size, mtime_ns, taken_at,"
+            " date_source, width, height, camera, has_gps, phash)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                relative_path,
+                stat.st_size,
+                stat.st_mtime_ns,
+                meta["taken_at"],
+                meta["date_source"],
+                meta["width"],
+                meta["height"],
+                meta["camera"],
+                int(meta["has_gps"]),
+                to_sqlite_hash(meta["phash"]),
+            ),
+        )
+    perceptual_hash_index.invalidate()
+    return True
+
+
+def remove_from_photo_index(conn: sqlite3.Connection, relative_path: str):
+    """Drop an image, or every image below a folder, from the index"""
+    low, high = path_prefix_range(relative_path)
+    with conn:
+        conn.execute(
+            "DELETE FROM photos WHERE path = ? OR (path >= ? AND path < ?)",
+            (relative_path, low, high),
+        )
+    perceptual_hash_index.invalidate()
+
+
+def update_photo_index() -> int:
+    """Bring the photo index up to date; returns the number of images indexed"""
+    with _photo_index_lock:
+        indexed = sync_index_with_journal(
+            get_photo_db(),
+            "photo_index",
+            "photos",
+            index_photo,
+            remove_from_photo_index,
+        )
+    if indexed:
+        logger.info("Photo index updated", indexed=indexed)
+    return indexed
+
+
+async def run_photo_indexer():
+    """Background loop keeping the photo index current"""
+    interval = get_settings().PHOTO_INDEX_INTERVAL
+    while True:
+        try:
+            await asyncio.to_thread(update_photo_index)
+        except Exception as e:
+            logger.error("Photo indexing failed", error=str(e))
+        await asyncio.sleep(interval)
+
+
+# Maps EXIF orientation to the Image.Transpose that displays it upright
+EXIF_ORIENTATION_TRANSPOSE = {
+    2: "FLIP_LEFT_RIGHT",
+    3: "ROTATE_180",
+    4: "FLIP_TOP_BOTTOM",
+    5: "TRANSPOSE",
+    6: "ROTATE_270",
+    7: "TRANSVERSE",
+    8: "ROTATE_90",
+}
+
+
+def dhash(img: "Image.Image", orientation: Optional[int] = None) -> int:
+    """64-bit difference hash: left/right brightness gradients on a 9x8 grid
+
+    Resizing, re-encoding and small edits flip only a few bits, so visually
+    similar images have a small Hamming distance. Upright orientation is
+    applied first so a rotated re-save still matches. Transparency is
+    flattened onto white as for previews, so the indexer and the preview
+    pipeline see the same pixels.
+    """
+    img = flatten_transparency(img).convert("L")
+    if orientation in EXIF_ORIENTATION_TRANSPOSE:
+        img = img.transpose(
+            getattr(Image.Transpose, EXIF_ORIENTATION_TRANSPOSE[orientation])
+        )
+    pixels = list(img.resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def to_sqlite_hash(value: Optional[int]) -> Optional[int]:
+    # SQLite integers are signed 64-bit
+    if value is not None and value >= 1 << 63:
+        value -= 1 << 64
+    return value
+
+
+def store_perceptual_hash(full_path: Path, value: int):
+    """Record a hash computed elsewhere (thumbnail pipeline) for an indexed photo
+
+    Only fills in a missing hash: the indexer's own value, hashed from a
+    different decode size, may differ in a bit or two and is kept.
+    """
+    try:
+        stat = full_path.stat()
+        relative_path = str(full_path.relative_to(get_settings().BASE_DIR))
+        conn = get_photo_db()
+        with conn:
+            updated = conn.execute(
+                "UPDATE photos SET phash = ? WHERE path = ? AND size = ?"
+                " AND mtime_ns = ? AND phash IS NULL",
+                (to_sqlite_hash(value), relative_path, stat.st_size, stat.st_mtime_ns),
+            ).rowcount
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(
+            "Storing perceptual hash failed", file=str(full_path), error=str(e)
+        )
+        return
+    if updated:
+        perceptual_hash_index.invalidate()
+
+
+class BKTree:
+    """Metric tree over 64-bit hashes for Hamming-radius queries
+
+    Each child edge is labelled with its distance to the parent, and the
+    triangle inequality prunes every subtree outside [d - r, d + r].
+    """
+
+    def __init__(self):
+        self.root = None  # [hash, items, {distance: child}]
+
+    def add(self, value: int, item):
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = (node[0] ^ value).bit_count()
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> List[tuple]:
+        """(distance, item) for every item within radius of value"""
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = (node[0] ^ value).bit_count()
+            if distance <= radius:
+                results.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return results
+
+
+class PerceptualHashIndex:
+    """In-memory Hamming-distance search over every indexed photo's dHash
+
+    Loaded lazily from the photo index and rebuilt after it changes. With
+    NumPy a query is one XOR + popcount pass over a packed uint64 array;
+    without it a BK-tree keeps queries well below a linear scan.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stale = True
+        self._paths: List[str] = []
+        self._hashes = None  # NumPy uint64 array, or a BKTree
+
+    @property
+    def engine(self) -> str:
+        return "numpy" if optional_import("numpy") is not None else "bktree"
+
+    def invalidate(self):
+        self._stale = True
+
+    def _load(self):
+        self._stale = False  # Changes during the load trigger another one
+        rows = (
+            get_photo_db()
+            .execute("SELECT path, phash FROM photos WHERE phash IS NOT NULL")
+            .fetchall()
+        )
+        self._paths = [path for path, _ in rows]
+        np = optional_import("numpy")
+        if np is not None:
+            self._hashes = np.array([value for _, value in rows], dtype=np.int64).view(
+                np.uint64
+            )
+        else:
+            tree = BKTree()
+            for i, (_, value) in enumerate(rows):
+                tree.add(value & 0xFFFFFFFFFFFFFFFF, i)
+            self._hashes = tree
+
+    def search(self, value: int, max_distance: int) -> List[tuple]:
+        """(distance, path) of every photo within max_distance, closest first"""
+        with self._lock:
+            if self._stale:
+                self._load()
+            paths, hashes = self._paths, self._hashes
+
+        np = optional_import("numpy")
+        if np is None:
+            matches = hashes.search(value, max_distance)
+        else:
+            xor = np.bitwise_xor(hashes, np.uint64(value))
+            distances = _popcount64(xor)
+            (indices,) = np.nonzero(distances <= max_distance)
+            matches = zip(distances[indices].tolist(), indices.tolist())
+        return sorted((distance, paths[i]) for distance, i in matches)
+
+
+@lru_cache(maxsize=1)
+def _popcount_table():
+    """Bits set in each byte value, built once for NumPy < 2.0"""
+    np = optional_import("numpy")
+    return np.array([i.bit_count() for i in range(256)], dtype=np.uint8)
+
+
+def _popcount64(values):
+    np = optional_import("numpy")
+    if hasattr(np, "bitwise_count"):  # NumPy 2.0+
+        return np.bitwise_count(values)
+    return _popcount_table()[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+perceptual_hash_index = PerceptualHashIndex()
+
+
+def encode_photo_cursor(taken_at: str, path: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([taken_at, path]).encode()).decode()
+
+
+def decode_photo_cursor(cursor: str) -> tuple:
+    try:
+        taken_at, path = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(taken_at), str(path)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# ============================================================================
+# DUPLICATE FINDER
+# ============================================================================
+
+DUPLICATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    partial_hash TEXT,
+    full_hash TEXT,
+    dev INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS file_hashes_full ON file_hashes(full_hash);
+"""
+
+# Bytes hashed from each end of a file before committing to a full read
+DUPLICATE_SAMPLE_SIZE = 64 * 1024
+
+_duplicate_schema_ready = False
+
+
+def get_hash_db() -> sqlite3.Connection:
+    global _duplicate_schema_ready
+    conn = get_journal_db()  # Scan bookkeeping lives in journal_meta
+    if not _duplicate_schema_ready:
+        conn.executescript(DUPLICATE_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(file_hashes)")}
+        if "dev" not in columns:  # Hashes saved before pooled volumes were told apart
+            conn.execute(
+                "ALTER TABLE file_hashes ADD COLUMN dev INTEGER NOT NULL DEFAULT 0"
+            )
+        _duplicate_schema_ready = True
+    return conn
+
+
+class ScanCancelled(Exception):
+    pass
+
+
+def hash_file_ends(full_path: Path, size: int) -> tuple:
+    """(hash, bytes_read) over the first and last DUPLICATE_SAMPLE_SIZE bytes
+
+    Files no larger than two samples are read whole, so for them this is
+    already the full-content hash.
+    """
+    digest = hashlib.blake2b(digest_size=32)
+    with open_logical(full_path) as f:
+        if size <= 2 * DUPLICATE_SAMPLE_SIZE:
+            data = f.read()
+            digest.update(data)
+            return digest.hexdigest(), len(data)
+        digest.update(f.read(DUPLICATE_SAMPLE_SIZE))
+        f.seek(size - DUPLICATE_SAMPLE_SIZE)
+        digest.update(f.read(DUPLICATE_SAMPLE_SIZE))
+    return digest.hexdigest(), 2 * DUPLICATE_SAMPLE_SIZE
+
+
+def hash_file_full(full_path: Path, cancelled: threading.Event) -> tuple:
+    """(hash, bytes_read) over the whole file"""
+    digest = hashlib.blake2b(digest_size=32)
+    bytes_read = 0
+    with open_logical(full_path) as f:
+        while chunk := f.read(1024 * 1024):
+            if cancelled.is_set():
+                raise ScanCancelled()
+            digest.update(chunk)
+            bytes_read += len(chunk)
+    return digest.hexdigest(), bytes_read
+
+
+class DuplicateScan:
+    """Background duplicate-detection job with progress reporting
+
+    Stages: group files by size, hash the first and last 64KB of files that
+    share a size, then fully hash files that still collide. Hashes are saved
+    as they are computed and reused while a file's size, mtime, device and
+    inode are unchanged, so an interrupted or repeated scan only reads what
+    is new. Files are identified by (st_dev, st_ino): pooled files on other
+    volumes can share an inode number with files in BASE_DIR.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._cancelled = threading.Event()
+        self.progress: Dict[str, Any] = {"state": "idle"}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        """Start (or resume) a scan; False if one is already running"""
+        with self._lock:
+            if self.running:
+                return False
+            self._cancelled.clear()
+            self.progress = {
+                "state": "running",
+                "stage": "sizing",
+                "started_at": time.time(),
+                "finished_at": None,
+                "files_scanned": 0,
+                "bytes_total": 0,
+                "size_candidates": 0,
+                "partial_candidates": 0,
+                "files_to_hash": 0,
+                "files_hashed": 0,
+                "bytes_read": 0,
+                "error": None,
+            }
+            self._thread = threading.Thread(
+                target=self._run, name="duplicate-scan", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def cancel(self) -> bool:
+        if not self.running:
+            return False
+        self._cancelled.set()
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        progress = dict(self.progress)
+        if progress["state"] == "idle":
+            return progress
+        end = progress["finished_at"] or time.time()
+        progress["elapsed_seconds"] = round(end - progress["started_at"], 2)
+        progress["read_fraction"] = (
+            round(progress["bytes_read"] / progress["bytes_total"], 6)
+            if progress["bytes_total"]
+            else 0.0
+        )
+        return progress
+
+    def _run(self):
+        conn = get_hash_db()
+        with conn:
+            _set_journal_meta(conn, "duplicate_scan_pending", 1)
+        try:
+            self._scan(conn)
+        except ScanCancelled:
+            self.progress["state"] = "cancelled"
+            logger.info("Duplicate scan cancelled", **self._counters())
+        except Exception as e:
+            self.progress.update(state="failed", error=str(e))
+            logger.error("Duplicate scan failed", error=str(e))
+        else:
+            self.progress.update(state="done", stage=None)
+            with conn:
+                _set_journal_meta(conn, "duplicate_scan_pending", 0)
+                _set_journal_meta(conn, "duplicate_scan_finished", int(time.time()))
+            logger.info("Duplicate scan finished", **self._counters())
+        finally:
+            self.progress["finished_at"] = time.time()
+
+    def _counters(self) -> Dict[str, int]:
+        return {
+            key: self.progress[key]
+            for key in ("files_scanned", "files_hashed", "bytes_read", "bytes_total")
+        }
+
+    def _scan(self, conn: sqlite3.Connection):
+        settings = get_settings()
+        base_dir = settings.BASE_DIR
+        progress = self.progress
+
+        # Stage 1: sizes (logical, so a compressed copy still matches a raw one)
+        compressed = {
+            row[0]: row
+            for row in get_compression_db().execute("SELECT * FROM compressed_files")
+        }
+        files: Dict[str, tuple] = {}
+        by_size = defaultdict(list)
+        for path, is_dir, stat in iter_tree(base_dir):
+            if self._cancelled.is_set():
+                raise ScanCancelled()
+            if is_dir or not stat_module.S_ISREG(stat.st_mode):
+                continue
+            size = logical_size(stat, compressed.get(path))
+            files[path] = (
+                size,
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_dev,
+                stat.st_ino,
+            )
+            progress["files_scanned"] += 1
+            progress["bytes_total"] += size
+            if size > 0:
+                by_size[size].append(path)
+
+        # Keep hashes only for files that are unchanged since they were hashed
+        cached = {}
+        stale = []
+        for (
+            path,
+            size,
+            stored_size,
+            mtime_ns,
+            dev,
+            ino,
+            partial_hash,
+            full_hash,
+        ) in conn.execute(
+            "SELECT path, size, stored_size, mtime_ns, dev, ino, partial_hash,"
+            " full_hash FROM file_hashes"
+        ):
+            if files.get(path) == (size, stored_size, mtime_ns, dev, ino):
+                cached[path] = (partial_hash, full_hash)
+            else:
+                stale.append((path,))
+        with conn:
+            conn.executemany("DELETE FROM file_hashes WHERE path = ?", stale)
+
+        candidates = [
+            path
+            for paths in by_size.values()
+            if len({files[p][3:] for p in paths}) > 1  # Hardlinks are one file
+            for path in paths
+        ]
+        progress["size_candidates"] = len(candidates)
+
+        # Stage 2: first and last 64KB
+        progress["stage"] = "partial_hash"
+        partial = self._hash_stage(
+            conn, files, cached, candidates, settings, full=False
+        )
+
+        by_partial = defaultdict(list)
+        for path in candidates:
+            if path in partial:
+                by_partial[(files[path][0], partial[path])].append(path)
+        remaining = [
+            path
+            for paths in by_partial.values()
+            if len({files[p][3:] for p in paths}) > 1
+            for path in paths
+        ]
+        progress["partial_candidates"] = len(remaining)
+
+        # Stage 3: full content, only for files the samples could not tell apart
+        progress["stage"] = "full_hash"
+        self._hash_stage(conn, files, cached, remaining, settings, full=True)
+
+    def _hash_stage(
+        self,
+        conn: sqlite3.Connection,
+        files: Dict[str, tuple],
+        cached: Dict[str, tuple],
+        paths: List[str],
+        settings: Settings,
+        full: bool,
+    ) -> Dict[str, str]:
+        progress = self.progress
+        column = 1 if full else 0
+        hashes: Dict[str, str] = {}
+        todo = []
+        for path in paths:
+            known = cached.get(path, (None, None))
+            if known[column] is not None:
+                hashes[path] = known[column]
+            elif full and files[path][0] <= 2 * DUPLICATE_SAMPLE_SIZE:
+                hashes[path] = known[0]  # The partial hash covered everything
+            else:
+                todo.append(path)
+        progress["files_to_hash"] = len(todo)
+        progress["files_hashed"] = 0
+
+        def work(path: str) -> tuple:
+            full_path = settings.BASE_DIR / path
+            if full:
+                return hash_file_full(full_path, self._cancelled)
+            if self._cancelled.is_set():
+                raise ScanCancelled()
+            return hash_file_ends(full_path, files[path][0])
+
+        pending_rows = []
+
+        def flush():
+            with conn:
+                for path, digest in pending_rows:
+                    size, stored_size, mtime_ns, dev, ino = files[path]
+                    partial_hash, full_hash = cached.get(path, (None, None))
+                    if full:
+                        full_hash = digest
+                    else:
+                        partial_hash = digest
+                        if size <= 2 * DUPLICATE_SAMPLE_SIZE:
+                            full_hash = digest
+                    cached[path] = (partial_hash, full_hash)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO file_hashes (path, size,"
+                        " stored_size, mtime_ns, dev, ino, partial_hash,"
+                        " full_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            path,
+                            size,
+                            stored_size,
+                            mtime_ns,
+                            dev,
+                            ino,
+                            partial_hash,
+                            full_hash,
+                        ),
+                    )
+            pending_rows.clear()
+
+        with ThreadPoolExecutor(max_workers=settings.DUPLICATE_HASH_WORKERS) as pool:
+            futures = {pool.submit(work, path): path for path in todo}
+            try:
+                for future in as_completed(futures):
+                    path = futures[future]
+                    try:
+                        digest, bytes_read = future.result()
+                    except OSError as e:
+                        # Vanished or unreadable; it simply can't be a duplicate
+                        logger.warning(
+                            "Duplicate scan skipped file", file=path, error=str(e)
+                        )
+                        continue
+                    progress["bytes_read"] += bytes_read
+                    progress["files_hashed"] += 1
+                    hashes[path] = digest
+                    pending_rows.append((path, digest))
+                    if len(pending_rows) >= 256:
+                        flush()
+            except ScanCancelled:
+                for future in futures:
+                    future.cancel()
+                raise
+            finally:
+                flush()  # Whatever finished is kept for the next run
+        return hashes
+
+
+duplicate_scan = DuplicateScan()
+
+
+def get_duplicate_groups(
+    min_size: int = 1, offset: int = 0, limit: int = 100
+) -> Dict[str, Any]:
+    """Duplicate groups from the last scan, most reclaimable space first
+
+    Keeping the smallest stored copy of each group, the rest is reclaimable.
+    Files changed or deleted since the scan are left out of the listing.
+    """
+    conn = get_hash_db()
+    groups = defaultdict(list)
+    for full_hash, path, size, stored_size, mtime_ns, dev, ino in conn.execute(
+        "SELECT full_hash, path, size, stored_size, mtime_ns, dev, ino"
+        " FROM file_hashes WHERE size >= ? AND full_hash IN (SELECT full_hash"
+        " FROM file_hashes WHERE full_hash IS NOT NULL GROUP BY full_hash"
+        " HAVING COUNT(DISTINCT dev || ':' || ino) > 1)",
+        (min_size,),
+    ):
+        groups[full_hash].append((path, size, stored_size, mtime_ns, (dev, ino)))
+
+    summary = []
+    for full_hash, members in groups.items():
+        # Hardlinks are one file: count each (device, inode) once
+        stored = {inode: stored_size for _, _, stored_size, _, inode in members}
+        if len(stored) < 2:
+            continue
+        summary.append(
+            (sum(stored.values()) - min(stored.values()), full_hash, members)
+        )
+    summary.sort(key=lambda group: (-group[0], group[1]))
+
+    base_dir = get_settings().BASE_DIR
+    page = []
+    for reclaimable, full_hash, members in summary[offset : offset + limit]:
+        present = []
+        for path, size, stored_size, mtime_ns, inode in sorted(members):
+            try:
+                stat = (base_dir / path).stat()
+            except OSError:
+                continue
+            if (stat.st_size, stat.st_mtime_ns, (stat.st_dev, stat.st_ino)) == (
+                stored_size,
+                mtime_ns,
+                inode,
+            ):
+                present.append(
+                    {
+                        "path": path,
+                        "stored_size": stored_size,
+                        "modification_date": datetime.fromtimestamp(mtime_ns / 1e9),
+                    }
+                )
+        if len(present) < 2:
+            continue
+        page.append(
+            {
+                "hash": full_hash,
+                "size": members[0][1],
+                "size_human": format_bytes(members[0][1]),
+                "count": len(present),
+                "reclaimable_bytes": reclaimable,
+                "reclaimable_human": format_bytes(reclaimable),
+                "files": present,
+            }
+        )
+
+    total_reclaimable = sum(group[0] for group in summary)
+    finished = _journal_meta(conn, "duplicate_scan_finished")
+    return {
+        "scanned_at": datetime.fromtimestamp(finished) if finished else None,
+        "total_groups": len(summary),
+        "total_reclaimable_bytes": total_reclaimable,
+        "total_reclaimable_human": format_bytes(total_reclaimable),
+        "groups": page,
+    }
+
+
+def fast_json_response(content: Dict[str, Any]) -> Response:
+    """Serialize plain data directly, skipping FastAPI's jsonable_encoder
+
+    Uses orjson when installed, otherwise compact stdlib json. Content must
+    already be JSON-native (no datetimes or models).
+    """
+    orjson = optional_import("orjson")
+    if orjson is not None:
+        body = orjson.dumps(content)
+    else:
+        body = json.dumps(content, separators=(",", ":"), ensure_ascii=False).encode()
+    return Response(body, media_type="application/json")
+
+
+def list_directory_columnar(
+    target_dir: Path, path: str, sort_by: str, order: str
+) -> Dict[str, Any]:
+    """Directory listing as parallel arrays
+
+    Paths and thumbnail URLs are path_prefix / thumbnail_prefix + name, times
+    are integer epoch seconds and MIME types index into mime_types. Only
+    image files get a thumbnail.
+    """
+    compressed = compressed_entries_in(target_dir)
+    entries = []
+    with os.scandir(target_dir) as it:
+        for entry in it:
+            if entry.name in INTERNAL_DIR_NAMES and is_internal_path(entry.path):
+                continue
+            try:
+                stat = entry.stat()
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            # Logical size, so compressed files sort by what is reported
+            size = 0 if is_dir else logical_size(stat, compressed.get(entry.name))
+            entries.append((entry.name, is_dir, stat, size))
+
+    sort_key_map = {
+        "name": lambda e: e[0].lower(),
+        "size": lambda e: e[3],
+        "date": lambda e: e[2].st_mtime,
+    }
+    if sort_by in sort_key_map:
+        entries.sort(key=sort_key_map[sort_by], reverse=(order == "desc"))
+
+    names, is_folder, sizes, mtimes, ctimes, mimes, thumbnails = ([] for _ in range(7))
+    mime_types: List[str] = []
+    mime_index: Dict[Optional[str], Optional[int]] = {None: None}
+    for name, is_dir, stat, size in entries:
+        mime_type, _ = mimetypes.guess_type(name)
+        if mime_type not in mime_index:
+            mime_index[mime_type] = len(mime_types)
+            mime_types.append(mime_type)
+        names.append(name)
+        is_folder.append(int(is_dir))
+        sizes.append(size)
+        mtimes.append(int(stat.st_mtime))
+        ctimes.append(int(getattr(stat, "st_birthtime", stat.st_ctime)))
+        mimes.append(mime_index[mime_type])
+        thumbnails.append(
+            int(not is_dir and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+        )
+
+    prefix = f"{path.strip('/')}/" if path.strip("/") else ""
+    return {
+        "path": path,
+        "count": len(names),
+        "format": "columnar",
+        "path_prefix": prefix,
+        "thumbnail_prefix": f"/api/thumbnail/{prefix}",
+        "mime_types": mime_types,
+        "columns": {
+            "name": names,
+            "is_folder": is_folder,
+            "size": sizes,
+            "mtime": mtimes,
+            "ctime": ctimes,
+            "mime": mimes,
+            "thumbnail": thumbnails,
+        },
+    }
+
+
+def search_results_columnar(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Search results as parallel arrays; folder indexes into folders"""
+    folders: List[str] = []
+    folder_index: Dict[str, int] = {}
+    columns = defaultdict(list)
+    for result in results:
+        folder = result["folder"]
+        if folder not in folder_index:
+            folder_index[folder] = len(folders)
+            folders.append(folder)
+        columns["name"].append(result["filename"])
+        columns["folder"].append(folder_index[folder])
+        columns["size"].append(result["size"])
+        columns["mtime"].append(int(result["modification_date"].timestamp()))
+        columns["thumbnail"].append(int(result["extension"] in IMAGE_EXTENSIONS))
+        if "snippet" in result:
+            columns["snippet"].append(result["snippet"])
+            columns["score"].append(result["score"])
+    return {
+        "format": "columnar",
+        "folders": folders,
+        "thumbnail_prefix": "/api/thumbnail/",
+        "columns": dict(columns),
+    }
+
+
+# ============================================================================
+# ZIP ARCHIVES
+# ============================================================================
+
+# Local file header: signature, version, flags, method, time, date, crc,
+# compressed size, size, name length, extra length
+ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+
+@lru_cache(maxsize=32)
+def read_zip_index(path: str, size: int, mtime_ns: int) -> Dict[str, zipfile.ZipInfo]:
+    """Central directory of an archive, cached per (path, size, mtime)"""
+    with zipfile.ZipFile(path) as archive:
+        return {info.filename: info for info in archive.infolist()}
+
+
+def zip_index_for(full_path: Path, stat: os.stat_result) -> Dict[str, zipfile.ZipInfo]:
+    try:
+        return read_zip_index(str(full_path), stat.st_size, stat.st_mtime_ns)
+    except (zipfile.BadZipFile, zipfile.LargeZipFile) as e:
+        raise HTTPException(status_code=400, detail=f"Not a readable ZIP: {e}")
+
+
+def zip_member_data_offset(f, info: zipfile.ZipInfo) -> int:
+    """Where a member's (compressed) data starts, from its local header"""
+    f.seek(info.header_offset)
+    header = f.read(ZIP_LOCAL_HEADER.size)
+    if len(header) != ZIP_LOCAL_HEADER.size or header[:4] != b"PK\x03\x04":
+        raise ValueError(f"Bad local header for {info.filename}")
+    fields = ZIP_LOCAL_HEADER.unpack(header)
+    return info.header_offset + ZIP_LOCAL_HEADER.size + fields[9] + fields[10]
+
+
+# Member types served inline by /api/zip/extract; the rest are downloads
+ZIP_INLINE_TYPES = ("image/", "video/", "audio/")
+
+
+def iter_zip_member(
+    full_path: Path, info: zipfile.ZipInfo, start: int = 0, end: Optional[int] = None
+):
+    """Yield a member's content (bytes start..end for STORED members)
+
+    Only the member's own bytes are read: STORED data is sliced straight
+    out of the archive and DEFLATED data is inflated with zlib. Other
+    methods go through zipfile.
+    """
+    if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        with zipfile.ZipFile(full_path) as archive:
+            with archive.open(info) as member:
+                while chunk := member.read(64 * 1024):
+                    yield chunk
+        return
+
+    with open(full_path, "rb") as f:
+        data_offset = zip_member_data_offset(f, info)
+
+    if info.compress_type == zipfile.ZIP_STORED:
+        last = info.file_size - 1 if end is None else end
+        yield from iter_file_range(full_path, data_offset + start, data_offset + last)
+        return
+
+    # The last piece is held back until the CRC checks out, so a corrupt
+    # member aborts the response short of its Content-Length
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+    crc = 0
+    pending = b""
+    for chunk in iter_file_range(
+        full_path, data_offset, data_offset + info.compress_size - 1
+    ):
+        data = inflater.decompress(chunk)
+        crc = zlib.crc32(data, crc)
+        if data:
+            if pending:
+                yield pending
+            pending = data
+    data = inflater.flush()
+    crc = zlib.crc32(data, crc)
+    if crc != info.CRC:
+        logger.error(
+            "ZIP member CRC mismatch", file=str(full_path), member=info.filename
+        )
+        raise zipfile.BadZipFile(f"Bad CRC-32 for member {info.filename!r}")
+    yield pending + data
+
+
+def describe_zip_member(info: zipfile.ZipInfo) -> Dict[str, Any]:
+    return {
+        "name": info.filename,
+        "is_dir": info.is_dir(),
+        "size": info.file_size,
+        "compressed_size": info.compress_size,
+        "method": zipfile.compressor_names.get(
+            info.compress_type, str(info.compress_type)
+        ),
+        "modified": datetime(*info.date_time).isoformat(),
+        "crc": f"{info.CRC:08x}",
+        "encrypted": bool(info.flag_bits & 0x1),
+    }
+
+
+# ============================================================================
+# MP4 FAST START
+# ============================================================================
+
+FASTSTART_EXTENSIONS = {".mp4", ".m4v", ".mov"}
+# Boxes whose children are boxes, on the path from moov down to stco/co64
+MP4_CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+
+def read_mp4_boxes(f, start: int, end: int) -> List[tuple]:
+    """(type, offset, header_size, size) of the boxes between start and end"""
+    boxes = []
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(16)
+        size, box_type = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                raise ValueError("Truncated box header")
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset  # Box runs to the end of the file
+        if size < header_size or offset + size > end:
+            raise ValueError(f"Bad {box_type!r} box size at {offset}")
+        boxes.append((box_type, offset, header_size, size))
+        offset += size
+    return boxes
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    if len(payload) + 8 <= 0xFFFFFFFF:
+        return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+    return struct.pack(">I4sQ", 1, box_type, len(payload) + 16) + payload
+
+
+def rewrite_chunk_offsets(box: bytes, shift, use_co64: bool) -> bytes:
+    """Copy of a moov box with every stco/co64 offset passed through shift
+
+    With use_co64, stco tables are widened to co64 so shifted offsets past
+    4GB still fit; the enclosing container sizes are recomputed.
+    """
+    header_size = 16 if struct.unpack(">I", box[:4])[0] == 1 else 8
+    box_type = box[4:8]
+    payload = box[header_size:]
+
+    if box_type in MP4_CONTAINER_BOXES:
+        children = []
+        offset = 0
+        while offset + 8 <= len(payload):
+            size = struct.unpack(">I", payload[offset : offset + 4])[0]
+            if size == 1:
+                size = struct.unpack(">Q", payload[offset + 8 : offset + 16])[0]
+            elif size == 0:
+                size = len(payload) - offset
+            children.append(
+                rewrite_chunk_offsets(payload[offset : offset + size], shift, use_co64)
+            )
+            offset += size
+        return _box(box_type, b"".join(children))
+
+    if box_type == b"stco":
+        version_flags, count = struct.unpack(">II", payload[:8])
+        offsets = [
+            shift(o) for o in struct.unpack(f">{count}I", payload[8 : 8 + 4 * count])
+        ]
+        if use_co64:
+            return _box(
+                b"co64",
+                struct.pack(">II", version_flags, count)
+                + struct.pack(f">{count}Q", *offsets),
+            )
+        return _box(
+            b"stco",
+            struct.pack(">II", version_flags, count)
+            + struct.pack(f">{count}I", *offsets),
+        )
+
+    if box_type == b"co64":
+        version_flags, count = struct.unpack(">II", payload[:8])
+        offsets = [
+            shift(o) for o in struct.unpack(f">{count}Q", payload[8 : 8 + 8 * count])
+        ]
+        return _box(
+            b"co64",
+            struct.pack(">II", version_flags, count)
+            + struct.pack(f">{count}Q", *offsets),
+        )
+
+    return box
+
+
+class FastStartLayout:
+    """A file's bytes rearranged so the moov box comes before the media data
+
+    The virtual file is a list of segments, each either bytes held in memory
+    (the rewritten moov) or a range of the original file, so any byte range
+    of it can be served without writing anything to disk.
+    """
+
+    def __init__(self, segments: List[tuple]):
+        self.segments = segments  # (virtual_start, length, bytes or file offset)
+        self.size = sum(length for _, length, _ in segments)
+        self.memory_size = sum(
+            length for _, length, source in segments if isinstance(source, bytes)
+        )
+
+    def iter_range(
+        self, original: Union[Path, BinaryIO], start: int, end: int, chunk_size: int
+    ):
+        """Yield the virtual file's bytes start..end (inclusive)
+
+        original is the source file's path or an open file, closed when done.
+        """
+        with open(original, "rb") if isinstance(original, Path) else original as f:
+            for virtual_start, length, source in self.segments:
+                segment_end = virtual_start + length
+                if segment_end <= start or virtual_start > end:
+                    continue
+                skip = max(start - virtual_start, 0)
+                remaining = min(segment_end, end + 1) - virtual_start - skip
+                if isinstance(source, bytes):
+                    yield source[skip : skip + remaining]
+                    continue
+                f.seek(source + skip)
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining))
+                    if not chunk:
+                        return
+                    remaining -= len(chunk)
+                    yield chunk
+
+
+class FastStartLayoutCache:
+    """LRU of fast-start layouts bounded by the bytes their moovs hold
+
+    A long video's rewritten moov can be tens of MB, so a count limit alone
+    could pin gigabytes. Files without a layout (None) are cached too, so
+    they aren't parsed again; a layout larger than the budget is not kept.
+    """
+
+    MAX_ENTRIES = 1024
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes_cached = 0
+        self._entries: "OrderedDict[tuple, Optional[FastStartLayout]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        with self._lock:
+            if key not in self._entries:
+                return _NOT_CACHED
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: tuple, layout: Optional[FastStartLayout]):
+        weight = layout.memory_size if layout else 0
+        if weight > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            self.bytes_cached -= old.memory_size if old else 0
+            self._entries[key] = layout
+            self.bytes_cached += weight
+            while (
+                self.bytes_cached > self.max_bytes
+                or len(self._entries) > self.MAX_ENTRIES
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes_cached -= evicted.memory_size if evicted else 0
+
+
+@lru_cache()
+def get_faststart_cache() -> FastStartLayoutCache:
+    return FastStartLayoutCache(get_settings().MP4_FASTSTART_CACHE_BYTES)
+
+
+def get_faststart_layout(
+    path: str, size: int, mtime_ns: int
+) -> Optional[FastStartLayout]:
+    """Fast-start layout of an MP4/MOV whose moov follows its mdat, else None
+
+    Cached per (path, size, mtime); a changed file gets a new key.
+    """
+    cache = get_faststart_cache()
+    key = (path, size, mtime_ns)
+    layout = cache.get(key)
+    if layout is _NOT_CACHED:
+        layout = build_faststart_layout(path, size)
+        cache.put(key, layout)
+    return layout
+
+
+def build_faststart_layout(path: str, size: int) -> Optional[FastStartLayout]:
+    with open(path, "rb") as f:
+        boxes = read_mp4_boxes(f, 0, size)
+        types = [box[0] for box in boxes]
+        if b"moov" not in types or b"mdat" not in types or b"moof" in types:
+            return None
+        moov_index = types.index(b"moov")
+        mdat_index = types.index(b"mdat")
+        if moov_index < mdat_index:
+            return None  # Already fast-start
+
+        _, moov_offset, _, moov_size = boxes[moov_index]
+        mdat_offset = boxes[mdat_index][1]
+        f.seek(moov_offset)
+        moov = f.read(moov_size)
+
+    def rewrite(use_co64: bool) -> bytes:
+        # Sizes only depend on use_co64, so a dry run gives the final shift
+        new_moov_size = len(rewrite_chunk_offsets(moov, lambda o: o, use_co64))
+
+        def shift(offset: int) -> int:
+            # Data between the first mdat and the old moov moves down by the
+            # moov's size; data after the old moov keeps its position, plus
+            # however much the moov grew
+            if mdat_offset <= offset < moov_offset:
+                return offset + new_moov_size
+            if offset >= moov_offset + moov_size:
+                return offset + new_moov_size - moov_size
+            return offset
+
+        return rewrite_chunk_offsets(moov, shift, use_co64)
+
+    new_moov = rewrite(use_co64=False)
+    if len(new_moov) - moov_size + size > 0xFFFFFFFF:
+        new_moov = rewrite(use_co64=True)
+
+    segments = []
+    position = 0
+    for box_type, offset, _, box_size in boxes[:mdat_index]:
+        segments.append((position, box_size, offset))
+        position += box_size
+    segments.append((position, len(new_moov), new_moov))
+    position += len(new_moov)
+    for box_type, offset, _, box_size in boxes[mdat_index:]:
+        if box_type != b"moov":
+            segments.append((position, box_size, offset))
+            position += box_size
+    return FastStartLayout(segments)
+
+
+def faststart_layout_for(
+    full_path: Path, stat: os.stat_result
+) -> Optional[FastStartLayout]:
+    if (
+        not get_settings().MP4_FASTSTART
+        or full_path.suffix.lower() not in FASTSTART_EXTENSIONS
+    ):
+        return None
+    try:
+        return get_faststart_layout(str(full_path), stat.st_size, stat.st_mtime_ns)
+    except (OSError, ValueError, struct.error) as e:
+        logger.warning("MP4 parse failed", file=str(full_path), error=str(e))
+        return None
+
+
+# ============================================================================
+# ENDPOINTS
+# ============================================================================
+
+
+@app.get("/", tags=["System"])
+async def root():
+    """Root endpoint"""
+    return {
+        "message": "Welcome to your Personal NAS Server! 🚀",
+        "version": "2.0.0",
+        "docs": (
+            "/docs"
+            if os.getenv("ENVIRONMENT", "development") == "development"
+            else "disabled"
+        ),
+    }
+
+
+@app.get("/health", response_model=HealthCheck, tags=["System"])
+async def health_check():
+    """Health check endpoint for monitoring"""
+    settings = get_settings()
+    return HealthCheck(
+        status="healthy",
+        timestamp=datetime.utcnow(),
+        version="2.0.0",
+        base_dir_accessible=settings.BASE_DIR.exists() and settings.BASE_DIR.is_dir(),
+    )
+
+
+@app.get("/app", response_class=HTMLResponse, tags=["Frontend"])
+async def serve_frontend():
+    """Serve the frontend interface"""
+    try:
+        with open("index.html", "r", encoding="utf-8") as f:
+            return HTMLResponse(content=f.read())
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=404,
+            detail="Frontend not found. Place index.html in the same directory as main.py",
+        )
+
+
+@app.get("/api/stats", response_model=StorageStats, tags=["Storage"])
+async def get_storage_statistics(
+    _: str = Depends(verify_api_key), __: None = Depends(check_rate_limit)
+):
+    """Get storage statistics and usage"""
+    settings = get_settings()
+    stats = get_storage_stats(settings.BASE_DIR)
+    return StorageStats(**stats, **get_compression_savings())
+
+
+@app.get("/api/pool", tags=["Storage"])
+def get_pool(_: str = Depends(verify_api_key), __: None = Depends(check_rate_limit)):
+    """Storage pool volumes, placement policy and files placed per volume"""
+    return {
+        "placement": get_settings().POOL_PLACEMENT,
+        "volumes": get_pool_summary(),
+    }
+
+
+@app.get("/api/tier", tags=["Storage"])
+def get_tier_metrics(
+    _: str = Depends(verify_api_key), __: None = Depends(check_rate_limit)
+):
+    """Fast-tier read cache usage, hit ratio and hottest files"""
+    fast_tier = get_fast_tier()
+    if fast_tier is None:
+        return {"enabled": False}
+    return fast_tier.metrics()
+
+
+@app.get("/api/uploads/metrics", tags=["Storage"])
+async def get_upload_metrics(
+    _: str = Depends(verify_api_key), __: None = Depends(check_rate_limit)
+):
+    """Disk write scheduler queue and throughput metrics, per disk"""
+    if len(_disk_write_schedulers) <= 1:
+        return get_disk_write_scheduler(next(iter(_disk_write_schedulers), 0)).metrics()
+    return {
+        "disks": {
+            str(device): scheduler.metrics()
+            for device, scheduler in _disk_write_schedulers.items()
+        }
+    }
+
+
+@app.get("/api/admission/metrics", tags=["System"])
+async def get_admission_metrics(
+    _: str = Depends(verify_api_key), __: None = Depends(check_rate_limit)
+):
+    """Per-route-class concurrency, queue and shedding counters"""
+    return {
+        route_class: get_route_limiter(route_class).metrics()
+        for route_class in get_settings().ADMISSION_LIMITS
+    }
+
+
+@app.get("/api/transfers", tags=["System"])
+async def get_transfers(
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Active downloads and streams with their live rates and the caps"""
+    return get_bandwidth_shaper().metrics()
+
+
+@app.get("/api/profiles", tags=["Profiling"])
+async def list_profiles(
+    _: str = Depends(verify_api_key),
+    __: None = Depends(verify_profiling_token),
+):
+    """Stored request profiles, newest first"""
+    profiles = [
+        json.loads(meta.read_text())
+        for meta in sorted(profiles_dir().glob("*.json"), reverse=True)
+    ]
+    return {"count": len(profiles), "profiles": profiles}
+
+
+@app.get("/api/profiles/{profile_id}", tags=["Profiling"])
+async def get_profile(
+    profile_id: str,
+    format: str = Query("text", pattern="^(text|pstats)$"),
+    sort: str = Query("cumulative", pattern="^(cumulative|tottime|ncalls)$"),
+    limit: int = Query(40, ge=1, le=1000),
+    _: str = Depends(verify_api_key),
+    __: None = Depends(verify_profiling_token),
+):
+    """A request profile as a pstats report, or the raw file for pstats/snakeviz"""
+    profile_path = profiles_dir() / f"{profile_id}.prof"
+    if not re.fullmatch(r"[\w-]+", profile_id) or not profile_path.exists():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "pstats":
+        return FileResponse(
+            profile_path,
+            media_type="application/octet-stream",
+            filename=profile_path.name,
+        )
+    report = await asyncio.to_thread(format_profile, profile_path, sort, limit)
+    return Response(report, media_type="text/plain")
+
+
+@app.post("/api/profiling/samples", status_code=202, tags=["Profiling"])
+async def start_sampling(
+    seconds: float = Query(30, gt=0, le=MAX_SAMPLE_SECONDS),
+    include_idle: bool = False,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(verify_profiling_token),
+):
+    """Sample all threads' stacks for a number of seconds"""
+    return stack_sampler.start(seconds, include_idle)
+
+
+@app.get("/api/profiling/samples", tags=["Profiling"])
+async def get_sampling_status(
+    _: str = Depends(verify_api_key),
+    __: None = Depends(verify_profiling_token),
+):
+    """State of the current or last sampling run"""
+    return stack_sampler.status()
+
+
+@app.post("/api/profiling/samples/stop", tags=["Profiling"])
+async def stop_sampling(
+    _: str = Depends(verify_api_key),
+    __: None = Depends(verify_profiling_token),
+):
+    """End the sampling run early and write its output"""
+    await asyncio.to_thread(stack_sampler.stop)
+    return stack_sampler.status()
+
+
+@app.get("/api/profiling/samples/{run_id}", tags=["Profiling"])
+async def download_samples(
+    run_id: str,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(verify_profiling_token),
+):
+    """Collapsed stacks of a finished run (flamegraph.pl, speedscope)"""
+    collapsed_path = profiles_dir() / f"{run_id}.collapsed"
+    if not re.fullmatch(r"[\w-]+", run_id) or not collapsed_path.exists():
+        raise HTTPException(status_code=404, detail="Sampling run not found")
+    return FileResponse(
+        collapsed_path, media_type="text/plain", filename=collapsed_path.name
+    )
+
+
+@app.get("/api/path-cache", tags=["System"])
+async def get_path_cache_metrics(
+    _: str = Depends(verify_api_key), __: None = Depends(check_rate_limit)
+):
+    """Path-resolution and stat cache size and hit ratio"""
+    return get_path_cache().metrics()
+
+
+@app.get("/api/startup", tags=["System"])
+async def get_startup_timing(
+    _: str = Depends(verify_api_key), __: None = Depends(check_rate_limit)
+):
+    """Cold-start timings in ms
+
+    import_ms, warm_ms and first_request_ms count from the start of module
+    import; the other entries are the durations of their own phase.
+    """
+    return startup_timing
+
+
+def sort_file_items(items: List[FileItem], sort_by: str, order: str):
+    """Sort a listing in place by name, size or date"""
+    sort_key_map = {
+        "name": lambda x: x.name.lower(),
+        "size": lambda x: x.file_size,
+        "date": lambda x: x.modification_date,
+    }
+
+    if sort_by in sort_key_map:
+        items.sort(key=sort_key_map[sort_by], reverse=(order == "desc"))
+
+
+@app.get("/api/files", tags=["Files"])
+async def list_files(
+    path: str = "",
+    sort_by: str = "name",  # name, size, date
+    order: str = "asc",  # asc, desc
+    format: str = Query("objects", pattern="^(objects|columnar)$"),
+    snapshot: Optional[int] = None,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """List files and folders with enhanced sorting
+
+    format=columnar returns a compact parallel-array listing (see
+    list_directory_columnar), much smaller and cheaper for large folders.
+    snapshot=ID lists the folder as it was in that snapshot (objects only).
+    """
+    settings = get_settings()
+
+    if snapshot is not None:
+        items = list_snapshot_directory(snapshot, snapshot_relative_path(path))
+        sort_file_items(items, sort_by, order)
+        return {"path": path, "snapshot": snapshot, "count": len(items), "items": items}
+
+    target_dir = settings.BASE_DIR / path if path else settings.BASE_DIR
+    target_dir = validate_path_security(target_dir, settings.BASE_DIR)
+
+    target_stat = stat_path(target_dir)
+    if target_stat is None:
+        raise HTTPException(status_code=404, detail="Directory not found")
+
+    if not stat_module.S_ISDIR(target_stat.st_mode):
+        raise HTTPException(status_code=400, detail="Path is not a directory")
+
+    if format == "columnar":
+        return fast_json_response(
+            list_directory_columnar(target_dir, path, sort_by, order)
+        )
 
     items = []
     image_ext = [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"]
 
+    compressed = compressed_entries_in(target_dir)
+
     for item in target_dir.iterdir():
+        if item.name in INTERNAL_DIR_NAMES and is_internal_path(item):
+            continue
         stat = item.stat()
+        is_file = stat_module.S_ISREG(stat.st_mode)
         relative_path = str(item.relative_to(settings.BASE_DIR))
         mime_type, _ = mimetypes.guess_type(str(item))
 
         items.append(
             FileItem(
                 name=item.name,
-                is_file=item.is_file(),
-                is_folder=item.is_dir(),
-                file_size=stat.st_size if item.is_file() else 0,
-                creation_date=datetime.datetime.fromtimestamp(
+                is_file=is_file,
+                is_folder=stat_module.S_ISDIR(stat.st_mode),
+                file_size=(
+                    logical_size(stat, compressed.get(item.name)) if is_file else 0
+                ),
+                creation_date=datetime.fromtimestamp(
                     stat.st_birthtime
                     if hasattr(stat, "st_birthtime")
                     else stat.st_ctime
                 ),
-                modification_date=datetime.datetime.fromtimestamp(stat.st_mtime),
+                modification_date=datetime.fromtimestamp(stat.st_mtime),
                 path=relative_path,
-                extension=item.suffix.lower() if item.is_file() else None,
+                extension=item.suffix.lower() if is_file else None,
                 thumbnail_url=(
                     f"/api/thumbnail/{relative_path}"
-                    if item.is_file() and item.suffix.lower() in image_ext
+                    if is_file and item.suffix.lower() in image_ext
                     else None
                 ),
                 mime_type=mime_type,
             )
         )
 
-    # Sorting
-    sort_key_map = {
-        "name": lambda x: x.name.lower(),
-        "size": lambda x: x.file_size,
-        "date": lambda x: x.modification_date,
-    }
-
-    if sort_by in sort_key_map:
-        items.sort(key=sort_key_map[sort_by], reverse=(order == "desc"))
+    sort_file_items(items, sort_by, order)
 
     return {"path": path, "count": len(items), "items": items}
 
 
 @app.get("/api/download", tags=["Files"])
 async def download_file(
-    path: str, _: str = Depends(verify_api_key), __: None = Depends(check_rate_limit)
+    path: str,
+    request: Request,
+    snapshot: Optional[int] = None,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
 ):
-    """Download a file with resume support"""
+    """Download a file with resume support
+
+    snapshot=ID downloads the version of the file kept in that snapshot.
+    """
     settings = get_settings()
+    if snapshot is not None:
+        return snapshot_file_response(snapshot, snapshot_relative_path(path))
+
     file_path = settings.BASE_DIR / path
     file_path = validate_path_security(file_path, settings.BASE_DIR)
 
-    if not file_path.exists():
+    stat = stat_path(file_path, fresh=True)
+    if stat is None:
         raise HTTPException(status_code=404, detail="File not found")
 
-    if not file_path.is_file():
+    if not stat_module.S_ISREG(stat.st_mode):
         raise HTTPException(status_code=400, detail="Path is not a file")
 
-    logger.info("File download", file=path, size=file_path.stat().st_size)
+    compression = get_compression_info(file_path, stat)
+    if compression:
+        return serve_compressed_download(request, file_path, stat, compression)
+
+    headers = validator_headers(stat, make_etag(stat))
+    if is_not_modified(request, stat, headers["ETag"]):
+        return not_modified_response(headers)
+    headers["Accept-Ranges"] = "bytes"
+
+    # Single ranges let clients resume and fetch segments in parallel
+    range_header = request.headers.get("range")
+    if range_header and if_range_allows(request, stat, headers["ETag"]):
+        byte_range = parse_byte_range(range_header, stat.st_size)
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            headers["Content-Disposition"] = (
+                f"attachment; filename*=utf-8''{quote(file_path.name)}"
+            )
+            return StreamingResponse(
+                iter_tiered_range(file_path, stat, start, end),
+                status_code=206,
+                media_type="application/octet-stream",
+                headers=headers,
+            )
+
+    logger.info("File download", file=path, size=stat.st_size)
+
+    if get_fast_tier() is not None:
+        # Streamed so a fast copy can be read from, if there is one by then
+        headers["Content-Length"] = str(stat.st_size)
+        headers["Content-Disposition"] = (
+            f"attachment; filename*=utf-8''{quote(file_path.name)}"
+        )
+        return StreamingResponse(
+            iter_tiered_range(
+                file_path, stat, 0, stat.st_size - 1, settings.CHUNK_SIZE
+            ),
+            media_type="application/octet-stream",
+            headers=headers,
+        )
 
     return FileResponse(
-        path=file_path, filename=file_path.name, media_type="application/octet-stream"
+        path=file_path,
+        filename=file_path.name,
+        media_type="application/octet-stream",
+        headers=headers,
+        stat_result=stat,
+    )
+
+
+def serve_compressed_download(
+    request: Request,
+    file_path: Path,
+    stat: os.stat_result,
+    compression: Dict[str, Any],
+) -> Response:
+    """Send a file stored compressed: as-is to gzip clients, else decompressed"""
+    settings = get_settings()
+    send_encoded = compression["codec"] == "gzip" and "gzip" in request.headers.get(
+        "accept-encoding", ""
+    )
+    headers = validator_headers(
+        stat, make_etag(stat, "gzip" if send_encoded else "identity")
+    )
+    headers["Vary"] = "Accept-Encoding"
+    if is_not_modified(request, stat, headers["ETag"]):
+        return not_modified_response(headers)
+
+    logger.info(
+        "File download",
+        file=str(file_path.relative_to(settings.BASE_DIR)),
+        size=compression["logical_size"],
+        encoded=send_encoded,
+    )
+
+    if send_encoded:
+        headers["Content-Encoding"] = "gzip"
+        return FileResponse(
+            path=file_path,
+            filename=file_path.name,
+            media_type="application/octet-stream",
+            headers=headers,
+            stat_result=stat,
+        )
+
+    def iterfile():
+        with open_logical(file_path, stat) as f:
+            while chunk := f.read(64 * 1024):
+                yield chunk
+
+    headers["Content-Length"] = str(compression["logical_size"])
+    headers["Content-Disposition"] = (
+        f"attachment; filename*=utf-8''{quote(file_path.name)}"
+    )
+    return StreamingResponse(
+        iterfile(), media_type="application/octet-stream", headers=headers
     )
 
 
@@ -586,34 +6070,48 @@ async def upload_file(
         )
 
     # Handle existing file
-    if file_path.exists() and not overwrite:
+    existed = file_path.exists()
+    if existed and not overwrite:
         raise HTTPException(
             status_code=400,
             detail="File already exists. Use overwrite=true to replace.",
         )
 
-    # Chunked upload to handle large files efficiently
+    # Chunked upload to handle large files efficiently. Written to a temp file
+    # and renamed over the target, so an overwrite gets a new inode and never
+    # changes data that snapshots hardlink to.
     total_size = 0
     sha256_hash = hashlib.sha256()
+    data_path = pool_data_path(file_path, file.size or 0)
+    fd, tmp_name = tempfile.mkstemp(
+        dir=data_path.parent, prefix=f".{file_path.name}.", suffix=".part"
+    )
+    tmp_path = Path(tmp_name)
+    os.chmod(tmp_path, 0o666 & ~PROCESS_UMASK)
 
     try:
-        with open(file_path, "wb") as f:
-            while chunk := await file.read(settings.CHUNK_SIZE):
-                total_size += len(chunk)
-
-                # Check size limit
-                if total_size > settings.MAX_UPLOAD_SIZE:
-                    file_path.unlink(missing_ok=True)  # Clean up
-                    raise HTTPException(
-                        status_code=413,
-                        detail=f"File size exceeds maximum allowed size of {format_bytes(settings.MAX_UPLOAD_SIZE)}",
-                    )
-
-                f.write(chunk)
-                sha256_hash.update(chunk)
-
+        scheduler = get_scheduler_for(data_path)
+        with open(fd, "wb", buffering=0) as f:
+            async with scheduler.sink(f, settings.WRITE_BLOCK_SIZE) as sink:
+                while chunk := await file.read(settings.CHUNK_SIZE):
+                    total_size += len(chunk)
+
+                    # Check size limit
+                    if total_size > settings.MAX_UPLOAD_SIZE:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"File size exceeds maximum allowed size of {format_bytes(settings.MAX_UPLOAD_SIZE)}",
+                        )
+
+                    await sink.write(chunk)
+                    sha256_hash.update(chunk)
+
+        os.replace(tmp_path, data_path)
+        pool_link(file_path, data_path)
         checksum = sha256_hash.hexdigest()
         relative_path = str(file_path.relative_to(settings.BASE_DIR))
+        record_change("modified" if existed else "created", file_path)
+        background_tasks.add_task(schedule_compression, file_path)
 
         logger.info(
             "File uploaded", filename=file.filename, size=total_size, checksum=checksum
@@ -628,23 +6126,516 @@ async def upload_file(
             message="File uploaded successfully",
         )
 
+    except HTTPException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    except Exception as e:
+        # Clean up on error; an existing file is left untouched
+        tmp_path.unlink(missing_ok=True)
+        logger.error("Upload failed", filename=file.filename, error=str(e))
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+
+@app.put(
+    "/api/files/{file_path:path}", response_model=FileUploadResponse, tags=["Files"]
+)
+async def put_file(
+    file_path: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    overwrite: bool = False,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Upload a file as the raw request body
+
+    The body is streamed straight into a temp file next to the destination
+    (no multipart spooling), hashed on the fly and atomically renamed into
+    place once complete.
+    """
+    settings = get_settings()
+
+    target_path = validate_path_security(
+        settings.BASE_DIR / file_path, settings.BASE_DIR
+    )
+    target_dir = target_path.parent
+
+    if not target_dir.exists() or not target_dir.is_dir():
+        raise HTTPException(status_code=400, detail="Invalid upload directory")
+
+    file_ext = target_path.suffix.lower()
+    if file_ext not in settings.ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File type {file_ext} not allowed. Allowed types: {', '.join(settings.ALLOWED_EXTENSIONS)}",
+        )
+
+    if target_path.is_dir():
+        raise HTTPException(status_code=400, detail="Path is a directory")
+
+    if target_path.exists() and not overwrite:
+        raise HTTPException(
+            status_code=400,
+            detail="File already exists. Use overwrite=true to replace.",
+        )
+
+    # Reject oversized uploads before reading a single body byte
+    expected_size = request_content_length(request)
+    if expected_size is not None and expected_size > settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File size exceeds maximum allowed size of {format_bytes(settings.MAX_UPLOAD_SIZE)}",
+        )
+
+    data_path = pool_data_path(target_path, expected_size or 0)
+    fd, tmp_name = tempfile.mkstemp(
+        dir=upload_tmp_dir(data_path), prefix=f".{target_path.name}.", suffix=".part"
+    )
+    tmp_path = Path(tmp_name)
+    # mkstemp creates 0600 files; give uploads the usual umask-derived mode
+    os.chmod(tmp_path, 0o666 & ~PROCESS_UMASK)
+    total_size = 0
+    sha256_hash = hashlib.sha256()
+
+    try:
+        if expected_size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, expected_size)
+            except OSError:
+                pass  # Filesystem without fallocate support
+
+        scheduler = get_scheduler_for(data_path)
+        with open(fd, "wb", buffering=0) as f:
+            async with scheduler.sink(f, settings.WRITE_BLOCK_SIZE) as sink:
+                async for chunk in request.stream():
+                    total_size += len(chunk)
+                    if total_size > settings.MAX_UPLOAD_SIZE:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"File size exceeds maximum allowed size of {format_bytes(settings.MAX_UPLOAD_SIZE)}",
+                        )
+                    await sink.write(chunk)
+                    sha256_hash.update(chunk)
+
+        if expected_size is not None and total_size != expected_size:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Incomplete upload: received {total_size} of {expected_size} bytes",
+            )
+
+        existed = target_path.exists()
+        if existed and not overwrite:
+            raise HTTPException(
+                status_code=400,
+                detail="File already exists. Use overwrite=true to replace.",
+            )
+        os.replace(tmp_path, data_path)
+        pool_link(target_path, data_path)
+        record_change("modified" if existed else "created", target_path)
+        background_tasks.add_task(schedule_compression, target_path)
+
+    except HTTPException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    except Exception as e:
+        tmp_path.unlink(missing_ok=True)
+        logger.error("Upload failed", filename=target_path.name, error=str(e))
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+    checksum = sha256_hash.hexdigest()
+    relative_path = str(target_path.relative_to(settings.BASE_DIR))
+
+    logger.info(
+        "File uploaded", filename=target_path.name, size=total_size, checksum=checksum
+    )
+
+    return FileUploadResponse(
+        success=True,
+        filename=target_path.name,
+        size=total_size,
+        checksum=checksum,
+        path=relative_path,
+        message="File uploaded successfully",
+    )
+
+
+@app.post("/api/uploads/sessions", status_code=201, tags=["Files"])
+async def create_upload_session(
+    path: str,
+    size: int,
+    overwrite: bool = False,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Start a chunked upload of a file of the given size
+
+    Send the content with PUT /api/uploads/sessions/{upload_id}?offset=N in
+    any order and over several connections, then POST .../complete.
+    """
+    settings = get_settings()
+    expire_upload_sessions()
+
+    target_path = validate_path_security(settings.BASE_DIR / path, settings.BASE_DIR)
+    if not target_path.parent.is_dir():
+        raise HTTPException(status_code=400, detail="Invalid upload directory")
+
+    file_ext = target_path.suffix.lower()
+    if file_ext not in settings.ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File type {file_ext} not allowed. Allowed types: {', '.join(settings.ALLOWED_EXTENSIONS)}",
+        )
+    if target_path.is_dir():
+        raise HTTPException(status_code=400, detail="Path is a directory")
+    if target_path.exists() and not overwrite:
+        raise HTTPException(
+            status_code=400,
+            detail="File already exists. Use overwrite=true to replace.",
+        )
+    if not 0 <= size <= settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File size exceeds maximum allowed size of {format_bytes(settings.MAX_UPLOAD_SIZE)}",
+        )
+
+    data_path = pool_data_path(target_path, size)
+    fd, tmp_name = tempfile.mkstemp(
+        dir=upload_tmp_dir(data_path), prefix=f".{target_path.name}.", suffix=".part"
+    )
+    try:
+        os.fchmod(fd, 0o666 & ~PROCESS_UMASK)
+        if size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except OSError:
+                os.ftruncate(fd, size)
+        else:
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+    upload_id = secrets.token_urlsafe(16)
+    upload_sessions[upload_id] = UploadSession(
+        target_path, data_path, Path(tmp_name), size
+    )
+    logger.info("Upload session started", upload_id=upload_id, file=path, size=size)
+    return {"upload_id": upload_id, "size": size}
+
+
+@app.put("/api/uploads/sessions/{upload_id}", tags=["Files"])
+async def upload_session_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    _: str = Depends(verify_api_key),
+):
+    """Write the raw request body at offset into the session's file"""
+    settings = get_settings()
+    session = get_upload_session(upload_id)
+
+    length = request_content_length(request)
+    if length is None:
+        raise HTTPException(status_code=411, detail="Content-Length required")
+    if offset < 0 or offset + length > session.size:
+        raise HTTPException(status_code=416, detail="Chunk outside the file")
+
+    received = 0
+    session.active_writes += 1
+    try:
+        fd = os.open(session.tmp_path, os.O_WRONLY)
+        with open(fd, "wb", buffering=0) as f:
+            f.seek(offset)
+            scheduler = get_scheduler_for(session.data_path)
+            async with scheduler.sink(f, settings.WRITE_BLOCK_SIZE) as sink:
+                async for chunk in request.stream():
+                    received += len(chunk)
+                    if received > length:
+                        raise HTTPException(
+                            status_code=400, detail="Body longer than Content-Length"
+                        )
+                    await sink.write(chunk)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    finally:
+        session.active_writes -= 1
+        session.last_activity = time.monotonic()
+
+    if received != length:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Incomplete chunk: received {received} of {length} bytes",
+        )
+    session.chunks[offset] = length
+    return {"offset": offset, "length": length}
+
+
+@app.post(
+    "/api/uploads/sessions/{upload_id}/complete",
+    response_model=FileUploadResponse,
+    tags=["Files"],
+)
+async def complete_upload_session(
+    upload_id: str,
+    background_tasks: BackgroundTasks,
+    overwrite: bool = False,
+    sha256: Optional[str] = None,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Move a fully received upload into place
+
+    With sha256, the assembled file must match it or the session is dropped.
+    """
+    settings = get_settings()
+    session = get_upload_session(upload_id)
+    if session.active_writes:
+        raise HTTPException(status_code=409, detail="Chunks still being written")
+    missing = session.missing_ranges()
+    if missing:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Upload incomplete", "missing": missing[:100]},
+        )
+
+    target_path = session.target_path
+    del upload_sessions[upload_id]
+    try:
+        checksum = await asyncio.to_thread(sha256_of_file, session.tmp_path)
+        if sha256 and checksum != sha256.lower():
+            raise HTTPException(status_code=400, detail="Checksum mismatch")
+
+        existed = target_path.exists()
+        if existed and not overwrite:
+            raise HTTPException(
+                status_code=400,
+                detail="File already exists. Use overwrite=true to replace.",
+            )
+        os.replace(session.tmp_path, session.data_path)
+        pool_link(target_path, session.data_path)
+        record_change("modified" if existed else "created", target_path)
+        background_tasks.add_task(schedule_compression, target_path)
+    except HTTPException:
+        session.tmp_path.unlink(missing_ok=True)
+        raise
+    except Exception as e:
+        session.tmp_path.unlink(missing_ok=True)
+        logger.error("Upload failed", filename=target_path.name, error=str(e))
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+    logger.info(
+        "File uploaded",
+        filename=target_path.name,
+        size=session.size,
+        checksum=checksum,
+        chunks=len(session.chunks),
+    )
+    return FileUploadResponse(
+        success=True,
+        filename=target_path.name,
+        size=session.size,
+        checksum=checksum,
+        path=str(target_path.relative_to(settings.BASE_DIR)),
+        message="File uploaded successfully",
+    )
+
+
+@app.delete("/api/uploads/sessions/{upload_id}", tags=["Files"])
+async def abort_upload_session(
+    upload_id: str,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Abandon a chunked upload and free its space"""
+    session = get_upload_session(upload_id)
+    if session.active_writes:
+        raise HTTPException(status_code=409, detail="Chunks still being written")
+    del upload_sessions[upload_id]
+    session.tmp_path.unlink(missing_ok=True)
+    return {"success": True}
+
+
+@app.get("/api/delta/signature/{file_path:path}", tags=["Delta Sync"])
+def get_delta_signature(
+    file_path: str,
+    block_size: Optional[int] = None,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Block signatures of an existing file for rsync-style delta uploads
+
+    Returns an Adler-32 (zlib.adler32) weak checksum and a BLAKE2b-128 strong
+    hash per block. The response ETag must be sent back as If-Match when the
+    patch is applied, so a patch is never applied to a different base.
+    """
+    settings = get_settings()
+
+    full_path = validate_path_security(settings.BASE_DIR / file_path, settings.BASE_DIR)
+
+    stat = stat_path(full_path, fresh=True)
+    if stat is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if not stat_module.S_ISREG(stat.st_mode):
+        raise HTTPException(status_code=400, detail="Path is not a file")
+
+    if block_size is None:
+        block_size = default_delta_block_size(stat.st_size)
+    elif not (
+        settings.DELTA_MIN_BLOCK_SIZE <= block_size <= settings.DELTA_MAX_BLOCK_SIZE
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail=f"block_size must be between {settings.DELTA_MIN_BLOCK_SIZE} and {settings.DELTA_MAX_BLOCK_SIZE}",
+        )
+
+    started = time.time()
+    blocks = compute_block_signatures(full_path, block_size)
+    etag = make_etag(stat)
+    compression = get_compression_info(full_path, stat)
+
+    logger.info(
+        "Delta signature",
+        file=file_path,
+        blocks=len(blocks),
+        duration_ms=round((time.time() - started) * 1000, 2),
+    )
+
+    return JSONResponse(
+        content={
+            "path": file_path,
+            "size": compression["logical_size"] if compression else stat.st_size,
+            "block_size": block_size,
+            "weak_checksum": "adler32",
+            "strong_hash": "blake2b-128",
+            "etag": etag,
+            "blocks": blocks,
+        },
+        headers=validator_headers(stat, etag),
+    )
+
+
+@app.post(
+    "/api/delta/patch/{file_path:path}",
+    response_model=FileUploadResponse,
+    tags=["Delta Sync"],
+)
+async def apply_delta(
+    file_path: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    block_size: int,
+    checksum: str,
+    if_match: Optional[str] = Header(None),
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Rebuild a file from its current version plus a streamed patch script
+
+    The new version is written to a temp file next to the original, verified
+    against the full SHA256 in checksum and only then atomically swapped in.
+    """
+    settings = get_settings()
+
+    full_path = validate_path_security(settings.BASE_DIR / file_path, settings.BASE_DIR)
+
+    if not full_path.exists():
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if not full_path.is_file():
+        raise HTTPException(status_code=400, detail="Path is not a file")
+
+    if not (
+        settings.DELTA_MIN_BLOCK_SIZE <= block_size <= settings.DELTA_MAX_BLOCK_SIZE
+    ):
+        raise HTTPException(status_code=400, detail="Invalid block_size")
+
+    stat = full_path.stat()
+    if if_match is None:
+        raise HTTPException(
+            status_code=428, detail="If-Match with the signature ETag is required"
+        )
+    if not _etag_in(if_match, make_etag(stat)):
+        raise HTTPException(
+            status_code=412,
+            detail="File changed since the signature was taken. Fetch a new one.",
+        )
+
+    data_path = pool_data_path(full_path)
+    fd, tmp_name = tempfile.mkstemp(
+        dir=data_path.parent, prefix=f".{full_path.name}.", suffix=".part"
+    )
+    tmp_path = Path(tmp_name)
+    os.chmod(tmp_path, stat.st_mode & 0o777)
+    sha256_hash = hashlib.sha256()
+    reader = PatchStreamReader(request.stream())
+
+    try:
+        scheduler = get_scheduler_for(data_path)
+        with open(fd, "wb", buffering=0) as f:
+            async with scheduler.sink(f, settings.WRITE_BLOCK_SIZE) as sink:
+                total_size = await apply_delta_patch(
+                    reader, full_path, sink, block_size, sha256_hash
+                )
+
+        if sha256_hash.hexdigest() != checksum.lower():
+            raise HTTPException(
+                status_code=400,
+                detail="Checksum mismatch: reconstructed file does not match",
+            )
+
+        # Re-check the base right before swapping in the new version
+        if make_etag(full_path.stat()) != make_etag(stat):
+            raise HTTPException(
+                status_code=412, detail="File changed while the patch was applied"
+            )
+        os.replace(tmp_path, data_path)
+        record_change("modified", full_path)
+        background_tasks.add_task(schedule_compression, full_path)
+
+    except HTTPException:
+        tmp_path.unlink(missing_ok=True)
+        raise
     except Exception as e:
-        # Clean up on error
-        file_path.unlink(missing_ok=True)
-        logger.error("Upload failed", filename=file.filename, error=str(e))
-        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+        tmp_path.unlink(missing_ok=True)
+        logger.error("Delta patch failed", file=file_path, error=str(e))
+        raise HTTPException(status_code=500, detail=f"Delta patch failed: {str(e)}")
+
+    relative_path = str(full_path.relative_to(settings.BASE_DIR))
+    logger.info(
+        "Delta patch applied",
+        file=relative_path,
+        size=total_size,
+        transferred=reader.bytes_received,
+        checksum=checksum,
+    )
+
+    return FileUploadResponse(
+        success=True,
+        filename=full_path.name,
+        size=total_size,
+        checksum=sha256_hash.hexdigest(),
+        path=relative_path,
+        message=f"File updated from delta ({format_bytes(reader.bytes_received)} transferred)",
+    )
 
 
 @app.get("/api/search", tags=["Files"])
-async def search_files(
+def search_files(
     q: str,
     file_type: Optional[str] = None,
     sort_by: str = "name",
     limit: Optional[int] = 50,  # Reduced from 100
+    content: bool = False,
+    format: str = Query("objects", pattern="^(objects|columnar)$"),
     _: str = Depends(verify_api_key),
     __: None = Depends(check_rate_limit),
 ):
-    """Search files with improved performance and filtering"""
+    """Search files with improved performance and filtering
+
+    content=true searches inside documents via the full-text index and
+    returns results ranked by relevance, each with a highlighted snippet.
+    format=columnar returns the results as parallel arrays.
+    """
     settings = get_settings()
 
     if len(q) < 2:
@@ -652,6 +6643,27 @@ async def search_files(
             status_code=400, detail="Search query must be at least 2 characters"
         )
 
+    if content:
+        start_time = time.time()
+        results = search_content(q, file_type, limit or 50)
+        if sort_by == "size":
+            results.sort(key=lambda x: x["size"], reverse=True)
+        elif sort_by == "date":
+            results.sort(key=lambda x: x["modification_date"], reverse=True)
+        response = {
+            "query": q,
+            "file_type": file_type,
+            "mode": "content",
+            "count": len(results),
+            "results": results,
+            "limited": limit is not None and len(results) >= limit,
+            "search_duration_ms": round((time.time() - start_time) * 1000, 2),
+        }
+        if format == "columnar":
+            response.update(search_results_columnar(response.pop("results")))
+            return fast_json_response(response)
+        return response
+
     query_lower = q.lower()
     results = []
     image_ext = [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"]
@@ -665,6 +6677,10 @@ async def search_files(
     # Use rglob for recursive search with safety limits
     try:
         for file_path in settings.BASE_DIR.rglob("*"):
+            if any(
+                name in file_path.parts for name in INTERNAL_DIR_NAMES
+            ) and is_internal_path(file_path):
+                continue
             # Safety checks
             files_scanned += 1
             if files_scanned > MAX_FILES_SCANNED:
@@ -689,16 +6705,16 @@ async def search_files(
                 try:
                     stat = file_path.stat()
                     relative_path = str(file_path.relative_to(settings.BASE_DIR))
+                    compression = get_compression_info(file_path, stat)
+                    size = compression["logical_size"] if compression else stat.st_size
 
                     results.append(
                         {
                             "filename": file_path.name,
                             "path": relative_path,
-                            "size": stat.st_size,
-                            "size_human": format_bytes(stat.st_size),
-                            "modification_date": datetime.datetime.fromtimestamp(
-                                stat.st_mtime
-                            ),
+                            "size": size,
+                            "size_human": format_bytes(size),
+                            "modification_date": datetime.fromtimestamp(stat.st_mtime),
                             "folder": str(
                                 file_path.parent.relative_to(settings.BASE_DIR)
                             ),
@@ -727,7 +6743,7 @@ async def search_files(
     else:
         results.sort(key=lambda x: x["filename"].lower())
 
-    return {
+    response = {
         "query": q,
         "file_type": file_type,
         "count": len(results),
@@ -736,65 +6752,81 @@ async def search_files(
         "files_scanned": files_scanned,
         "search_duration_ms": round((time.time() - start_time) * 1000, 2),
     }
+    if format == "columnar":
+        response.update(search_results_columnar(response.pop("results")))
+        return fast_json_response(response)
+    return response
 
 
 @app.get("/api/thumbnail/{file_path:path}", tags=["Files"])
-async def get_thumbnail(
+def get_thumbnail(
     file_path: str,
+    request: Request,
     size: int = 200,
     format: str = "webp",  # webp is more efficient
+    wait: bool = False,
     _: str = Depends(verify_api_key),
 ):
-    """Generate and cache image thumbnails"""
+    """Generate and cache image thumbnails
+
+    Pyramid sizes (webp at a PREVIEW_SIZES width) that are not rendered yet
+    are queued and answered with 202 and a placeholder; retry after
+    Retry-After or wait for the job on /api/thumbnails/events. wait=true
+    blocks until the thumbnail is ready instead.
+    """
     settings = get_settings()
 
-    valid_formats = ["jpeg", "png", "webp"]
-    if format.lower() not in valid_formats:
+    if format.lower() not in THUMBNAIL_FORMATS:
         raise HTTPException(
-            status_code=400, detail=f"Invalid format. Must be one of: {valid_formats}"
+            status_code=400,
+            detail=f"Invalid format. Must be one of: {THUMBNAIL_FORMATS}",
         )
 
     full_path = settings.BASE_DIR / file_path
     full_path = validate_path_security(full_path, settings.BASE_DIR)
 
-    if not full_path.exists() or not full_path.is_file():
+    stat = stat_path(full_path)
+    if stat is None or not stat_module.S_ISREG(stat.st_mode):
         raise HTTPException(status_code=404, detail="File not found")
 
     image_ext = [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"]
     if full_path.suffix.lower() not in image_ext:
         raise HTTPException(status_code=400, detail="File is not an image")
 
+    # Revalidate against the source image before paying for a decode
+    headers = validator_headers(stat, make_etag(stat, f"{size}{format.lower()}"))
+    headers["Cache-Control"] = "public, no-cache"
+    if is_not_modified(request, stat, headers["ETag"]):
+        return not_modified_response(headers)
+
     try:
-        img = Image.open(full_path)
-        img.thumbnail((size, size), Image.Resampling.LANCZOS)
-
-        buffer = io.BytesIO()
-
-        # Handle transparency
-        if img.mode in ("RGBA", "LA", "P"):
-            bg = Image.new("RGB", img.size, (255, 255, 255))
-            if img.mode == "P":
-                img = img.convert("RGBA")
-            bg.paste(img, mask=img.split()[-1] if img.mode in ("RGBA", "LA") else None)
-            img = bg
-
-        # Save with optimized settings
-        output_format = format.upper()
-        if output_format == "WEBP":
-            img.save(buffer, format="WEBP", quality=85, method=6)
-        elif output_format == "JPEG":
-            img.save(buffer, format="JPEG", quality=85, optimize=True)
-        else:
-            img.save(buffer, format="PNG", optimize=True)
+        if format.lower() == "webp" and size in settings.PREVIEW_SIZES:
+            # Served from the preview pyramid: one decode covers every size
+            relative_path = str(full_path.relative_to(settings.BASE_DIR))
+            source_etag = make_etag(stat)
+            if (
+                settings.THUMBNAIL_ASYNC
+                and not wait
+                and not preview_ready(relative_path, source_etag)
+            ):
+                return thumbnail_pending_response(
+                    thumbnail_jobs.enqueue(full_path, relative_path, source_etag)
+                )
+            preview_path = get_preview_path(full_path, relative_path, source_etag, size)
+            return FileResponse(
+                path=preview_path, media_type="image/webp", headers=headers
+            )
 
-        buffer.seek(0)
+        thumbnail = render_thumbnail(full_path, size, format)
 
         return StreamingResponse(
-            buffer,
+            io.BytesIO(thumbnail),
             media_type=f"image/{format}",
-            headers={"Cache-Control": "public, max-age=86400"},  # 24 hour cache
+            headers=headers,
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error("Thumbnail generation failed", file=file_path, error=str(e))
         raise HTTPException(
@@ -802,6 +6834,283 @@ async def get_thumbnail(
         )
 
 
+@app.get("/api/preview/{file_path:path}", tags=["Files"])
+async def get_preview(
+    file_path: str,
+    request: Request,
+    width: int = 200,
+    wait: bool = False,
+    _: str = Depends(verify_api_key),
+):
+    """Serve the closest pre-rendered preview size for an image
+
+    All configured sizes are produced from one decode and stored together, so
+    grid icons, thumbnails and lightbox views never re-read the original.
+    Like /api/thumbnail, an image not rendered yet gets 202 unless wait=true.
+    """
+    settings = get_settings()
+
+    full_path = settings.BASE_DIR / file_path
+    full_path = validate_path_security(full_path, settings.BASE_DIR)
+
+    stat = stat_path(full_path)
+    if stat is None or not stat_module.S_ISREG(stat.st_mode):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if full_path.suffix.lower() not in IMAGE_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="File is not an image")
+
+    if width < 1:
+        raise HTTPException(status_code=400, detail="Width must be positive")
+
+    source_etag = make_etag(stat)
+    served_size = closest_preview_size(width)
+    headers = validator_headers(stat, make_etag(stat, f"p{served_size}"))
+    headers["Cache-Control"] = "public, no-cache"
+    if is_not_modified(request, stat, headers["ETag"]):
+        return not_modified_response(headers)
+
+    relative_path = str(full_path.relative_to(settings.BASE_DIR))
+    if (
+        settings.THUMBNAIL_ASYNC
+        and not wait
+        and not preview_ready(relative_path, source_etag)
+    ):
+        return thumbnail_pending_response(
+            thumbnail_jobs.enqueue(full_path, relative_path, source_etag)
+        )
+    try:
+        preview_path = await asyncio.get_running_loop().run_in_executor(
+            thumbnail_executor,
+            get_preview_path,
+            full_path,
+            relative_path,
+            source_etag,
+            width,
+        )
+    except Exception as e:
+        logger.error("Preview generation failed", file=file_path, error=str(e))
+        raise HTTPException(
+            status_code=500, detail=f"Error generating preview: {str(e)}"
+        )
+
+    return FileResponse(path=preview_path, media_type="image/webp", headers=headers)
+
+
+def collect_batch_thumbnail_paths(
+    batch: ThumbnailBatchRequest, base_dir: Path
+) -> List[Path]:
+    """Resolve the images a batch thumbnail request refers to"""
+    settings = get_settings()
+
+    if batch.paths is not None:
+        candidates = [
+            validate_path_security(base_dir / p, base_dir) for p in batch.paths
+        ]
+    else:
+        target_dir = base_dir / batch.path if batch.path else base_dir
+        target_dir = validate_path_security(target_dir, base_dir)
+        if not target_dir.is_dir():
+            raise HTTPException(status_code=404, detail="Directory not found")
+        candidates = sorted(
+            (
+                item
+                for item in target_dir.iterdir()
+                if item.suffix.lower() in IMAGE_EXTENSIONS and item.is_file()
+            ),
+            key=lambda x: x.name.lower(),
+        )
+
+    if len(candidates) > settings.MAX_BATCH_THUMBNAILS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many images in one batch (max {settings.MAX_BATCH_THUMBNAILS})",
+        )
+    return candidates
+
+
+def render_batch_item(
+    full_path: Path, size: int, format: Optional[str]
+) -> Dict[str, Any]:
+    """Render one batch thumbnail, capturing errors instead of raising
+
+    With format=None the decoded image is returned unencoded (for sprites).
+    """
+    try:
+        if not full_path.is_file():
+            raise FileNotFoundError("File not found")
+        if full_path.suffix.lower() not in IMAGE_EXTENSIONS:
+            raise ValueError("File is not an image")
+        img = render_thumbnail_image(full_path, size)
+        if format is None:
+            return {"path": full_path, "image": img}
+        return {"path": full_path, "data": encode_image(img, format)}
+    except Exception as e:
+        logger.error("Thumbnail generation failed", file=str(full_path), error=str(e))
+        return {"path": full_path, "error": str(e)}
+
+
+@app.get("/api/thumbnails/jobs/{job_id}", tags=["Files"])
+async def get_thumbnail_job(
+    job_id: str,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Status of a queued thumbnail job: queued, running, done or failed"""
+    job = thumbnail_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    del job["etag"]
+    return job
+
+
+@app.get("/api/thumbnails/events", tags=["Files"])
+async def thumbnail_events(request: Request, _: str = Depends(verify_api_key)):
+    """Server-sent events announcing finished thumbnail jobs
+
+    Each event is {"id", "path", "status"}; reload the image on "done".
+    """
+    queue = thumbnail_jobs.subscribe()
+
+    async def iter_events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: thumbnail\ndata: {json.dumps(event)}\n\n"
+        finally:
+            thumbnail_jobs.unsubscribe(queue)
+
+    return StreamingResponse(
+        iter_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/api/thumbnails/batch", tags=["Files"])
+async def get_thumbnails_batch(
+    batch: ThumbnailBatchRequest,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Generate thumbnails for a whole directory (or list of paths) in one response
+
+    The multipart layout streams each thumbnail as soon as it is rendered. The
+    sprite layout packs every thumbnail into a single image and returns it with
+    a JSON offset map.
+    """
+    settings = get_settings()
+
+    format = batch.format.lower()
+    if format not in THUMBNAIL_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid format. Must be one of: {THUMBNAIL_FORMATS}",
+        )
+    if batch.layout not in ("multipart", "sprite"):
+        raise HTTPException(
+            status_code=400, detail="Invalid layout. Must be multipart or sprite"
+        )
+
+    image_paths = collect_batch_thumbnail_paths(batch, settings.BASE_DIR)
+    loop = asyncio.get_running_loop()
+    item_format = None if batch.layout == "sprite" else format
+    futures = [
+        loop.run_in_executor(
+            thumbnail_executor, render_batch_item, p, batch.size, item_format
+        )
+        for p in image_paths
+    ]
+
+    logger.info(
+        "Batch thumbnails", count=len(image_paths), size=batch.size, layout=batch.layout
+    )
+
+    if batch.layout == "sprite":
+        results = await asyncio.gather(*futures)
+        return await loop.run_in_executor(
+            thumbnail_executor,
+            build_thumbnail_sprite,
+            results,
+            batch.size,
+            format,
+            settings.BASE_DIR,
+        )
+
+    boundary = secrets.token_hex(16)
+
+    async def iter_parts():
+        try:
+            for next_done in asyncio.as_completed(futures):
+                result = await next_done
+                relative_path = str(result["path"].relative_to(settings.BASE_DIR))
+                if "error" in result:
+                    body = json.dumps({"error": result["error"]}).encode()
+                    content_type = "application/json"
+                else:
+                    body = result["data"]
+                    content_type = f"image/{format}"
+                headers = (
+                    f"--{boundary}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Location: {quote(relative_path)}\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n"
+                )
+                yield headers.encode() + body + b"\r\n"
+            yield f"--{boundary}--\r\n".encode()
+        finally:
+            # Client went away: don't decode images nobody will receive
+            for fut in futures:
+                fut.cancel()
+
+    return StreamingResponse(
+        iter_parts(),
+        media_type=f"multipart/mixed; boundary={boundary}",
+        headers={"Cache-Control": "no-store"},
+    )
+
+
+def build_thumbnail_sprite(
+    results: List[Dict[str, Any]], size: int, format: str, base_dir: Path
+) -> Dict[str, Any]:
+    """Pack rendered thumbnails into one sprite sheet with an offset map"""
+    rendered = [r for r in results if "image" in r]
+    columns = max(1, min(len(rendered), 10))
+    rows = max(1, -(-len(rendered) // columns))
+    sheet = Image.new("RGB", (columns * size, rows * size), (255, 255, 255))
+
+    offsets = {}
+    for index, result in enumerate(rendered):
+        x, y = (index % columns) * size, (index // columns) * size
+        thumb = result["image"]
+        sheet.paste(thumb, (x, y))
+        offsets[str(result["path"].relative_to(base_dir))] = {
+            "x": x,
+            "y": y,
+            "width": thumb.width,
+            "height": thumb.height,
+        }
+
+    sprite = encode_image(sheet, format)
+    return {
+        "cell_size": size,
+        "columns": columns,
+        "rows": rows,
+        "sprite": f"data:image/{format};base64,"
+        + base64.b64encode(sprite).decode("ascii"),
+        "offsets": offsets,
+        "errors": {
+            str(r["path"].relative_to(base_dir)): r["error"]
+            for r in results
+            if "error" in r
+        },
+    }
+
+
 @app.post("/api/folders/create", tags=["Folders"])
 async def create_folder(
     folder_data: FolderCreate,
@@ -825,6 +7134,7 @@ async def create_folder(
 
     try:
         new_folder.mkdir(parents=False, exist_ok=False)
+        record_change("created", new_folder)
         logger.info(
             "Folder created", path=str(new_folder.relative_to(settings.BASE_DIR))
         )
@@ -859,6 +7169,8 @@ async def delete_item(
     try:
         if full_path.is_file():
             full_path.unlink()
+            pool_remove(full_path, is_dir=False)
+            record_change("deleted", full_path, is_dir=False)
             logger.info("File deleted", path=item_path)
             return {
                 "success": True,
@@ -875,6 +7187,8 @@ async def delete_item(
                         detail="Folder is not empty. Use force=true to delete non-empty folders",
                     )
                 shutil.rmtree(full_path)
+                pool_remove(full_path, is_dir=True)
+                record_change("deleted", full_path, is_dir=True)
                 logger.info("Folder deleted (forced)", path=item_path)
                 return {
                     "success": True,
@@ -884,6 +7198,8 @@ async def delete_item(
                 }
             else:
                 full_path.rmdir()
+                pool_remove(full_path, is_dir=True)
+                record_change("deleted", full_path, is_dir=True)
                 logger.info("Empty folder deleted", path=item_path)
                 return {
                     "success": True,
@@ -911,46 +7227,46 @@ async def stream_video(
     full_path = settings.BASE_DIR / file_path
     full_path = validate_path_security(full_path, settings.BASE_DIR)
 
-    if not full_path.exists() or not full_path.is_file():
+    stat = stat_path(full_path, fresh=True)
+    if stat is None or not stat_module.S_ISREG(stat.st_mode):
         raise HTTPException(status_code=404, detail="File not found")
 
     video_extensions = [".mp4", ".mkv", ".avi", ".mov", ".webm", ".flv", ".wmv", ".m4v"]
     if full_path.suffix.lower() not in video_extensions:
         raise HTTPException(status_code=400, detail="File is not a video")
 
-    file_size = full_path.stat().st_size
+    # Trailing-moov MP4s are served as a virtual fast-start file
+    layout = await asyncio.to_thread(faststart_layout_for, full_path, stat)
+    file_size = layout.size if layout else stat.st_size
     range_header = request.headers.get("range")
 
+    validators = validator_headers(stat, make_etag(stat, "faststart" if layout else ""))
+    if is_not_modified(request, stat, validators["ETag"]):
+        return not_modified_response(validators)
+
+    # A stale If-Range means the client's partial copy is outdated: send it all
+    if range_header and not if_range_allows(request, stat, validators["ETag"]):
+        range_header = None
+
     mime_type, _ = mimetypes.guess_type(str(full_path))
     if not mime_type:
         mime_type = "video/mp4"
 
-    # Handle range request for seeking
-    if range_header:
-        byte_range = range_header.replace("bytes=", "").split("-")
-        start = int(byte_range[0]) if byte_range[0] else 0
-        end = (
-            int(byte_range[1])
-            if len(byte_range) > 1 and byte_range[1]
-            else file_size - 1
-        )
+    def iterfile(start: int, end: int):
+        # Opened on the first read, so a 416 or an unread body leaves no fd
+        source = open_fast_copy(full_path, stat) or full_path
+        if layout:
+            yield from layout.iter_range(source, start, end, settings.CHUNK_SIZE)
+            return
+        yield from iter_file_range(source, start, end, settings.CHUNK_SIZE)
 
+    # Handle range request for seeking
+    byte_range = parse_byte_range(range_header, file_size) if range_header else None
+    if byte_range:
+        start, end = byte_range
         content_length = end - start + 1
-
-        def iterfile():
-            with open(full_path, "rb") as f:
-                f.seek(start)
-                remaining = content_length
-                while remaining > 0:
-                    chunk_size = min(settings.CHUNK_SIZE, remaining)
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    remaining -= len(chunk)
-                    yield chunk
-
         return StreamingResponse(
-            iterfile(),
+            iterfile(start, end),
             status_code=206,
             media_type=mime_type,
             headers={
@@ -958,22 +7274,19 @@ async def stream_video(
                 "Accept-Ranges": "bytes",
                 "Content-Length": str(content_length),
                 "Cache-Control": "public, max-age=3600",
+                **validators,
             },
         )
 
     # Stream entire file
-    def iterfile():
-        with open(full_path, "rb") as f:
-            while chunk := f.read(settings.CHUNK_SIZE):
-                yield chunk
-
     return StreamingResponse(
-        iterfile(),
+        iterfile(0, file_size - 1),
         media_type=mime_type,
         headers={
             "Accept-Ranges": "bytes",
             "Content-Length": str(file_size),
             "Cache-Control": "public, max-age=3600",
+            **validators,
         },
     )
 
@@ -991,36 +7304,488 @@ async def get_file_info(
     full_path = settings.BASE_DIR / file_path
     full_path = validate_path_security(full_path, settings.BASE_DIR)
 
-    if not full_path.exists():
+    stat = stat_path(full_path)
+    if stat is None:
         raise HTTPException(status_code=404, detail="File not found")
 
-    if not full_path.is_file():
+    if not stat_module.S_ISREG(stat.st_mode):
         raise HTTPException(status_code=400, detail="Path is not a file")
 
-    stat = full_path.stat()
     mime_type, encoding = mimetypes.guess_type(str(full_path))
+    compression = get_compression_info(full_path, stat)
+    size = compression["logical_size"] if compression else stat.st_size
 
     info = {
         "name": full_path.name,
         "path": file_path,
-        "size": stat.st_size,
-        "size_human": format_bytes(stat.st_size),
+        "size": size,
+        "size_human": format_bytes(size),
         "extension": full_path.suffix.lower(),
         "mime_type": mime_type,
         "encoding": encoding,
-        "created": datetime.datetime.fromtimestamp(
+        "created": datetime.fromtimestamp(
             stat.st_birthtime if hasattr(stat, "st_birthtime") else stat.st_ctime
         ),
-        "modified": datetime.datetime.fromtimestamp(stat.st_mtime),
-        "accessed": datetime.datetime.fromtimestamp(stat.st_atime),
+        "modified": datetime.fromtimestamp(stat.st_mtime),
+        "accessed": datetime.fromtimestamp(stat.st_atime),
     }
 
+    if compression:
+        info["stored_compressed"] = compression["codec"]
+        info["stored_size"] = compression["stored_size"]
+
     if include_checksum:
         info["checksum_sha256"] = calculate_checksum(full_path)
 
     return info
 
 
+def validate_zip_path(file_path: str) -> tuple:
+    """Validated full path and stat of an existing .zip file"""
+    settings = get_settings()
+    full_path = validate_path_security(settings.BASE_DIR / file_path, settings.BASE_DIR)
+    stat = stat_path(full_path, fresh=True)
+    if stat is None or not stat_module.S_ISREG(stat.st_mode):
+        raise HTTPException(status_code=404, detail="File not found")
+    if full_path.suffix.lower() != ".zip":
+        raise HTTPException(status_code=400, detail="File is not a ZIP archive")
+    return full_path, stat
+
+
+@app.get("/api/zip/entries/{file_path:path}", tags=["Archives"])
+async def list_zip_entries(
+    file_path: str,
+    prefix: str = "",
+    offset: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=10000),
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """List the members of a ZIP archive from its central directory
+
+    prefix narrows the listing to a folder inside the archive (e.g. "DCIM/").
+    """
+    full_path, stat = validate_zip_path(file_path)
+    index = await asyncio.to_thread(zip_index_for, full_path, stat)
+    names = [name for name in index if name.startswith(prefix)]
+    return {
+        "path": file_path,
+        "count": len(names),
+        "offset": offset,
+        "entries": [
+            describe_zip_member(index[name]) for name in names[offset : offset + limit]
+        ],
+    }
+
+
+@app.get("/api/zip/extract/{file_path:path}", tags=["Archives"])
+async def extract_zip_member(
+    file_path: str,
+    member: str,
+    request: Request,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Stream one member out of a ZIP archive
+
+    Byte ranges are supported for STORED (uncompressed) members, which is
+    how most photo and video archives are written.
+    """
+    full_path, stat = validate_zip_path(file_path)
+    index = await asyncio.to_thread(zip_index_for, full_path, stat)
+    info = index.get(member)
+    if info is None or info.is_dir():
+        raise HTTPException(status_code=404, detail="Member not found in archive")
+    if info.flag_bits & 0x1:
+        raise HTTPException(status_code=400, detail="Member is encrypted")
+
+    member_tag = hashlib.sha1(member.encode("utf-8")).hexdigest()[:12]
+    headers = validator_headers(stat, make_etag(stat, f"zip{member_tag}"))
+    if is_not_modified(request, stat, headers["ETag"]):
+        return not_modified_response(headers)
+
+    # Archive contents are untrusted: only media is shown inline, anything
+    # else (HTML, SVG, ...) is a download so it can't run on this origin
+    media_type = mimetypes.guess_type(member)[0] or "application/octet-stream"
+    disposition = "inline"
+    if not media_type.startswith(ZIP_INLINE_TYPES) or media_type == "image/svg+xml":
+        media_type = "application/octet-stream"
+        disposition = "attachment"
+    headers["Content-Disposition"] = (
+        f"{disposition}; filename*=utf-8''{quote(os.path.basename(member))}"
+    )
+    headers["X-Content-Type-Options"] = "nosniff"
+    stored = info.compress_type == zipfile.ZIP_STORED
+    if stored:
+        headers["Accept-Ranges"] = "bytes"
+
+    range_header = request.headers.get("range")
+    if stored and range_header and if_range_allows(request, stat, headers["ETag"]):
+        byte_range = parse_byte_range(range_header, info.file_size)
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{info.file_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                iter_zip_member(full_path, info, start, end),
+                status_code=206,
+                media_type=media_type,
+                headers=headers,
+            )
+
+    headers["Content-Length"] = str(info.file_size)
+    logger.info(
+        "ZIP member extracted", file=file_path, member=member, size=info.file_size
+    )
+    return StreamingResponse(
+        iter_zip_member(full_path, info), media_type=media_type, headers=headers
+    )
+
+
+@app.get("/api/changes", tags=["Sync"])
+def get_changes(
+    cursor: Optional[int] = None,
+    limit: int = 1000,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Changes since a cursor, for incremental sync
+
+    Call without a cursor to get the current position, then list the tree once.
+    Afterwards pass the returned cursor to receive only what changed. When
+    reset_required is true the cursor predates the retained journal and the
+    client has to resync from a full listing.
+    """
+    limit = max(1, min(limit, 10000))
+    conn = get_journal_db()
+    latest = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+    latest = max(latest, _journal_meta(conn, "floor"))
+
+    if cursor is None:
+        return {"cursor": latest, "changes": [], "has_more": False}
+
+    if cursor < _journal_meta(conn, "floor") or cursor > latest:
+        return {
+            "cursor": latest,
+            "changes": [],
+            "has_more": False,
+            "reset_required": True,
+        }
+
+    rows = conn.execute(
+        "SELECT seq, path, op, is_dir, size, mtime, old_path, source, ts"
+        " FROM changes WHERE seq > ? ORDER BY seq LIMIT ?",
+        (cursor, limit + 1),
+    ).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    changes = [
+        {
+            "seq": seq,
+            "path": path,
+            "op": op,
+            "is_folder": bool(is_dir),
+            "size": size,
+            "modification_date": (
+                datetime.fromtimestamp(mtime) if mtime is not None else None
+            ),
+            "old_path": old_path,
+            "source": source,
+            "timestamp": datetime.fromtimestamp(ts),
+        }
+        for seq, path, op, is_dir, size, mtime, old_path, source, ts in rows
+    ]
+
+    return {
+        "cursor": rows[-1][0] if rows else cursor,
+        "changes": changes,
+        "has_more": has_more,
+        "reset_required": False,
+    }
+
+
+@app.get("/api/snapshots", tags=["Snapshots"])
+async def list_snapshots(
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Snapshots, newest first; browse one with /api/files?snapshot=ID"""
+    settings = get_settings()
+    rows = await asyncio.to_thread(
+        lambda: get_snapshot_db()
+        .execute("SELECT * FROM snapshots ORDER BY id DESC")
+        .fetchall()
+    )
+    return {
+        "interval": settings.SNAPSHOT_INTERVAL,
+        "keep_hourly": settings.SNAPSHOT_KEEP_HOURLY,
+        "keep_daily": settings.SNAPSHOT_KEEP_DAILY,
+        "count": len(rows),
+        "snapshots": [snapshot_summary(row) for row in rows],
+    }
+
+
+@app.post("/api/snapshots", status_code=201, tags=["Snapshots"])
+async def take_snapshot(
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Take a snapshot now, then apply the retention policy"""
+    try:
+        summary = await asyncio.to_thread(create_snapshot)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    await asyncio.to_thread(prune_snapshots)
+    return summary
+
+
+@app.delete("/api/snapshots/{snapshot_id}", tags=["Snapshots"])
+async def delete_snapshot(
+    snapshot_id: int,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Delete a snapshot (the newest one cannot be deleted)"""
+
+    def drop():
+        with _snapshot_lock:
+            conn = get_snapshot_db()
+            require_snapshot(snapshot_id)
+            newest = conn.execute("SELECT MAX(id) FROM snapshots").fetchone()[0]
+            if snapshot_id == newest:
+                raise HTTPException(
+                    status_code=409, detail="The newest snapshot cannot be deleted"
+                )
+            drop_snapshots(conn, [snapshot_id])
+
+    await asyncio.to_thread(drop)
+    return {"success": True, "message": f"Snapshot {snapshot_id} deleted"}
+
+
+@app.post("/api/snapshots/{snapshot_id}/restore", tags=["Snapshots"])
+async def restore_snapshot(
+    snapshot_id: int,
+    path: str = "",
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Restore a file or folder (path) from a snapshot into the live share"""
+    relative_path = snapshot_relative_path(path)
+    result = await asyncio.to_thread(restore_from_snapshot, snapshot_id, relative_path)
+    return {"success": True, "snapshot": snapshot_id, "path": relative_path, **result}
+
+
+@app.post("/api/duplicates/scan", status_code=202, tags=["Duplicates"])
+def start_duplicate_scan(
+    _: str = Depends(verify_api_key), __: None = Depends(check_rate_limit)
+):
+    """Start a duplicate scan, reusing hashes of files unchanged since the last one"""
+    if not duplicate_scan.start():
+        raise HTTPException(
+            status_code=409, detail="A duplicate scan is already running"
+        )
+    logger.info("Duplicate scan started")
+    return duplicate_scan.status()
+
+
+@app.delete("/api/duplicates/scan", tags=["Duplicates"])
+def cancel_duplicate_scan(
+    _: str = Depends(verify_api_key), __: None = Depends(check_rate_limit)
+):
+    """Stop the running scan; hashes computed so far are kept"""
+    if not duplicate_scan.cancel():
+        raise HTTPException(status_code=404, detail="No duplicate scan is running")
+    return {"success": True, "message": "Duplicate scan cancellation requested"}
+
+
+@app.get("/api/duplicates/status", tags=["Duplicates"])
+def get_duplicate_scan_status(
+    _: str = Depends(verify_api_key), __: None = Depends(check_rate_limit)
+):
+    """Stage and progress counters of the current or last scan"""
+    return duplicate_scan.status()
+
+
+@app.get("/api/duplicates", tags=["Duplicates"])
+def list_duplicates(
+    min_size: int = 1,
+    offset: int = 0,
+    limit: int = 100,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Duplicate groups found by the last scan, with reclaimable bytes"""
+    limit = max(1, min(limit, 1000))
+    return get_duplicate_groups(max(min_size, 1), max(offset, 0), limit)
+
+
+@app.get("/api/photos", tags=["Photos"])
+def list_photos(
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    month: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    min_width: Optional[int] = None,
+    min_height: Optional[int] = None,
+    orientation: Optional[str] = Query(None, pattern="^(landscape|portrait|square)$"),
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Photo timeline ordered by capture date
+
+    Pages by keyset on the (taken_at, path) index: pass next_cursor from the
+    previous page to continue, so every page costs O(limit).
+    """
+    limit = max(1, min(limit, 1000))
+    conditions, params = [], []
+    if cursor:
+        comparison = "<" if order == "desc" else ">"
+        conditions.append(f"(taken_at, path) {comparison} (?, ?)")
+        params.extend(decode_photo_cursor(cursor))
+    if month:
+        year, month_number = int(month[:4]), int(month[5:])
+        if not 1 <= month_number <= 12:
+            raise HTTPException(status_code=400, detail="Invalid month")
+        next_month = (
+            f"{year + 1:04d}-01"
+            if month_number == 12
+            else f"{year:04d}-{month_number + 1:02d}"
+        )
+        conditions.append("taken_at >= ? AND taken_at < ?")
+        params.extend([month, next_month])
+    if min_width:
+        conditions.append("width >= ?")
+        params.append(min_width)
+    if min_height:
+        conditions.append("height >= ?")
+        params.append(min_height)
+    if orientation == "landscape":
+        conditions.append("width > height")
+    elif orientation == "portrait":
+        conditions.append("width < height")
+    elif orientation == "square":
+        conditions.append("width = height")
+
+    direction = "DESC" if order == "desc" else "ASC"
+    sql = (
+        "SELECT path, size, taken_at, date_source, width, height, camera, has_gps"
+        " FROM photos"
+        + (" WHERE " + " AND ".join(conditions) if conditions else "")
+        + f" ORDER BY taken_at {direction}, path {direction} LIMIT ?"
+    )
+    rows = get_photo_db().execute(sql, (*params, limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    photos = [
+        {
+            "filename": os.path.basename(path),
+            "path": path,
+            "size": size,
+            "taken_at": taken_at,
+            "date_source": date_source,
+            "width": width,
+            "height": height,
+            "camera": camera,
+            "has_gps": bool(has_gps),
+            "thumbnail_url": f"/api/thumbnail/{path}",
+        }
+        for path, size, taken_at, date_source, width, height, camera, has_gps in rows
+    ]
+    return {
+        "photos": photos,
+        "next_cursor": (
+            encode_photo_cursor(rows[-1][2], rows[-1][0]) if has_more else None
+        ),
+        "has_more": has_more,
+    }
+
+
+@app.get("/api/photos/months", tags=["Photos"])
+def list_photo_months(
+    _: str = Depends(verify_api_key), __: None = Depends(check_rate_limit)
+):
+    """Photo counts per capture month, newest first, for timeline navigation"""
+    rows = get_photo_db().execute(
+        "SELECT substr(taken_at, 1, 7) AS month, COUNT(*) FROM photos"
+        " GROUP BY month ORDER BY month DESC"
+    )
+    return {"months": [{"month": month, "count": count} for month, count in rows]}
+
+
+@app.get("/api/photos/similar/{file_path:path}", tags=["Photos"])
+def find_similar_photos(
+    file_path: str,
+    max_distance: int = Query(10, ge=0, le=32),
+    limit: int = 50,
+    _: str = Depends(verify_api_key),
+    __: None = Depends(check_rate_limit),
+):
+    """Near-duplicates of a photo (resized, re-encoded or lightly edited copies)
+
+    Compares 64-bit perceptual hashes; max_distance is the number of differing
+    bits allowed (0-4 near-identical, around 10 still visually the same).
+    """
+    settings = get_settings()
+    full_path = validate_path_security(settings.BASE_DIR / file_path, settings.BASE_DIR)
+    stat = stat_path(full_path)
+    if stat is None or not stat_module.S_ISREG(stat.st_mode):
+        raise HTTPException(status_code=404, detail="File not found")
+    if full_path.suffix.lower() not in IMAGE_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="File is not an image")
+
+    relative_path = str(full_path.relative_to(settings.BASE_DIR))
+    conn = get_photo_db()
+    row = conn.execute(
+        "SELECT phash FROM photos WHERE path = ?", (relative_path,)
+    ).fetchone()
+    if row and row[0] is not None:
+        value = row[0] & 0xFFFFFFFFFFFFFFFF
+    else:
+        # Not indexed yet; hash it on the spot
+        try:
+            value = read_photo_metadata(full_path, stat)["phash"]
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Cannot read image: {e}")
+
+    started = time.perf_counter()
+    matches = [
+        (distance, path)
+        for distance, path in perceptual_hash_index.search(value, max_distance)
+        if path != relative_path
+    ][: max(1, min(limit, 500))]
+    search_ms = (time.perf_counter() - started) * 1000
+
+    details = {}
+    if matches:
+        paths = [path for _, path in matches]
+        details = {
+            path: {"size": size, "width": width, "height": height, "taken_at": taken}
+            for path, size, width, height, taken in conn.execute(
+                "SELECT path, size, width, height, taken_at FROM photos"
+                f" WHERE path IN ({','.join('?' * len(paths))})",
+                paths,
+            )
+        }
+
+    return {
+        "path": relative_path,
+        "phash": f"{value:016x}",
+        "engine": perceptual_hash_index.engine,
+        "search_ms": round(search_ms, 3),
+        "matches": [
+            {
+                "path": path,
+                "distance": distance,
+                **details.get(path, {}),
+                "thumbnail_url": f"/api/thumbnail/{path}",
+            }
+            for distance, path in matches
+        ],
+    }
+
+
 # ============================================================================
 # ERROR HANDLERS
 # ============================================================================
@@ -1041,8 +7806,9 @@ async def http_exception_handler(request: Request, exc: HTTPException):
             "error": True,
             "status_code": exc.status_code,
             "message": exc.detail,
-            "timestamp": datetime.datetime.utcnow().isoformat(),
+            "timestamp": datetime.utcnow().isoformat(),
         },
+        headers=exc.headers,
     )
 
 
@@ -1061,11 +7827,14 @@ async def general_exception_handler(request: Request, exc: Exception):
             "error": True,
             "status_code": 500,
             "message": "Internal server error",
-            "timestamp": datetime.datetime.utcnow().isoformat(),
+            "timestamp": datetime.utcnow().isoformat(),
         },
     )
 
 
+startup_timing["import_ms"] = _elapsed_ms(_import_started)
+
+
 # ============================================================================
 # MAIN (for local development)
 # ============================================================================
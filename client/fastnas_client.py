@@ -0,0 +1,692 @@
+#!/usr/bin/env python3
+"""
+Personal FastNAS - Command-line client
+
+Parallel transfers against the v2 API, so a single big file can use the
+whole link instead of one TCP connection:
+
+    get   download a file as parallel Range segments
+    put   upload a file as parallel chunks (chunked upload session)
+    sync  push or pull a folder recursively, skipping unchanged files
+
+Only the standard library is used. Connections are kept alive and reused,
+one per worker thread.
+
+Usage:
+    export FASTNAS_URL=http://100.64.0.1:8000
+    export FASTNAS_API_KEY=your-api-key
+    python fastnas_client.py -j 8 get Videos/trip.mp4 ./trip.mp4
+    python fastnas_client.py put ./backup.zip Backups/backup.zip --overwrite
+    python fastnas_client.py sync push ./Photos Photos
+"""
+
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import posixpath
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import quote, urlencode, urlsplit
+
+MB = 1024 * 1024
+READ_SIZE = 1 * MB
+SYNC_CACHE_NAME = ".fastnas-sync.json"
+
+
+class FastNASError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+def format_bytes(size: float) -> str:
+    """Human-readable size"""
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if size < 1024.0:
+            return f"{size:.2f} {unit}"
+        size /= 1024.0
+    return f"{size:.2f} PB"
+
+
+# ============================================================================
+# THROUGHPUT REPORTING
+# ============================================================================
+
+
+class TransferStats:
+    """Byte counter shared by all workers, with a live progress line"""
+
+    def __init__(self, label: str, connections: int, quiet: bool = False):
+        self.label = label
+        self.connections = connections
+        self.quiet = quiet or not sys.stderr.isatty()
+        self.bytes = 0
+        self.files = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def add(self, n: int):
+        with self._lock:
+            self.bytes += n
+
+    def finished(self, ok: bool):
+        with self._lock:
+            if ok:
+                self.files += 1
+            else:
+                self.failed += 1
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        if not self.quiet:
+            threading.Thread(target=self._progress, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.monotonic() - self.started
+        self._done.set()
+        if not self.quiet:
+            sys.stderr.write("\r\033[K")
+        if exc_type is None:
+            self.report()
+
+    def _progress(self):
+        last_bytes, last_time = 0, self.started
+        while not self._done.wait(0.5):
+            now = time.monotonic()
+            rate = (self.bytes - last_bytes) / (now - last_time)
+            last_bytes, last_time = self.bytes, now
+            sys.stderr.write(
+                f"\r\033[K{self.label}: {format_bytes(self.bytes)}"
+                f" at {format_bytes(rate)}/s"
+            )
+            sys.stderr.flush()
+
+    def report(self):
+        rate = self.bytes / self.elapsed if self.elapsed else 0.0
+        line = (
+            f"{self.label}: {format_bytes(self.bytes)} in {self.elapsed:.1f}s"
+            f" = {format_bytes(rate)}/s ({rate * 8 / 1e6:.1f} Mbit/s)"
+            f" over {self.connections} connections"
+        )
+        if self.files:
+            line += f", {self.files} files"
+        if self.failed:
+            line += f", {self.failed} failed"
+        print(line)
+
+
+# ============================================================================
+# HTTP CLIENT
+# ============================================================================
+
+
+class FastNASClient:
+    """Thread-safe API client keeping one keep-alive connection per thread"""
+
+    RETRIES = 4
+
+    def __init__(self, url: str, api_key: str = "", connections: int = 8):
+        parts = urlsplit(url if "://" in url else f"http://{url}")
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.api_key = api_key
+        self.connections = connections
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = (
+                http.client.HTTPSConnection
+                if self.https
+                else http.client.HTTPConnection
+            )
+            conn = cls(self.host, self.port, timeout=60, blocksize=READ_SIZE)
+            self._local.conn = conn
+        return conn
+
+    def _reset_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def request(self, method, path, params=None, body=None, headers=None):
+        """Send a request and return the response with its body unread
+
+        The caller must read the body to the end (or close the response)
+        before the next request on this thread. body may be bytes or a
+        zero-argument callable returning a fresh file object, so the request
+        can be retried after a dropped connection.
+        """
+        url = path + (f"?{urlencode(params)}" if params else "")
+        headers = dict(headers or {})
+        if self.api_key:
+            headers["X-API-Key"] = self.api_key
+
+        for attempt in range(self.RETRIES + 1):
+            conn = self._connection()
+            payload = body() if callable(body) else body
+            try:
+                conn.request(method, url, body=payload, headers=headers)
+                response = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                # Keep-alive connection closed by the server, or a network blip
+                self._reset_connection()
+                if attempt == self.RETRIES:
+                    raise
+                time.sleep(0.5 * 2**attempt)
+                continue
+            finally:
+                if callable(body) and payload is not None:
+                    payload.close()
+
+            if response.status in (429, 503) and attempt < self.RETRIES:
+                response.read()
+                retry_after = response.getheader("Retry-After")
+                time.sleep(float(retry_after) if retry_after else 5.0 * 2**attempt)
+                continue
+            if response.status >= 400:
+                raw = response.read()
+                try:
+                    data = json.loads(raw)
+                    message = data.get("message") or data.get("detail") or raw
+                except ValueError:
+                    message = raw.decode("utf-8", "replace")
+                raise FastNASError(response.status, str(message))
+            return response
+
+    def json(self, method, path, params=None, body=None, headers=None):
+        response = self.request(method, path, params, body, headers)
+        return json.loads(response.read())
+
+    # ------------------------------------------------------------------------
+    # Downloads
+    # ------------------------------------------------------------------------
+
+    def download(
+        self,
+        remote: str,
+        local: str,
+        stats: TransferStats,
+        via_stream: bool = False,
+        min_segment: int = 4 * MB,
+    ) -> int:
+        """Download remote to local in parallel Range segments; returns size
+
+        The first request fetches one segment and learns the size and ETag;
+        the rest is split across the connections, each request guarded by
+        If-Range so a file changing mid-transfer is detected.
+        """
+        if via_stream:
+            path, params = f"/api/stream/{quote(remote)}", None
+        else:
+            path, params = "/api/download", {"path": remote}
+
+        part = f"{local}.part"
+        os.makedirs(os.path.dirname(os.path.abspath(local)), exist_ok=True)
+        try:
+            response = self.request(
+                "GET", path, params, headers={"Range": f"bytes=0-{min_segment - 1}"}
+            )
+        except FastNASError as e:
+            if e.status != 416:
+                raise
+            # An empty file has no byte 0 to range over (416 bytes */0)
+            response = self.request("GET", path, params)
+        last_modified = response.getheader("Last-Modified")
+
+        with open(part, "wb") as f:
+            if response.status != 206:
+                # No range support for this file (e.g. stored compressed)
+                size = self._copy_body(response, f, stats)
+            else:
+                size = int(response.getheader("Content-Range").rsplit("/", 1)[1])
+                etag = response.getheader("ETag")
+                f.truncate(size)
+                self._copy_body(response, f, stats)
+
+                start = min(min_segment, size)
+                remaining = size - start
+                count = max(1, min(self.connections, remaining // min_segment))
+                step = max(1, -(-remaining // count))
+                segments = [
+                    (offset, min(offset + step, size) - 1)
+                    for offset in range(start, size, step)
+                ]
+
+                def fetch(segment):
+                    with open(part, "r+b") as out:
+                        out.seek(segment[0])
+                        segment_response = self.request(
+                            "GET",
+                            path,
+                            params,
+                            headers={
+                                "Range": f"bytes={segment[0]}-{segment[1]}",
+                                "If-Range": etag,
+                            },
+                        )
+                        if segment_response.status != 206:
+                            segment_response.close()
+                            self._reset_connection()
+                            raise FastNASError(
+                                segment_response.status,
+                                f"{remote} changed during download",
+                            )
+                        self._copy_body(segment_response, out, stats)
+
+                with ThreadPoolExecutor(self.connections) as pool:
+                    for _ in pool.map(fetch, segments):
+                        pass
+
+        os.replace(part, local)
+        if last_modified:
+            mtime = parsedate_to_datetime(last_modified).timestamp()
+            os.utime(local, (mtime, mtime))
+        return size
+
+    @staticmethod
+    def _copy_body(response, f, stats: TransferStats) -> int:
+        copied = 0
+        while True:
+            chunk = response.read(READ_SIZE)
+            if not chunk:
+                return copied
+            f.write(chunk)
+            copied += len(chunk)
+            stats.add(len(chunk))
+
+    # ------------------------------------------------------------------------
+    # Uploads
+    # ------------------------------------------------------------------------
+
+    def upload(
+        self,
+        local: str,
+        remote: str,
+        stats: TransferStats,
+        overwrite: bool = False,
+        chunk_size: int = 16 * MB,
+    ) -> dict:
+        """Upload local to remote; files above chunk_size go up in parallel"""
+        size = os.path.getsize(local)
+        if size <= chunk_size:
+            result = self.json(
+                "PUT",
+                f"/api/files/{quote(remote)}",
+                {"overwrite": str(overwrite).lower()},
+                body=lambda: open(local, "rb"),
+                headers={"Content-Length": str(size)},
+            )
+            stats.add(size)
+            return result
+
+        session = self.json(
+            "POST",
+            "/api/uploads/sessions",
+            {"path": remote, "size": size, "overwrite": str(overwrite).lower()},
+        )
+        upload_id = session["upload_id"]
+
+        def send(offset):
+            with open(local, "rb") as f:
+                f.seek(offset)
+                data = f.read(chunk_size)
+            self.request(
+                "PUT",
+                f"/api/uploads/sessions/{upload_id}",
+                {"offset": offset},
+                body=data,
+                headers={"Content-Length": str(len(data))},
+            ).read()
+            stats.add(len(data))
+
+        try:
+            with ThreadPoolExecutor(self.connections + 1) as pool:
+                # Hash locally while the chunks are in flight
+                checksum = pool.submit(sha256_of_file, local)
+                for _ in pool.map(send, range(0, size, chunk_size)):
+                    pass
+                return self.json(
+                    "POST",
+                    f"/api/uploads/sessions/{upload_id}/complete",
+                    {
+                        "overwrite": str(overwrite).lower(),
+                        "sha256": checksum.result(),
+                    },
+                )
+        except BaseException:
+            try:
+                self.request("DELETE", f"/api/uploads/sessions/{upload_id}").read()
+            except (FastNASError, OSError, http.client.HTTPException):
+                pass
+            raise
+
+    # ------------------------------------------------------------------------
+    # Remote tree
+    # ------------------------------------------------------------------------
+
+    def list_tree(self, remote_dir: str, folders: Optional[set] = None) -> dict:
+        """{relative_path: (size, mtime)} for every file below remote_dir
+
+        Remote paths of the folders visited are added to folders if given.
+        """
+        files = {}
+        pending = [""]
+        while pending:
+            relative_dir = pending.pop()
+            folder = remote_path_join(remote_dir, relative_dir)
+            listing = self.json(
+                "GET", "/api/files", {"path": folder, "format": "columnar"}
+            )
+            if folders is not None:
+                folders.add(folder)
+            columns = listing["columns"]
+            for name, is_folder, size, mtime in zip(
+                columns["name"], columns["is_folder"], columns["size"], columns["mtime"]
+            ):
+                relative = f"{relative_dir}/{name}" if relative_dir else name
+                if is_folder:
+                    pending.append(relative)
+                else:
+                    files[relative] = (size, mtime)
+        return files
+
+    def ensure_folder(self, remote_dir: str, existing: set):
+        """Create remote_dir and its missing parents"""
+        parts = [p for p in remote_dir.split("/") if p]
+        for i in range(len(parts)):
+            folder = "/".join(parts[: i + 1])
+            if folder in existing:
+                continue
+            try:
+                self.json(
+                    "POST",
+                    "/api/folders/create",
+                    body=json.dumps(
+                        {"folder_path": "/".join(parts[:i]), "folder_name": parts[i]}
+                    ).encode(),
+                    headers={"Content-Type": "application/json"},
+                )
+            except FastNASError as e:
+                if e.status != 400:  # 400: already exists
+                    raise
+            existing.add(folder)
+
+
+def remote_path_join(*parts: str) -> str:
+    return "/".join(part.strip("/") for part in parts if part.strip("/"))
+
+
+def sha256_of_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+# ============================================================================
+# FOLDER SYNC
+# ============================================================================
+
+
+class SyncCache:
+    """Per-folder record of what the last sync saw on both sides
+
+    Keyed by relative path: local size/mtime_ns and SHA-256, plus the remote
+    size/mtime. Local files whose size and mtime are unchanged are not
+    re-hashed; files touched but unchanged in content are not re-sent.
+    """
+
+    def __init__(self, local_dir: str):
+        self.path = os.path.join(local_dir, SYNC_CACHE_NAME)
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.files = json.load(f)["files"]
+        except (OSError, ValueError, KeyError):
+            self.files = {}
+
+    def local_checksum(self, relative: str, full_path: str, stat) -> str:
+        entry = self.files.get(relative)
+        if (
+            entry
+            and entry.get("sha256")
+            and (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns)
+        ):
+            return entry["sha256"]
+        return sha256_of_file(full_path)
+
+    def record(self, relative: str, stat, sha256, remote):
+        self.files[relative] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256,
+            "remote": list(remote) if remote else None,
+        }
+
+    def save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f)
+        os.replace(tmp, self.path)
+
+
+def walk_local(local_dir: str) -> dict:
+    """{relative_path (with /): full_path} for every file below local_dir"""
+    files = {}
+    for root, _, names in os.walk(local_dir):
+        for name in names:
+            full_path = os.path.join(root, name)
+            relative = os.path.relpath(full_path, local_dir).replace(os.sep, "/")
+            if relative != SYNC_CACHE_NAME and not name.endswith(".part"):
+                files[relative] = full_path
+    return files
+
+
+def run_transfers(client, jobs, transfer, stats, chunk_size):
+    """Small files in parallel (one connection each), then big files one at
+    a time with their segments/chunks spread over all connections"""
+    small = [job for job in jobs if job[1] <= chunk_size]
+    large = [job for job in jobs if job[1] > chunk_size]
+
+    def run(job):
+        try:
+            transfer(job[0])
+            stats.finished(True)
+        except (FastNASError, OSError, http.client.HTTPException) as e:
+            stats.finished(False)
+            clear = "" if stats.quiet else "\r\033[K"
+            print(f"{clear}failed: {job[0]}: {e}", file=sys.stderr)
+
+    with ThreadPoolExecutor(client.connections) as pool:
+        for _ in pool.map(run, small):
+            pass
+    for job in large:
+        run(job)
+
+
+def sync_push(client, local_dir, remote_dir, stats, chunk_size):
+    cache = SyncCache(local_dir)
+    remote_folders = set()
+    try:
+        remote_files = client.list_tree(remote_dir, remote_folders)
+    except FastNASError as e:
+        if e.status != 404:
+            raise
+        remote_files = {}  # Created below
+    local_files = walk_local(local_dir)
+    checksums = {}
+    jobs = []
+
+    for relative, full_path in sorted(local_files.items()):
+        stat = os.stat(full_path)
+        entry = cache.files.get(relative)
+        checksum = cache.local_checksum(relative, full_path, stat)
+        checksums[relative] = checksum
+        remote = remote_files.get(relative)
+        unchanged = (
+            entry is not None
+            and entry.get("sha256") == checksum
+            and remote is not None
+            and entry.get("remote") == list(remote)
+        )
+        if unchanged:
+            cache.record(relative, stat, checksum, remote)
+        else:
+            jobs.append((relative, stat.st_size))
+
+    for folder in sorted({posixpath.dirname(relative) for relative, _ in jobs}):
+        client.ensure_folder(remote_path_join(remote_dir, folder), remote_folders)
+
+    def push(relative):
+        remote_path = remote_path_join(remote_dir, relative)
+        client.upload(
+            local_files[relative],
+            remote_path,
+            stats,
+            overwrite=True,
+            chunk_size=chunk_size,
+        )
+
+    run_transfers(client, jobs, push, stats, chunk_size)
+
+    # Remote mtimes are only known after the upload
+    if jobs:
+        remote_files = client.list_tree(remote_dir)
+    for relative, _ in jobs:
+        if relative in remote_files:
+            stat = os.stat(local_files[relative])
+            cache.record(relative, stat, checksums[relative], remote_files[relative])
+    cache.save()
+
+
+def sync_pull(client, local_dir, remote_dir, stats, via_stream):
+    cache = SyncCache(local_dir)
+    remote_files = client.list_tree(remote_dir)
+    jobs = []
+
+    for relative, remote in sorted(remote_files.items()):
+        full_path = os.path.join(local_dir, *relative.split("/"))
+        entry = cache.files.get(relative)
+        try:
+            stat = os.stat(full_path)
+        except FileNotFoundError:
+            stat = None
+        unchanged = (
+            stat is not None
+            and entry is not None
+            and entry.get("remote") == list(remote)
+            and (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns)
+        )
+        if not unchanged:
+            jobs.append((relative, remote[0]))
+
+    def pull(relative):
+        full_path = os.path.join(local_dir, *relative.split("/"))
+        remote_path = remote_path_join(remote_dir, relative)
+        client.download(remote_path, full_path, stats, via_stream)
+        cache.record(relative, os.stat(full_path), None, remote_files[relative])
+
+    run_transfers(client, jobs, pull, stats, 16 * MB)
+    cache.save()
+
+
+# ============================================================================
+# COMMAND LINE
+# ============================================================================
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Parallel transfer client for Personal FastNAS"
+    )
+    parser.add_argument(
+        "--server",
+        default=os.getenv("FASTNAS_URL", "http://localhost:8000"),
+        help="Server URL (default: $FASTNAS_URL)",
+    )
+    parser.add_argument(
+        "--api-key",
+        default=os.getenv("FASTNAS_API_KEY", ""),
+        help="API key (default: $FASTNAS_API_KEY)",
+    )
+    parser.add_argument(
+        "-j", "--connections", type=int, default=8, help="Parallel connections"
+    )
+    parser.add_argument(
+        "--chunk-mb", type=int, default=16, help="Upload chunk size in MB"
+    )
+    parser.add_argument("-q", "--quiet", action="store_true", help="No progress line")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    get = commands.add_parser("get", help="Download a file")
+    get.add_argument("remote")
+    get.add_argument("local", nargs="?")
+    get.add_argument(
+        "--stream", action="store_true", help="Use /api/stream (videos only)"
+    )
+
+    put = commands.add_parser("put", help="Upload a file")
+    put.add_argument("local")
+    put.add_argument("remote", nargs="?")
+    put.add_argument("--overwrite", action="store_true")
+
+    sync = commands.add_parser("sync", help="Sync a folder")
+    sync.add_argument("direction", choices=["push", "pull"])
+    sync.add_argument("local_dir")
+    sync.add_argument("remote_dir", nargs="?", default="")
+    sync.add_argument("--stream", action="store_true", help="Pull through /api/stream")
+
+    args = parser.parse_args(argv)
+    client = FastNASClient(args.server, args.api_key, args.connections)
+    chunk_size = args.chunk_mb * MB
+
+    try:
+        if args.command == "get":
+            local = args.local or os.path.basename(args.remote)
+            with TransferStats("download", args.connections, args.quiet) as stats:
+                client.download(args.remote, local, stats, args.stream)
+        elif args.command == "put":
+            remote = args.remote or os.path.basename(args.local)
+            with TransferStats("upload", args.connections, args.quiet) as stats:
+                result = client.upload(
+                    args.local, remote, stats, args.overwrite, chunk_size
+                )
+            print(f"{result['path']}  sha256 {result['checksum']}")
+        else:
+            os.makedirs(args.local_dir, exist_ok=True)
+            label = "sync " + args.direction
+            with TransferStats(label, args.connections, args.quiet) as stats:
+                if args.direction == "push":
+                    sync_push(
+                        client, args.local_dir, args.remote_dir, stats, chunk_size
+                    )
+                else:
+                    sync_pull(
+                        client, args.local_dir, args.remote_dir, stats, args.stream
+                    )
+            if stats.failed:
+                return 1
+    except (FastNASError, OSError, http.client.HTTPException) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())